@@ -0,0 +1,287 @@
+"""
+Cold start benchmark of the WSGI application (lorisattack.wsgi), as paid by each new zappa (lambda) container
+
+Each run starts a new interpreter which times the startup phases up to the first response:
+
+    settings      load of the settings module (DJANGO_SETTINGS_MODULE)
+    apps          django.setup(), with a per-app breakdown of app config creation, models import and ready()
+    storages      django-storages default storage backend setup
+    wsgi          lorisattack.wsgi import (WSGI handler and middleware loading)
+    urlconf       URLconf import and resolver population
+    first_request first request served by the application
+    (second_request is also recorded for comparison with a warm request)
+
+Usage (from the directory containing manage.py):
+
+    python -m lorisattack.coldstart --runs 10 --output coldstart.json [--baseline previous-coldstart.json]
+
+> Results (and comparison with the given baseline) are written as JSON,
+> the exit status is 1 if a phase median regressed by more than --max-regression
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+BENCHMARK_SETTINGS_MODULE = 'lorisattack.settings.benchmark'
+PHASES = (
+    'settings',
+    'apps',
+    'storages',
+    'wsgi',
+    'urlconf',
+    'first_request',
+)
+DEFAULT_RUNS = 10
+DEFAULT_PATH = '/'
+DEFAULT_MAX_REGRESSION = 0.2
+# phase regressions smaller than this are considered noise
+REGRESSION_MIN_DELTA_SECONDS = 0.005
+
+
+def _timed(func: Callable, *args: Any, **kwargs: Any) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _record_app_timings(app_timings: Dict[str, Dict[str, float]]) -> None:
+    """Wrap the AppConfig methods called by django.setup() to record the time spent per app (create, import_models, ready)"""
+    from django.apps import AppConfig
+
+    def timed(name: str, method: Callable, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            app_timings.setdefault(name, {})[method.__name__] = time.perf_counter() - start
+
+    create = AppConfig.create.__func__
+    import_models = AppConfig.import_models
+
+    def timed_create(cls: type, entry: str) -> AppConfig:
+        start = time.perf_counter()
+        app_config = create(cls, entry)
+        app_timings.setdefault(app_config.name, {})['create'] = time.perf_counter() - start
+        # ready() is commonly overridden by the AppConfig subclasses, wrap it on the instance
+        ready = app_config.ready
+        app_config.ready = lambda: timed(app_config.name, ready)
+        return app_config
+
+    AppConfig.create = classmethod(timed_create)
+    AppConfig.import_models = lambda self: timed(self.name, import_models, self)
+
+
+def measure_cold_start(path: str = DEFAULT_PATH) -> dict:
+    """
+    Time the startup phases of the WSGI application in the current (new) interpreter, see module docstring
+    Returns the {PHASE: SECONDS} timings with the per-app breakdown and the response status of the first request.
+    """
+    started_epoch = time.time()
+    from wsgiref.util import setup_testing_defaults
+
+    timings = {}
+    app_timings = {}  # type: Dict[str, Dict[str, float]]
+
+    def load_settings() -> None:
+        from django.conf import settings
+        settings.INSTALLED_APPS
+
+    timings['settings'] = _timed(load_settings)
+
+    _record_app_timings(app_timings)
+    import django
+    timings['apps'] = _timed(django.setup, set_prefix=False)
+
+    def setup_storages() -> None:
+        from django.core.files.storage import default_storage
+        default_storage._setup()
+
+    timings['storages'] = _timed(setup_storages)
+
+    def import_wsgi() -> None:
+        import lorisattack.wsgi  # noqa: F401
+
+    timings['wsgi'] = _timed(import_wsgi)
+
+    def load_urlconf() -> None:
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+        get_resolver()._populate()
+
+    timings['urlconf'] = _timed(load_urlconf)
+
+    from lorisattack.wsgi import application
+    statuses = []
+
+    def request() -> None:
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+        setup_testing_defaults(environ)
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+
+    timings['first_request'] = _timed(request)
+    second_request_seconds = _timed(request)
+    return {
+        'started_epoch': started_epoch,
+        'timings': timings,
+        'total_seconds': sum(timings.values()),
+        'second_request_seconds': second_request_seconds,
+        'apps': app_timings,
+        'status': statuses[0],
+    }
+
+
+def run_cold_start(settings_module: str = BENCHMARK_SETTINGS_MODULE, path: str = DEFAULT_PATH) -> dict:
+    """
+    Measure a single cold start in a new interpreter
+    'process_seconds' is the wall time of the measuring process (from spawn to exit)
+    and 'interpreter_seconds' the interpreter startup time before measurement started.
+    """
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings_module
+    project_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started_epoch = time.time()
+    result = subprocess.run(
+        [sys.executable, '-m', 'lorisattack.coldstart', '--measure', '--path', path],
+        cwd=project_directory,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    process_seconds = time.time() - started_epoch
+    if result.returncode != 0:
+        raise RuntimeError(f'Cold start measurement failed: {result.stderr.decode("utf8")}')
+    measurement = json.loads(result.stdout.decode('utf8').strip().splitlines()[-1])
+    measurement['interpreter_seconds'] = measurement.pop('started_epoch') - started_epoch
+    measurement['process_seconds'] = process_seconds
+    return measurement
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        'min': min(values),
+        'median': statistics.median(values),
+        'max': max(values),
+    }
+
+
+def summarize_runs(runs: List[dict]) -> dict:
+    """Summarize the (min, median, max) seconds of each phase and app over the given runs"""
+    phases = {phase: _summarize([run['timings'][phase] for run in runs]) for phase in PHASES}
+    for key in ('total_seconds', 'second_request_seconds', 'interpreter_seconds', 'process_seconds'):
+        phases[key] = _summarize([run[key] for run in runs])
+    app_names = sorted(set(name for run in runs for name in run['apps']))
+    apps = {
+        name: _summarize([sum(run['apps'].get(name, {}).values()) for run in runs])
+        for name in app_names
+    }
+    return {
+        'phases': phases,
+        'apps': apps,
+        'statuses': sorted(set(run['status'] for run in runs)),
+    }
+
+
+def compare_results(results: dict, baseline: dict, max_regression: float = DEFAULT_MAX_REGRESSION) -> dict:
+    """
+    Compare the phase medians of results with the baseline results
+    A phase is regressed if its median is more than max_regression (ratio) and REGRESSION_MIN_DELTA_SECONDS slower.
+    """
+    comparison = {}
+    for phase, summary in results['summary']['phases'].items():
+        baseline_summary = baseline['summary']['phases'].get(phase)
+        if not baseline_summary:
+            continue
+        delta_seconds = summary['median'] - baseline_summary['median']
+        ratio = delta_seconds / baseline_summary['median'] if baseline_summary['median'] else 0.0
+        comparison[phase] = {
+            'baseline_median': baseline_summary['median'],
+            'median': summary['median'],
+            'delta_seconds': delta_seconds,
+            'ratio': ratio,
+            'is_regressed': ratio > max_regression and delta_seconds > REGRESSION_MIN_DELTA_SECONDS,
+        }
+    return comparison
+
+
+def run_benchmark(runs: int = DEFAULT_RUNS,
+                  settings_module: str = BENCHMARK_SETTINGS_MODULE,
+                  path: str = DEFAULT_PATH,
+                  baseline: Optional[dict] = None,
+                  max_regression: float = DEFAULT_MAX_REGRESSION) -> dict:
+    """Run the cold start measurement runs times, returning the results (compared with the given baseline results)"""
+    import django
+    samples = [run_cold_start(settings_module, path) for _ in range(runs)]
+    results = {
+        'created_datetime': datetime.now(timezone.utc).isoformat(),
+        'settings_module': settings_module,
+        'path': path,
+        'runs': runs,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'summary': summarize_runs(samples),
+        'samples': samples,
+    }
+    if baseline:
+        results['comparison'] = compare_results(results, baseline, max_regression)
+    return results
+
+
+def format_results(results: dict) -> str:
+    lines = [f'Cold start ({results["settings_module"]}, {results["runs"]} runs, GET {results["path"]} -> {results["summary"]["statuses"]}):']
+    comparison = results.get('comparison', {})
+    for phase, summary in results['summary']['phases'].items():
+        line = f'  {phase:24} median {summary["median"] * 1000:8.1f}ms  (min {summary["min"] * 1000:8.1f}ms, max {summary["max"] * 1000:8.1f}ms)'
+        if phase in comparison:
+            phase_comparison = comparison[phase]
+            marker = ' REGRESSED' if phase_comparison['is_regressed'] else ''
+            line += f'  baseline {phase_comparison["baseline_median"] * 1000:8.1f}ms ({phase_comparison["ratio"]:+.1%}){marker}'
+        lines.append(line)
+    lines.append('  apps (django.setup() per app):')
+    apps = sorted(results['summary']['apps'].items(), key=lambda item: item[1]['median'], reverse=True)
+    for name, summary in apps:
+        lines.append(f'    {name:40} median {summary["median"] * 1000:8.1f}ms')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the WSGI application')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Number of cold starts measured')
+    parser.add_argument('--settings', default=BENCHMARK_SETTINGS_MODULE, help='Settings module used by the measured application')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Path of the first request')
+    parser.add_argument('-o', '--output', help='Write results to the given JSON file')
+    parser.add_argument('-b', '--baseline', help='Compare with the results of the given JSON file')
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION, help='Allowed phase median regression (ratio)')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)  # measure in the current process
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure_cold_start(args.path)))
+        return 0
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf8') as baseline_file:
+            baseline = json.load(baseline_file)
+    results = run_benchmark(args.runs, args.settings, args.path, baseline, args.max_regression)
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f'Results written to: {args.output}')
+    if any(phase_comparison['is_regressed'] for phase_comparison in results.get('comparison', {}).values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
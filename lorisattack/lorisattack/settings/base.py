@@ -231,6 +231,9 @@ STATIC_ROOT = '/static/'
 DEFAULT_AWS_STORAGE_BUCKET_NAME = f'lorisattack-staticfiles-dev-{S3_BUCKET_SUFFIX}'
 
 AWS_DEFAULT_ACL = None  # to silence warning
+# files read from storage larger than this are spooled to disk instead of held in memory (django-storages default is 0, no limit)
+DEFAULT_AWS_S3_MAX_MEMORY_SIZE = str(5 * 1024 * 1024)
+AWS_S3_MAX_MEMORY_SIZE = int(os.getenv('AWS_S3_MAX_MEMORY_SIZE', DEFAULT_AWS_S3_MAX_MEMORY_SIZE))
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME', DEFAULT_AWS_STORAGE_BUCKET_NAME)  # django-storages required setting
 S3_STATICFILES_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.{AWS_S3_DOMAIN}'
 AWS_S3_CUSTOM_DOMAIN = S3_STATICFILES_DOMAIN  # django-storages required setting
@@ -240,3 +243,120 @@ STATIC_URL = f'{schema}{S3_STATICFILES_DOMAIN}/'
 MAX_INDEX_NEWSITEMS = int(os.getenv('MAX_INDEX_NEWSITEMS', '6'))
 DEFAULT_NEWS_ITEMS_PER_PAGE = '5'
 NEWS_ITEMS_PER_PAGE = int(os.getenv('NEWS_ITEMS_PER_PAGE', DEFAULT_NEWS_ITEMS_PER_PAGE))
+# rows fetched per database round-trip when streaming NewsItems for NewsPage.instantiate()
+DEFAULT_NEWS_ITERATOR_CHUNK_SIZE = '500'
+NEWS_ITERATOR_CHUNK_SIZE = int(os.getenv('NEWS_ITERATOR_CHUNK_SIZE', DEFAULT_NEWS_ITERATOR_CHUNK_SIZE))
+
+# S3 sync upload engine
+DEFAULT_S3_UPLOAD_MAX_WORKERS = '10'
+S3_UPLOAD_MAX_WORKERS = int(os.getenv('S3_UPLOAD_MAX_WORKERS', DEFAULT_S3_UPLOAD_MAX_WORKERS))
+DEFAULT_S3_UPLOAD_MAX_RETRIES = '3'
+S3_UPLOAD_MAX_RETRIES = int(os.getenv('S3_UPLOAD_MAX_RETRIES', DEFAULT_S3_UPLOAD_MAX_RETRIES))
+DEFAULT_S3_UPLOAD_RETRY_BACKOFF_SECONDS = '0.5'
+S3_UPLOAD_RETRY_BACKOFF_SECONDS = float(os.getenv('S3_UPLOAD_RETRY_BACKOFF_SECONDS', DEFAULT_S3_UPLOAD_RETRY_BACKOFF_SECONDS))
+# shared boto3 S3 client (created on first use): connection pool size (sized for the transfer workers sharing the client),
+# and botocore retry configuration (total attempts, including the initial request)
+DEFAULT_S3_CLIENT_MAX_POOL_CONNECTIONS = '50'
+S3_CLIENT_MAX_POOL_CONNECTIONS = int(os.getenv('S3_CLIENT_MAX_POOL_CONNECTIONS', DEFAULT_S3_CLIENT_MAX_POOL_CONNECTIONS))
+DEFAULT_S3_CLIENT_MAX_ATTEMPTS = '5'
+S3_CLIENT_MAX_ATTEMPTS = int(os.getenv('S3_CLIENT_MAX_ATTEMPTS', DEFAULT_S3_CLIENT_MAX_ATTEMPTS))
+DEFAULT_S3_CLIENT_RETRY_MODE = 'standard'
+S3_CLIENT_RETRY_MODE = os.getenv('S3_CLIENT_RETRY_MODE', DEFAULT_S3_CLIENT_RETRY_MODE)
+# where sites are instantiated on sync: 's3' (upload as produced), 'memory' or 'filesystem' (temporary directory)
+DEFAULT_SYNC_BUILD_SINK = 's3'
+SYNC_BUILD_SINK = os.getenv('SYNC_BUILD_SINK', DEFAULT_SYNC_BUILD_SINK)
+# maximum number of rendered files waiting to be uploaded by the 's3' sink, rendering blocks while the queue is full
+DEFAULT_SYNC_PIPELINE_MAX_PENDING = '32'
+SYNC_PIPELINE_MAX_PENDING = int(os.getenv('SYNC_PIPELINE_MAX_PENDING', DEFAULT_SYNC_PIPELINE_MAX_PENDING))
+# maximum (in-memory) bytes of the files waiting to be uploaded by the 's3' sink, a single larger file is still queued alone
+DEFAULT_SYNC_PIPELINE_MAX_PENDING_BYTES = str(64 * 1024 * 1024)
+SYNC_PIPELINE_MAX_PENDING_BYTES = int(os.getenv('SYNC_PIPELINE_MAX_PENDING_BYTES', DEFAULT_SYNC_PIPELINE_MAX_PENDING_BYTES))
+# copy PageAsset/NewsItem image files stored in AWS_STORAGE_BUCKET_NAME directly to the site bucket with copy_object()
+DEFAULT_S3_SERVER_SIDE_COPY = 'true'
+S3_SERVER_SIDE_COPY = os.getenv('S3_SERVER_SIDE_COPY', DEFAULT_S3_SERVER_SIDE_COPY).lower() == 'true'
+
+# transforms applied to the text of synced files before compression {CONTENT_TYPE: [DOTTED_PATH, ...]} (see staticsites.transforms),
+# results are cached per process by input hash (SYNC_TRANSFORM_CACHE_MAXSIZE entries), set SYNC_MINIFY=false to upload files as authored
+DEFAULT_SYNC_MINIFY = 'true'
+SYNC_MINIFY = os.getenv('SYNC_MINIFY', DEFAULT_SYNC_MINIFY).lower() == 'true'
+SYNC_TRANSFORMS = {
+    'text/html': ['staticsites.transforms.minify_html'],
+    'text/css': ['staticsites.transforms.minify_css'],
+    'application/javascript': ['staticsites.transforms.minify_js'],
+    'text/javascript': ['staticsites.transforms.minify_js'],
+} if SYNC_MINIFY else {}
+DEFAULT_SYNC_TRANSFORM_CACHE_MAXSIZE = '256'
+SYNC_TRANSFORM_CACHE_MAXSIZE = int(os.getenv('SYNC_TRANSFORM_CACHE_MAXSIZE', DEFAULT_SYNC_TRANSFORM_CACHE_MAXSIZE))
+# Content-Encoding of text objects (html, css, js, json, svg, ...) uploaded on sync: 'gzip', 'br' (requires the brotli package) or '' (uncompressed)
+# > S3 serves objects as stored, so browsers that do not accept the encoding are not supported ('br' is only sent by browsers over https)
+DEFAULT_SYNC_CONTENT_ENCODING = 'gzip'
+SYNC_CONTENT_ENCODING = os.getenv('SYNC_CONTENT_ENCODING', DEFAULT_SYNC_CONTENT_ENCODING)
+DEFAULT_SYNC_COMPRESSION_LEVEL = '9'
+SYNC_COMPRESSION_LEVEL = int(os.getenv('SYNC_COMPRESSION_LEVEL', DEFAULT_SYNC_COMPRESSION_LEVEL))
+# Cache-Control of uploaded objects, HTML pages change on each sync and are revalidated sooner than assets
+DEFAULT_SYNC_HTML_CACHE_CONTROL = 'public, max-age=300'
+SYNC_HTML_CACHE_CONTROL = os.getenv('SYNC_HTML_CACHE_CONTROL', DEFAULT_SYNC_HTML_CACHE_CONTROL)
+DEFAULT_SYNC_ASSET_CACHE_CONTROL = 'public, max-age=86400'
+SYNC_ASSET_CACHE_CONTROL = os.getenv('SYNC_ASSET_CACHE_CONTROL', DEFAULT_SYNC_ASSET_CACHE_CONTROL)
+# Cache-Control of content-hashed (fingerprinted) assets, see StaticSite.fingerprint_assets
+DEFAULT_SYNC_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SYNC_IMMUTABLE_CACHE_CONTROL = os.getenv('SYNC_IMMUTABLE_CACHE_CONTROL', DEFAULT_SYNC_IMMUTABLE_CACHE_CONTROL)
+
+# manage.py build_sites: number of sites built at the same time,
+# and the total number of S3 transfer workers shared between the running site builds
+DEFAULT_BUILD_SITES_MAX_CONCURRENT_SITES = '4'
+BUILD_SITES_MAX_CONCURRENT_SITES = int(os.getenv('BUILD_SITES_MAX_CONCURRENT_SITES', DEFAULT_BUILD_SITES_MAX_CONCURRENT_SITES))
+DEFAULT_BUILD_SITES_MAX_TRANSFER_WORKERS = '40'
+BUILD_SITES_MAX_TRANSFER_WORKERS = int(os.getenv('BUILD_SITES_MAX_TRANSFER_WORKERS', DEFAULT_BUILD_SITES_MAX_TRANSFER_WORKERS))
+
+# Backend used to run StaticSite.enqueue_sync() SyncJobs out of band (see staticsites.jobs)
+DEFAULT_SYNC_JOB_BACKEND = 'staticsites.jobs.ThreadSyncJobBackend'
+SYNC_JOB_BACKEND = os.getenv('SYNC_JOB_BACKEND', DEFAULT_SYNC_JOB_BACKEND)
+# minimum interval between SyncJob progress updates written to the database
+DEFAULT_SYNC_JOB_PROGRESS_UPDATE_SECONDS = '1.0'
+SYNC_JOB_PROGRESS_UPDATE_SECONDS = float(os.getenv('SYNC_JOB_PROGRESS_UPDATE_SECONDS', DEFAULT_SYNC_JOB_PROGRESS_UPDATE_SECONDS))
+# sync requests are coalesced into a queued SyncJob, which runs once no further request is made for this period
+DEFAULT_SYNC_JOB_DEBOUNCE_SECONDS = '10.0'
+SYNC_JOB_DEBOUNCE_SECONDS = float(os.getenv('SYNC_JOB_DEBOUNCE_SECONDS', DEFAULT_SYNC_JOB_DEBOUNCE_SECONDS))
+# running SyncJobs started longer ago than this are assumed to have died and no longer block new jobs of the site
+DEFAULT_SYNC_JOB_STALE_SECONDS = '1800'
+SYNC_JOB_STALE_SECONDS = int(os.getenv('SYNC_JOB_STALE_SECONDS', DEFAULT_SYNC_JOB_STALE_SECONDS))
+# interval between checks for queued SyncJobs by `manage.py run_sync_jobs`
+DEFAULT_SYNC_JOB_POLL_SECONDS = '5.0'
+SYNC_JOB_POLL_SECONDS = float(os.getenv('SYNC_JOB_POLL_SECONDS', DEFAULT_SYNC_JOB_POLL_SECONDS))
+
+# Number of compiled IndexPage/NewsPage templates to keep in the process-wide cache
+DEFAULT_TEMPLATE_CACHE_MAXSIZE = '128'
+TEMPLATE_CACHE_MAXSIZE = int(os.getenv('TEMPLATE_CACHE_MAXSIZE', DEFAULT_TEMPLATE_CACHE_MAXSIZE))
+
+# number of processes used to render (and transform) page HTML and CSS/JS assets during site instantiation (1: sequentially, 0: use all cores)
+# > where the process pool cannot be started (AWS Lambda has no /dev/shm), pages are rendered sequentially
+DEFAULT_RENDER_MAX_PROCESSES = '1'
+RENDER_MAX_PROCESSES = int(os.getenv('RENDER_MAX_PROCESSES', DEFAULT_RENDER_MAX_PROCESSES))
+
+# number of pages (and CSS/JS assets) rendered in the current process before the render process pool is started,
+# so that small sites and incremental syncs with few changed pages do not pay the worker startup (django.setup()) cost
+DEFAULT_RENDER_POOL_MIN_PAGES = '16'
+RENDER_POOL_MIN_PAGES = int(os.getenv('RENDER_POOL_MIN_PAGES', DEFAULT_RENDER_POOL_MIN_PAGES))
+
+# NewsItem image derivatives created on sync {DERIVATIVE_NAME: (MAX_WIDTH, MAX_HEIGHT)}, available to templates as newsitem.image_derivatives
+IMAGE_DERIVATIVE_SIZES = {
+    'thumbnail': (320, 320),
+    'medium': (960, 960),
+}
+DEFAULT_IMAGE_DERIVATIVE_QUALITY = '80'
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', DEFAULT_IMAGE_DERIVATIVE_QUALITY))
+# formats NewsItem images (and derivatives) and image PageAssets are transcoded to on sync, in <picture> source preference order
+# (comma separated 'avif' and/or 'webp', formats not supported by the installed Pillow are skipped)
+DEFAULT_IMAGE_TRANSCODE_FORMATS = 'webp'
+IMAGE_TRANSCODE_FORMATS = [f.strip().lower() for f in os.getenv('IMAGE_TRANSCODE_FORMATS', DEFAULT_IMAGE_TRANSCODE_FORMATS).split(',') if f.strip()]
+# number of images resized/transcoded in parallel
+DEFAULT_IMAGE_PROCESSING_MAX_WORKERS = '4'
+IMAGE_PROCESSING_MAX_WORKERS = int(os.getenv('IMAGE_PROCESSING_MAX_WORKERS', DEFAULT_IMAGE_PROCESSING_MAX_WORKERS))
+# storage (DEFAULT_FILE_STORAGE) location of created derivatives, keyed by source image hash and derivative size/quality
+DEFAULT_IMAGE_DERIVATIVE_STORAGE_PREFIX = 'derivatives'
+IMAGE_DERIVATIVE_STORAGE_PREFIX = os.getenv('IMAGE_DERIVATIVE_STORAGE_PREFIX', DEFAULT_IMAGE_DERIVATIVE_STORAGE_PREFIX)
+
+# chunk size used when copying PageAsset/NewsItem image files during site instantiation
+DEFAULT_FILE_COPY_CHUNK_SIZE = str(1024 * 1024)
+FILE_COPY_CHUNK_SIZE = int(os.getenv('FILE_COPY_CHUNK_SIZE', DEFAULT_FILE_COPY_CHUNK_SIZE))
@@ -0,0 +1,15 @@
+from .production import *
+
+# Cold start benchmark (see lorisattack.coldstart)
+# -- production settings with a local sqlite database and a local S3 stand-in (moto/localstack)
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('BENCHMARK_DB_NAME', os.path.join(BASE_DIR, 'benchmark.sqlite3')),
+    }
+}
+
+BOTO3_ENDPOINTS = {
+    's3': os.getenv('S3_ENDPOINT_URL', 'http://localhost:4572'),  # localstack endpoint
+}
+AWS_S3_ENDPOINT_URL = BOTO3_ENDPOINTS['s3']
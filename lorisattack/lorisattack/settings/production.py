@@ -25,3 +25,6 @@ DATABASES = {
 }
 
 DISPLAY_ADMIN_AUTH_FOR_MODELBACKEND = False
+
+# run SyncJobs in a separate lambda invocation, requests are limited by the API Gateway timeout
+SYNC_JOB_BACKEND = os.getenv('SYNC_JOB_BACKEND', 'staticsites.jobs.ZappaSyncJobBackend')
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='newsitem',
+            index=models.Index(fields=['newspage', 'is_published', '-publish_on', '-id'], name='news_newsitem_published_idx'),
+        ),
+    ]
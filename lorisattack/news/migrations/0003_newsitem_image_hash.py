@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0002_newsitem_published_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsitem',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='sha256 of the image content, used to key the created image derivatives', max_length=64),
+        ),
+    ]
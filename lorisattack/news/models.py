@@ -1,17 +1,29 @@
 import logging
 from math import ceil
 from pathlib import Path
-from typing import Generator, List
+from typing import Any, Dict, Generator, List, Optional, Tuple, Union
 
 from django.db import models
 from django.conf import settings
-from django.template import engines
-from django.db.models import QuerySet
+from django.db.models import Q, QuerySet
 from django.core.validators import MinLengthValidator
+from django.core.files.storage import Storage, default_storage
 from django.utils.translation import ugettext_lazy as _
 
 from commons.models import UserCreatedDatetimeModel
 from staticsites.models import IndexPage, StaticPageBase
+from staticsites.dependencies import calculate_dependency_hash
+from staticsites.images import (
+    ORIGINAL_IMAGE_DERIVATIVE,
+    ImageVariant,
+    calculate_image_hash,
+    get_derivative_filename,
+    get_image_variants,
+    prepare_images_derivatives,
+)
+from staticsites.rendering import PageRenderer, render_html
+from staticsites.sinks import BuildSink, as_build_sink
+from staticsites.transfers import get_storage_name_copy
 
 
 logger = logging.getLogger(__name__)
@@ -23,64 +35,142 @@ class NewsPage(StaticPageBase):
         on_delete=models.CASCADE,
     )
 
-    def get_total_pages(self, items_per_page: int = 10) -> int:
-        return ceil(NewsItem.objects.filter(is_published=True).order_by('-publish_on').count() / items_per_page)
-
-    def get_newsitems_pages(self, items_per_page: int = 10) -> Generator[QuerySet, None, None]:
-        qs = NewsItem.objects \
+    def get_published_newsitems(self) -> QuerySet:
+        """
+        Published NewsItems of the page, latest first
+        > ('-publish_on', '-id') ordering matches the NewsItem 'news_newsitem_published_idx' index
+        """
+        return NewsItem.objects \
             .filter(
                 newspage=self,
                 is_published=True,
-            )\
-            .order_by('-publish_on')
+            ) \
+            .order_by('-publish_on', '-id')
 
-        for page_number in range(self.get_total_pages(items_per_page)):
-            offset = items_per_page * page_number
-            yield qs[offset: offset + items_per_page]
+    def get_total_pages(self, items_per_page: int = 10) -> int:
+        return ceil(self.get_published_newsitems().count() / items_per_page)
+
+    def get_newsitems_pages(self, items_per_page: int = 10) -> Generator[QuerySet, None, None]:
+        """
+        Yield (evaluated) QuerySets of published NewsItems for each page
+        Uses keyset pagination on (publish_on, id), so that the cost of each page is independent of its depth
+        """
+        qs = self.get_published_newsitems()
+        cursor = None
+        while True:
+            page_qs = qs
+            if cursor:
+                publish_on, newsitem_id = cursor
+                page_qs = qs.filter(Q(publish_on__lt=publish_on) | Q(publish_on=publish_on, id__lt=newsitem_id))
+            page_qs = page_qs[:items_per_page]
+            page_newsitems = list(page_qs)  # evaluate to populate the QuerySet cache
+            if not page_newsitems:
+                break
+            yield page_qs
+            if len(page_newsitems) < items_per_page:
+                break
+            cursor = (page_newsitems[-1].publish_on, page_newsitems[-1].id)
 
     def get_latest_n_published(self, n: int = 6) -> QuerySet:
-        return NewsItem.objects.filter(is_published=True).order_by('-publish_on')[:n]
+        return self.get_published_newsitems()[:n]
 
-    def instantiate(self, root_directory: Path, items_per_page: int = settings.NEWS_ITEMS_PER_PAGE) -> List[dict]:
+    def iter_published_pages(self,
+                             items_per_page: int = 10,
+                             chunk_size: int = settings.NEWS_ITERATOR_CHUNK_SIZE) -> Generator[List['NewsItem'], None, None]:
         """
-        Create instantiated HTML and images in given root_directory
+        Yield lists of published NewsItems for each page
+        All pages are materialized from a single streamed query (fetched from the database in chunk_size rows)
         """
-        # prepare template
-        django_engine = engines['django']
-        template = django_engine.from_string(self.template)
+        page_newsitems = []
+        for newsitem in self.get_published_newsitems().iterator(chunk_size=chunk_size):
+            page_newsitems.append(newsitem)
+            if len(page_newsitems) == items_per_page:
+                yield page_newsitems
+                page_newsitems = []
+        if page_newsitems:
+            yield page_newsitems
+
+    def get_page_dependency_hash(self,
+                                 page_newsitems: List['NewsItem'],
+                                 items_per_page: int,
+                                 asset_paths: Optional[Dict[str, str]] = None) -> str:
+        """Hash of all inputs used to render a single numbered page (including the fingerprinted asset paths, if any)"""
+        values = [
+            self.template,
+            self.index.newsitems_template_variablename,
+            items_per_page,
+            [(newsitem.id, newsitem.updated_datetime) for newsitem in page_newsitems],
+        ]
+        if asset_paths:
+            values.append(sorted(asset_paths.items()))
+        return calculate_dependency_hash(*values)
 
+    def instantiate(self,
+                    target: Union[Path, BuildSink],
+                    items_per_page: int = settings.NEWS_ITEMS_PER_PAGE,
+                    previous_dependency_hashes: Optional[Dict[str, str]] = None,
+                    storage_copies: Optional[List[dict]] = None,
+                    renderer: Optional[PageRenderer] = None) -> List[dict]:
+        """
+        Create instantiated HTML and images in the given target BuildSink (or root directory)
+
+        Published NewsItems are read in a single pass (see iter_published_pages()),
+        so the number of queries does not depend on the number of pages.
+        If previous_dependency_hashes ({KEY: DEPENDENCY_HASH}) is given,
+        pages whose inputs are unchanged since the previous build are *NOT* rendered (page_data 'is_rendered' is False).
+        If a storage_copies list is given, images stored in an S3 bucket are *NOT* written to the sink,
+        instead their copy definitions are appended to storage_copies (see NewsItem.instantiate_images())
+        If a renderer is given, pages are rendered through it (possibly in parallel, see PageRenderer),
+        otherwise each page is rendered immediately.
+        """
+        sink = as_build_sink(target)
+        newsitems_template_variablename = self.index.newsitems_template_variablename
+        asset_paths = self.get_asset_paths()
+
+        previous_dependency_hashes = previous_dependency_hashes or {}
         result_page_data = []
-        for page_count, page_queryset in enumerate(self.get_newsitems_pages(items_per_page)):
+        for page_count, page_newsitems in enumerate(self.iter_published_pages(items_per_page)):
             page_numbered_filename = str(self.filename.format(page_count))
-            page_newsitems = list(page_queryset)
             relative_filepath = Path(str(self.relative_path), page_numbered_filename)
-            absolute_filepath = root_directory / relative_filepath
-
-            # make directories for target news html file
-            logger.info(f'Writing ({relative_filepath}) to {root_directory} ...')
-            absolute_filepath.parent.mkdir(parents=True, exist_ok=True)
-            with absolute_filepath.open('w', encoding='utf8') as html_out:
-                html = template.render(context={
-                    self.index.newsitems_template_variablename: page_newsitems
-                })
-                html_out.write(html)
-
-            # instantiate newsitem.images to root_directory
-            for newsitem in page_newsitems:
-                image_relative_filepath = Path(str(newsitem.image_relpath), str(newsitem.image.name))
-                image_absolute_filepath = root_directory / image_relative_filepath
-                image_absolute_filepath.parent.mkdir(parents=True, exist_ok=True)
-                logger.info(f'Writing ({image_relative_filepath}) to {root_directory} ...')
-                with newsitem.image.open('rb') as image_out, image_absolute_filepath.open('wb') as image_in:
-                    image_in.write(image_out.read())
-
+            absolute_filepath = sink.get_absolute_filepath(relative_filepath)
+            dependency_hash = self.get_page_dependency_hash(page_newsitems, items_per_page, asset_paths)
+            newsitem_images = [
+                {
+                    'newsitem_id': newsitem.id,
+                    'relative_path': Path(image_relative_filepath),
+                }
+                for newsitem in page_newsitems
+                for image_relative_filepath in newsitem.get_image_relative_filepaths()
+            ]
             page_data = {
                 'relative_path': relative_filepath,
                 'absolute_path': absolute_filepath,
                 'filename': page_numbered_filename,
-                'page_count': page_count
+                'page_count': page_count,
+                'newsitem_images': newsitem_images,
+                'dependency_hash': dependency_hash,
+                'is_rendered': False,
             }
             result_page_data.append(page_data)
+
+            if previous_dependency_hashes.get(str(relative_filepath)) == dependency_hash:
+                logger.info(f'Unchanged, skipping ({relative_filepath}) ...')
+                continue
+
+            logger.info(f'Writing ({relative_filepath}) ...')
+            context = {
+                newsitems_template_variablename: page_newsitems
+            }
+            if renderer is not None:
+                renderer.render(self.id, self.template, context, sink, relative_filepath, asset_paths)
+            else:
+                sink.write_text(relative_filepath, render_html(self.id, self.template, context, asset_paths))
+
+            # instantiate newsitem.images (and their derivatives) to the sink, variants are prepared in parallel
+            image_newsitems = [newsitem for newsitem in page_newsitems if newsitem.image]
+            for newsitem, variant_storage_names in zip(image_newsitems, prepare_newsitems_image_variants(image_newsitems)):
+                newsitem.instantiate_images(sink, storage_copies, variant_storage_names)
+            page_data['is_rendered'] = True
         return result_page_data
 
     def save(self, *args, **kwargs):
@@ -107,6 +197,13 @@ class NewsItem(UserCreatedDatetimeModel):
         max_length=250,
         default='imgs/news'
     )
+    image_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        editable=False,
+        help_text=_('sha256 of the image content, used to key the created image derivatives')
+    )
     title = models.CharField(
         max_length=150,
         help_text=_('News Item Title')
@@ -114,3 +211,105 @@ class NewsItem(UserCreatedDatetimeModel):
     text = models.TextField(
         validators=[MinLengthValidator(limit_value=10)]
     )
+
+    @property
+    def image_relative_filepath(self) -> Path:
+        return Path(str(self.image_relpath), str(self.image.name))
+
+    @property
+    def image_derivatives(self) -> Dict[str, str]:
+        """
+        Relative paths of the image and its derivatives {DERIVATIVE_NAME: RELATIVE_PATH}, for use in templates:
+
+            <img src="{{ newsitem.image_derivatives.thumbnail }}" />
+
+        Transcoded (webp/avif) <picture> sources are available with the staticsites_images 'image_sources' filter.
+        > Where DERIVATIVE_NAME is 'original' or a settings.IMAGE_DERIVATIVE_SIZES name, empty if there is no image
+        """
+        if not self.image:
+            return {}
+        derivatives = {
+            derivative_name: str(self.get_image_derivative_relative_filepath(derivative_name))
+            for derivative_name in settings.IMAGE_DERIVATIVE_SIZES
+        }
+        derivatives[ORIGINAL_IMAGE_DERIVATIVE] = str(self.image_relative_filepath)
+        return derivatives
+
+    def get_image_derivative_relative_filepath(self, derivative_name: str, image_format: Optional[str] = None) -> Path:
+        return Path(str(self.image_relpath), get_derivative_filename(str(self.image.name), derivative_name, image_format))
+
+    def get_image_relative_filepaths(self) -> List[Path]:
+        """Relative paths of the image and all of its variants (derivatives and transcoded images), empty if there is no image"""
+        if not self.image:
+            return []
+        return [self.image_relative_filepath] + [
+            self.get_image_derivative_relative_filepath(derivative_name, image_format)
+            for derivative_name, image_format in get_image_variants(str(self.image.name), settings.IMAGE_DERIVATIVE_SIZES)
+        ]
+
+    def get_image_hash(self) -> str:
+        """Get the image content hash, calculated (and saved) if not yet set"""
+        if not self.image_hash:
+            with self.image.open('rb') as image_in:
+                self.image_hash = calculate_image_hash(image_in)
+            NewsItem.objects.filter(pk=self.pk).update(image_hash=self.image_hash)
+        return self.image_hash
+
+    def load_image_content(self) -> bytes:
+        with self.image.open('rb') as image_in:
+            return image_in.read()
+
+    def instantiate_images(self,
+                           target: Union[Path, BuildSink],
+                           storage_copies: Optional[List[dict]] = None,
+                           variant_storage_names: Optional[Dict[ImageVariant, str]] = None) -> None:
+        """
+        Write the image and its variants to the given target BuildSink (or root directory)
+        variant_storage_names are the storage names of the prepared variants (see prepare_newsitems_image_variants()), prepared if not given.
+        If a storage_copies list is given, files stored in an S3 bucket are *NOT* written to the sink,
+        instead their copy definitions are appended to storage_copies.
+        """
+        if not self.image:
+            return
+        sink = as_build_sink(target)
+        if variant_storage_names is None:
+            variant_storage_names = prepare_newsitems_image_variants([self])[0]
+        # (RELATIVE_FILEPATH, STORAGE, STORAGE_NAME, FILE_HASH), derivatives are keyed by the image hash in their storage name
+        image_files = [(self.image_relative_filepath, self.image.storage, self.image.name, self.get_image_hash())]  # type: List[Tuple[Path, Storage, str, Optional[str]]]
+        for (derivative_name, image_format), storage_name in variant_storage_names.items():
+            image_files.append((self.get_image_derivative_relative_filepath(derivative_name, image_format), default_storage, storage_name, None))
+
+        for relative_filepath, storage, storage_name, file_hash in image_files:
+            if storage_copies is not None:
+                storage_copy = get_storage_name_copy(storage, storage_name, relative_filepath, 'newsitem_image', self.id, file_hash)
+                if storage_copy:
+                    storage_copies.append(storage_copy)
+                    continue
+            logger.info(f'Writing ({relative_filepath}) ...')
+            with storage.open(storage_name, 'rb') as image_in:
+                sink.write_fileobj(relative_filepath, image_in, settings.FILE_COPY_CHUNK_SIZE)
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        # hash new image uploads, so that derivatives are keyed by content
+        if not self.image:
+            self.image_hash = ''
+        elif not self.image._committed or not self.image_hash:
+            self.image.open('rb')
+            self.image_hash = calculate_image_hash(self.image)
+            self.image.seek(0)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['newspage', 'is_published', '-publish_on', '-id'], name='news_newsitem_published_idx'),
+        ]
+
+
+def prepare_newsitems_image_variants(newsitems: List[NewsItem]) -> List[Dict[ImageVariant, str]]:
+    """
+    Prepare the image variants of the given NewsItems (with images) in parallel (see staticsites.images.prepare_images_derivatives())
+    Returns the {(DERIVATIVE_NAME, IMAGE_FORMAT): STORAGE_NAME} of each NewsItem, in the given order
+    """
+    # image hashes are resolved (and saved if missing) before variants are prepared in the worker threads
+    images = [(newsitem.get_image_hash(), str(newsitem.image.name), newsitem.load_image_content) for newsitem in newsitems]
+    return prepare_images_derivatives(images)
@@ -1,5 +1,7 @@
+import hashlib
 from math import ceil
 from pathlib import Path
+from unittest import mock
 from tempfile import TemporaryDirectory
 
 from django.test import TestCase
@@ -8,9 +10,11 @@ from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 import boto3
+from PIL import Image
 
 from accounts.models import Organization, OrganizationUser, OrganizationEmailDomain
 from staticsites.models import StaticSite, IndexPage
+from staticsites.rendering import PageRenderer
 
 from ..models import NewsPage, NewsItem
 
@@ -270,6 +274,76 @@ class NewsPageTestCase(TestCase):
         actual_twodayago_count = len([item for item in actual_latest_newsitems if item.publish_on == two_days_ago])
         self.assertTrue(actual_twodayago_count == expected_twodayago_count)
 
+    def _create_other_newspage(self) -> NewsPage:
+        other_staticsite = StaticSite(
+            organization=self.org,
+            name='other-staticsite',
+            staging_bucket=self.staging_bucket_name,
+            production_bucket=self.production_bucket_name,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        other_staticsite.save()
+        other_indexpage = IndexPage(
+            site=other_staticsite,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        other_indexpage.save()
+        other_newspage = NewsPage(
+            site=other_staticsite,
+            index=other_indexpage,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        other_newspage.save()
+        return other_newspage
+
+    def test_published_queries__scoped_to_newspage(self):
+        one_day_ago = timezone.now() - timezone.timedelta(days=1)
+        other_newspage = self._create_other_newspage()
+        for newspage, count in ((self.newspage, 3), (other_newspage, 12)):
+            for i in range(count):
+                newsitem = NewsItem(
+                    newspage=newspage,
+                    title=f'newsitem({i})',
+                    text='text',
+                    publish_on=one_day_ago,
+                    is_published=True,
+                    created_by=self.system_admin_user,
+                    updated_by=self.system_admin_user,
+                )
+                newsitem.save()
+
+        self.assertEqual(self.newspage.get_total_pages(items_per_page=5), 1)
+        self.assertEqual(other_newspage.get_total_pages(items_per_page=5), 3)
+        latest_newsitems = list(self.newspage.get_latest_n_published(n=6))
+        self.assertEqual(len(latest_newsitems), 3)
+        self.assertTrue(all(newsitem.newspage_id == self.newspage.id for newsitem in latest_newsitems))
+
+    def test_get_newsitems_pages__keyset_order(self):
+        now = timezone.now()
+        expected_ids = []
+        for i in range(13):
+            newsitem = NewsItem(
+                newspage=self.newspage,
+                title=f'newsitem({i})',
+                text='text',
+                publish_on=now - timezone.timedelta(days=i // 3),  # items share publish_on in groups of 3
+                is_published=True,
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            newsitem.save()
+            expected_ids.append(newsitem.id)
+        expected_ids.sort(key=lambda newsitem_id: (-NewsItem.objects.get(id=newsitem_id).publish_on.timestamp(), -newsitem_id))
+
+        items_per_page = 4
+        pages = list(self.newspage.get_newsitems_pages(items_per_page))
+        self.assertEqual(len(pages), self.newspage.get_total_pages(items_per_page))
+        actual_ids = [newsitem.id for page_qs in pages for newsitem in page_qs]
+        self.assertEqual(actual_ids, expected_ids)
+
     def test_instantiate__single_newspage(self):
         one_day_ago = timezone.now() - timezone.timedelta(days=1)
 
@@ -332,6 +406,142 @@ class NewsPageTestCase(TestCase):
                 instantiated_news_absolute_filepath = page_data['absolute_path']
                 self.assertTrue(instantiated_news_absolute_filepath.exists())
 
+    def test_instantiate__query_count(self):
+        one_day_ago = timezone.now() - timezone.timedelta(days=1)
+        for i in range(23):
+            newsitem = NewsItem(
+                newspage=self.newspage,
+                title=f'newsitem({i})',
+                text='text',
+                publish_on=one_day_ago,
+                is_published=True,
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            newsitem.save()
+
+        newspage = NewsPage.objects.get(id=self.newspage.id)
+        with TemporaryDirectory(prefix='news_test_') as tempdir:
+            # NewsPage.index + single NewsItem query, independent of the number of pages
+            with self.assertNumQueries(2):
+                result_page_data = newspage.instantiate(Path(tempdir), items_per_page=2)
+        self.assertEqual(len(result_page_data), 12)
+        self.assertEqual([len(page_data['newsitem_images']) for page_data in result_page_data], [0] * 12)
+
+    def test_instantiate__process_pool_renderer(self):
+        one_day_ago = timezone.now() - timezone.timedelta(days=1)
+        for i in range(9):
+            newsitem = NewsItem(
+                newspage=self.newspage,
+                title=f'newsitem({i})',
+                text='text',
+                publish_on=one_day_ago,
+                is_published=True,
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            newsitem.save()
+
+        with TemporaryDirectory(prefix='news_test_') as sequential_tempdir, TemporaryDirectory(prefix='news_test_') as parallel_tempdir:
+            sequential_page_data = self.newspage.instantiate(Path(sequential_tempdir), items_per_page=2)
+            with PageRenderer(max_processes=2, min_pool_pages=0) as renderer:
+                parallel_page_data = self.newspage.instantiate(Path(parallel_tempdir), items_per_page=2, renderer=renderer)
+
+            self.assertEqual(len(parallel_page_data), 5)
+            self.assertEqual(
+                [(d['relative_path'], d['dependency_hash']) for d in sequential_page_data],
+                [(d['relative_path'], d['dependency_hash']) for d in parallel_page_data]
+            )
+            for page_data in parallel_page_data:
+                self.assertTrue(page_data['is_rendered'])
+                expected_html = (Path(sequential_tempdir) / page_data['relative_path']).read_text(encoding='utf8')
+                actual_html = (Path(parallel_tempdir) / page_data['relative_path']).read_text(encoding='utf8')
+                self.assertEqual(actual_html, expected_html)
+
+    def test_instantiate__previous_dependency_hashes(self):
+        one_day_ago = timezone.now() - timezone.timedelta(days=1)
+
+        # create is_publish items
+        publshed_newsitems_count = 12
+        newsitems = []
+        for i in range(publshed_newsitems_count):
+            newsitem = NewsItem(
+                newspage=self.newspage,
+                title=f'newsitem({i})',
+                text='text',
+                publish_on=one_day_ago - timezone.timedelta(hours=i),
+                is_published=True,
+                image=self._get_dummy_image_file(),
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            newsitem.save()
+            newsitems.append(newsitem)
+
+        items_per_page = 5
+        with TemporaryDirectory(prefix='news_test_') as tempdir:
+            result_page_data = self.newspage.instantiate(Path(tempdir), items_per_page=items_per_page)
+            self.assertTrue(all(page_data['is_rendered'] for page_data in result_page_data))
+        previous_dependency_hashes = {str(page_data['relative_path']): page_data['dependency_hash'] for page_data in result_page_data}
+
+        # update the oldest item, only the last page is affected
+        oldest_newsitem = newsitems[-1]
+        oldest_newsitem.title = 'updated'
+        oldest_newsitem.save()
+        with TemporaryDirectory(prefix='news_test_') as tempdir:
+            result_page_data = self.newspage.instantiate(
+                Path(tempdir),
+                items_per_page=items_per_page,
+                previous_dependency_hashes=previous_dependency_hashes
+            )
+            rendered_filenames = [page_data['filename'] for page_data in result_page_data if page_data['is_rendered']]
+            self.assertEqual(rendered_filenames, ['news_2.html'])
+            self.assertTrue((Path(tempdir) / 'news' / 'news_2.html').exists())
+            self.assertFalse((Path(tempdir) / 'news' / 'news_0.html').exists())
+
+    def test_instantiate__image_derivatives(self):
+        newsitem = NewsItem(
+            newspage=self.newspage,
+            title='newsitem',
+            text='text',
+            publish_on=timezone.now() - timezone.timedelta(days=1),
+            is_published=True,
+            image=self._get_dummy_image_file(),
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        newsitem.save()
+        sample_image_content = (NEWS_FIXTURES_DIRECTORY / 'images' / 'sample-photo.jpeg').read_bytes()
+        self.assertEqual(newsitem.image_hash, hashlib.sha256(sample_image_content).hexdigest())
+
+        image_derivatives = newsitem.image_derivatives
+        self.assertEqual(set(image_derivatives.keys()), set(settings.IMAGE_DERIVATIVE_SIZES.keys()) | {'original'})
+        self.assertEqual(image_derivatives['original'], str(newsitem.image_relative_filepath))
+
+        with TemporaryDirectory(prefix='news_test_') as tempdir:
+            result_page_data = self.newspage.instantiate(Path(tempdir), items_per_page=5)
+            image_relative_paths = set(str(image['relative_path']) for image in result_page_data[0]['newsitem_images'])
+            self.assertEqual(image_relative_paths, set(str(p) for p in newsitem.get_image_relative_filepaths()))
+            self.assertTrue(set(image_derivatives.values()) < image_relative_paths)
+            for image_relative_path in image_relative_paths:
+                self.assertTrue((Path(tempdir) / image_relative_path).exists(), image_relative_path)
+            for derivative_name, (max_width, max_height) in settings.IMAGE_DERIVATIVE_SIZES.items():
+                derivative_filepath = Path(tempdir) / image_derivatives[derivative_name]
+                with Image.open(derivative_filepath) as derivative:
+                    self.assertLessEqual(derivative.width, max_width)
+                    self.assertLessEqual(derivative.height, max_height)
+                self.assertLess(derivative_filepath.stat().st_size, len(sample_image_content))
+            self.assertEqual((Path(tempdir) / image_derivatives['original']).read_bytes(), sample_image_content)
+
+        # derivatives are kept in storage, and not created again for the same image content
+        storage_copies = []
+        with mock.patch('staticsites.images.create_image_derivative') as mock_create_image_derivative:
+            with TemporaryDirectory(prefix='news_test_') as tempdir:
+                self.newspage.instantiate(Path(tempdir), items_per_page=5, storage_copies=storage_copies)
+            mock_create_image_derivative.assert_not_called()
+        self.assertEqual(set(str(c['relative_path']) for c in storage_copies), image_relative_paths)
+        self.assertTrue(all(c['source_bucket'] == settings.AWS_STORAGE_BUCKET_NAME for c in storage_copies))
+
 #    def test_instantiate__multi_newspages(self):
 #        raise NotImplementedError()
 
@@ -1,3 +1,88 @@
 from django.contrib import admin
+from django.http import HttpRequest
+from django.db.models import QuerySet
+from django.utils.translation import ugettext_lazy as _
 
-# Register your models here.
+from commons.admin import UserDatetimeModelAdmin
+from .models import StaticSite, SyncJob
+
+
+@admin.register(StaticSite)
+class StaticSiteAdmin(UserDatetimeModelAdmin):
+    list_display = (
+        'name',
+        'organization',
+        'staging_bucket',
+        'production_bucket',
+        'last_staging_sync_datetime',
+        'last_production_sync_datetime',
+    )
+    actions = (
+        'enqueue_staging_sync',
+        'enqueue_production_sync',
+    )
+
+    def _enqueue_sync(self, request: HttpRequest, queryset: QuerySet, update_production: bool) -> None:
+        jobs = [staticsite.enqueue_sync(request.user, update_production=update_production) for staticsite in queryset]
+        self.message_user(request, f'{len(jobs)} sync jobs queued, see SyncJobs for progress')
+
+    def enqueue_staging_sync(self, request: HttpRequest, queryset: QuerySet) -> None:
+        self._enqueue_sync(request, queryset, update_production=False)
+    enqueue_staging_sync.short_description = _('Sync selected sites to staging (background)')  # type: ignore
+
+    def enqueue_production_sync(self, request: HttpRequest, queryset: QuerySet) -> None:
+        self._enqueue_sync(request, queryset, update_production=True)
+    enqueue_production_sync.short_description = _('Sync selected sites to production (background)')  # type: ignore
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'site',
+        'update_production',
+        'status',
+        'phase',
+        'progress',
+        'coalesced_count',
+        'created_datetime',
+        'run_after',
+        'started_datetime',
+        'finished_datetime',
+        'elapsed',
+    )
+    list_filter = (
+        'status',
+        'update_production',
+    )
+    readonly_fields = (
+        'site',
+        'update_production',
+        'incremental',
+        'delete_stale',
+        'status',
+        'phase',
+        'progress',
+        'error',
+        'build',
+        'coalesced_count',
+        'created_by',
+        'created_datetime',
+        'run_after',
+        'started_datetime',
+        'finished_datetime',
+        'elapsed',
+    )
+
+    def progress(self, obj: SyncJob) -> str:
+        return f'{obj.completed_count}/{obj.total_count}'
+
+    def elapsed(self, obj: SyncJob) -> str:
+        elapsed_seconds = obj.elapsed_seconds
+        if elapsed_seconds is None:
+            return '-'
+        return f'{elapsed_seconds:.1f}s'
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        # jobs are created with the StaticSite sync actions
+        return False
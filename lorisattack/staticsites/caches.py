@@ -0,0 +1,130 @@
+import hashlib
+import threading
+from pathlib import Path
+from html.parser import HTMLParser
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from django.conf import settings
+from django.template import engines
+from django.template.backends.django import Template
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache holding at most `maxsize` entries"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Any], bool]) -> int:
+        """Remove all entries whose key matches the given predicate, returning the number of removed entries"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+TEMPLATE_CACHE = LRUCache(maxsize=settings.TEMPLATE_CACHE_MAXSIZE)
+
+
+def get_template_hash(template_text: str) -> str:
+    return hashlib.sha256(template_text.encode('utf8')).hexdigest()
+
+
+def get_compiled_template(page_id: Optional[int], template_text: str) -> Template:
+    """
+    Get the compiled django template for the given page template text
+    Compiled templates are cached process-wide keyed by (page_id, TEMPLATE_HASH)
+    """
+    key = (page_id, get_template_hash(template_text))
+    template = TEMPLATE_CACHE.get(key)
+    if template is None:
+        django_engine = engines['django']
+        template = django_engine.from_string(template_text)
+        TEMPLATE_CACHE.set(key, template)
+    return template
+
+
+def invalidate_page_templates(page_id: Optional[int]) -> int:
+    """Remove all cached compiled templates for the given page"""
+    return TEMPLATE_CACHE.invalidate(lambda key: key[0] == page_id)
+
+
+class TemplateAssetPathParser(HTMLParser):
+    """
+    Streaming extractor of the relative asset paths referenced by a template:
+
+    - link (href)
+    - script (src)
+    - img (src)
+
+    > Absolute (http/https) urls are excluded
+    """
+    ASSET_ATTRIBUTES = {
+        'link': 'href',
+        'script': 'src',
+        'img': 'src',
+    }
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.relpaths = {tag: [] for tag in self.ASSET_ATTRIBUTES}  # type: Dict[str, List[Path]]
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attribute_name = self.ASSET_ATTRIBUTES.get(tag)
+        if not attribute_name:
+            return
+        value = dict(attrs).get(attribute_name)
+        if value and not value.startswith('http'):
+            self.relpaths[tag].append(Path(value))
+
+    handle_startendtag = handle_starttag
+
+
+def extract_template_relpaths(template_text: str) -> List[Path]:
+    """Extract the relative link, script and img paths referenced by the given template (in that order)"""
+    parser = TemplateAssetPathParser()
+    parser.feed(template_text)
+    parser.close()
+    return [relpath for tag in parser.ASSET_ATTRIBUTES for relpath in parser.relpaths[tag]]
+
+
+TEMPLATE_RELPATHS_CACHE = LRUCache(maxsize=settings.TEMPLATE_CACHE_MAXSIZE)
+
+
+def get_template_relpaths(template_text: str) -> List[Path]:
+    """
+    Get the relative asset paths referenced by the given template text (see extract_template_relpaths())
+    Results are cached process-wide keyed by TEMPLATE_HASH, so changed templates are parsed again
+    """
+    key = get_template_hash(template_text)
+    relpaths = TEMPLATE_RELPATHS_CACHE.get(key)
+    if relpaths is None:
+        relpaths = tuple(extract_template_relpaths(template_text))
+        TEMPLATE_RELPATHS_CACHE.set(key, relpaths)
+    return list(relpaths)
@@ -0,0 +1,65 @@
+import os
+import logging
+import threading
+from typing import Any, Dict, Tuple
+
+from django.conf import settings
+
+import boto3
+from botocore.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+_CLIENTS = {}  # type: Dict[Tuple[int, str], Any]
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client_config() -> Config:
+    """
+    Get the botocore Config used for created clients
+    The connection pool is sized for the S3 transfer workers sharing the client (see settings.S3_CLIENT_MAX_POOL_CONNECTIONS)
+    """
+    return Config(
+        max_pool_connections=settings.S3_CLIENT_MAX_POOL_CONNECTIONS,
+        retries={
+            'total_max_attempts': settings.S3_CLIENT_MAX_ATTEMPTS,
+            'mode': settings.S3_CLIENT_RETRY_MODE,
+        },
+    )
+
+
+def get_client(service_name: str) -> Any:
+    """
+    Get the shared boto3 client for the given service, created on first use
+    Clients are thread-safe and shared by the transfer worker threads of the process.
+
+    > Clients are created per process, so that forked processes do not share the connection pool of the parent
+    """
+    key = (os.getpid(), service_name)
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                logger.debug(f'Creating boto3 {service_name} client ...')
+                # boto3.Session() instances are not thread-safe, use a dedicated session while holding the lock
+                session = boto3.session.Session()
+                client = session.client(
+                    service_name,
+                    endpoint_url=settings.BOTO3_ENDPOINTS.get(service_name),
+                    config=get_client_config(),
+                )
+                _CLIENTS[key] = client
+    return client
+
+
+def get_s3_client() -> Any:
+    """Get the shared S3 client, created on first use (see get_client())"""
+    return get_client('s3')
+
+
+def reset_clients() -> None:
+    """Discard the created clients, so that they are re-created with the current settings on next use"""
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
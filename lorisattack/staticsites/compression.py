@@ -0,0 +1,83 @@
+import gzip
+import logging
+from typing import Optional
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, 'br' falls back to 'gzip'
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_ENCODING_GZIP = 'gzip'
+CONTENT_ENCODING_BROTLI = 'br'
+CONTENT_ENCODINGS = (
+    CONTENT_ENCODING_GZIP,
+    CONTENT_ENCODING_BROTLI,
+)
+
+# text content types that benefit from compression,
+# images (other than svg), pdf and archive types are already compressed and are stored as is
+COMPRESSIBLE_CONTENT_TYPE_PREFIXES = ('text/',)
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/javascript',
+    'application/json',
+    'application/ld+json',
+    'application/manifest+json',
+    'application/xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'application/xhtml+xml',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+)
+HTML_CONTENT_TYPES = (
+    'text/html',
+    'application/xhtml+xml',
+)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """True if content of the given type is compressed on upload (see COMPRESSIBLE_CONTENT_TYPES)"""
+    if not content_type:
+        return False
+    return content_type.startswith(COMPRESSIBLE_CONTENT_TYPE_PREFIXES) or content_type in COMPRESSIBLE_CONTENT_TYPES
+
+
+def get_content_encoding(content_encoding: Optional[str]) -> Optional[str]:
+    """
+    Get the supported Content-Encoding for the given (configured) content_encoding, None if compression is disabled
+    > 'br' falls back to 'gzip' if the brotli package is not installed
+    """
+    content_encoding = (content_encoding or '').strip().lower()
+    if not content_encoding:
+        return None
+    if content_encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f'Unknown content encoding ({content_encoding}), expected one of: {CONTENT_ENCODINGS}')
+    if content_encoding == CONTENT_ENCODING_BROTLI and brotli is None:
+        logger.warning(f'brotli package not installed, using ({CONTENT_ENCODING_GZIP}) content encoding')
+        return CONTENT_ENCODING_GZIP
+    return content_encoding
+
+
+def compress(content: bytes, content_encoding: str) -> bytes:
+    """
+    Compress the given content with the given Content-Encoding ('gzip' or 'br')
+    > Output is deterministic (gzip mtime is fixed), so that unchanged content keeps the same md5 (S3 ETag) between builds
+    """
+    if content_encoding == CONTENT_ENCODING_GZIP:
+        return gzip.compress(content, compresslevel=settings.SYNC_COMPRESSION_LEVEL, mtime=0)
+    elif content_encoding == CONTENT_ENCODING_BROTLI:
+        return brotli.compress(content, mode=brotli.MODE_TEXT)
+    raise ValueError(f'Unknown content encoding: {content_encoding}')
+
+
+def get_cache_control(content_type: Optional[str]) -> str:
+    """Get the Cache-Control of objects of the given content type, where HTML is revalidated sooner than assets"""
+    if content_type in HTML_CONTENT_TYPES:
+        return settings.SYNC_HTML_CACHE_CONTROL
+    return settings.SYNC_ASSET_CACHE_CONTROL
@@ -0,0 +1,12 @@
+import json
+import hashlib
+from typing import Any
+
+
+def calculate_dependency_hash(*values: Any) -> str:
+    """
+    Calculate a stable hex digest of the given (json serializable) values
+    Used to detect if the inputs to a rendered page have changed since the last build
+    """
+    serialized = json.dumps(values, default=str, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf8')).hexdigest()
@@ -0,0 +1,75 @@
+import re
+from pathlib import Path
+from typing import Dict, List, Match, Optional, Tuple
+
+from django.conf import settings
+
+# number of content hash characters included in fingerprinted filenames
+FINGERPRINT_LENGTH = 12
+
+# href/src/srcset attribute values of the rendered HTML,
+# the attribute name must follow whitespace so that other attributes ending in these names (data-src, xlink:href) are not matched
+ASSET_REFERENCE_PATTERN = re.compile(
+    r'''(?P<prefix>(?<=\s)(?:href|src|srcset)\s*=\s*)(?P<quote>["'])(?P<value>[^"']*)(?P=quote)''',
+    re.IGNORECASE
+)
+EXTERNAL_REFERENCE_PREFIXES = ('http', '//', '#', 'data:', 'mailto:')
+
+
+def get_fingerprinted_filename(filename: str, content_hash: str) -> str:
+    """
+    Get the filename including the (truncated) content hash
+    ('style.css', '3f2a9c1b0d4e...') -> 'style.3f2a9c1b0d4e.css'
+    """
+    path = Path(filename)
+    return f'{path.stem}.{content_hash[:FINGERPRINT_LENGTH]}{path.suffix}'
+
+
+def get_asset_targets(relative_filepath: Path, asset_paths: Dict[str, str]) -> List[Tuple[Path, Optional[str]]]:
+    """
+    Get the (TARGET_RELATIVE_FILEPATH, CACHE_CONTROL) pairs an asset is written to, given the fingerprinted asset_paths
+    Fingerprinted assets are cached as immutable, and are also written to their original path
+    (CACHE_CONTROL None, default for the content type), so that references not rewritten (css url(), scripts) still resolve.
+    """
+    fingerprinted_path = asset_paths.get(str(relative_filepath))
+    targets = [(Path(relative_filepath), None)]  # type: List[Tuple[Path, Optional[str]]]
+    if fingerprinted_path:
+        targets.insert(0, (Path(fingerprinted_path), settings.SYNC_IMMUTABLE_CACHE_CONTROL))
+    return targets
+
+
+def _rewrite_path(value: str, asset_paths: Dict[str, str]) -> str:
+    stripped = value.strip()
+    if not stripped or stripped.startswith(EXTERNAL_REFERENCE_PREFIXES):
+        return value
+    return asset_paths.get(str(Path(stripped)), value)
+
+
+def rewrite_asset_references(html: str, asset_paths: Dict[str, str]) -> str:
+    """
+    Rewrite the href, src and srcset references in the given rendered HTML
+    to the fingerprinted asset paths {RELATIVE_PATH: FINGERPRINTED_RELATIVE_PATH}
+
+    > References are matched as extracted by staticsites.caches.get_template_relpaths() (normalized relative paths)
+    """
+    if not asset_paths:
+        return html
+
+    def rewrite(match: Match) -> str:
+        value = match.group('value')
+        if match.group('prefix').lower().startswith('srcset'):
+            # 'URL [DESCRIPTOR], URL [DESCRIPTOR], ...'
+            candidates = []
+            for candidate in value.split(','):
+                parts = candidate.split(maxsplit=1)
+                if parts:
+                    parts[0] = _rewrite_path(parts[0], asset_paths)
+                candidates.append(' '.join(parts))
+            rewritten = ', '.join(candidates)
+        else:
+            rewritten = _rewrite_path(value, asset_paths)
+        if rewritten == value:
+            return match.group(0)
+        return f'{match.group("prefix")}{match.group("quote")}{rewritten}{match.group("quote")}'
+
+    return ASSET_REFERENCE_PATTERN.sub(rewrite, html)
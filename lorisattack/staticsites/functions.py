@@ -1,27 +1,514 @@
-from typing import List
+import time
+import logging
+import mimetypes
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-from .models import StaticSite
+from django.conf import settings
+from django.db import connections, transaction
 
+from .clients import get_s3_client
+from .models import StaticSite, PageAsset, StaticSiteBuild, StaticSiteBuildObject
+from .rendering import PageRenderer, get_render_max_processes
+from .compression import get_cache_control
+from .sinks import BuildFile, BuildSink, as_build_sink, create_build_sink
+from .transfers import (
+    FILE_HASH_METADATA_KEY,
+    copy_objects,
+    head_objects,
+    list_bucket_etags,
+    list_bucket_objects,
+    delete_keys,
+    TransferError,
+)
 
-def instantiate_staticsite(staticsite: StaticSite, directory: Path) -> List[dict]:
-    """Generate staticsites to the target directory"""
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# sync_staticsite() progress phases
+SYNC_PHASE_RENDERING = 'rendering'
+SYNC_PHASE_TRANSFERRING = 'transferring'
+SYNC_PHASE_RECORDING = 'recording'
+
+
+def instantiate_staticsite(staticsite: StaticSite,
+                           target: Union[Path, BuildSink],
+                           previous_dependency_hashes: Optional[Dict[str, str]] = None,
+                           storage_copies: Optional[List[dict]] = None,
+                           render_max_processes: int = settings.RENDER_MAX_PROCESSES) -> List[dict]:
+    """
+    Generate staticsites to the target BuildSink (or directory)
+
+    If previous_dependency_hashes ({KEY: DEPENDENCY_HASH}) from a previous build is given,
+    pages whose inputs have not changed are not rendered.
+    If a storage_copies list is given, PageAssets and NewsItem images stored in an S3 bucket are not written to
+    the sink, instead their copy definitions are appended to the list (and the page_data 'storage_copies')
+    If render_max_processes is greater than 1, page HTML is rendered, and HTML/CSS/JS is transformed (see settings.SYNC_TRANSFORMS),
+    across a process pool (0 uses all cores)
+    """
+    sink = as_build_sink(target)
     instantiated_pages = []
-    for page in staticsite.pages():
-        instantiated_assets = [(abs_filepath, rel_filepath) for abs_filepath, rel_filepath in page.prepare_assets(directory)]
-        asset_absolute_filepaths = [abs_fp for abs_fp, _ in instantiated_assets]
-        asset_relative_filepaths = [rel_fp for _, rel_fp in instantiated_assets]
-
-        instantiated_page_data = page.instantiate(directory)
-        page_data = {
-            'id': page.id,
-            'type': page.type,
-            'data': [],
-            'asset_absolute_filepaths': asset_absolute_filepaths,
-            'asset_relative_filepaths': asset_relative_filepaths
-        }
-        if instantiated_page_data:
-            page_data['data'].extend(instantiated_page_data)
-        instantiated_pages.append(page_data)
+    with PageRenderer(max_processes=render_max_processes) as renderer:
+        for page in staticsite.pages():
+            page_storage_copies = [] if storage_copies is not None else None  # type: Optional[List[dict]]
+            instantiated_assets = [
+                (abs_filepath, rel_filepath) for abs_filepath, rel_filepath in page.prepare_assets(sink, page_storage_copies, renderer)
+            ]
+            asset_absolute_filepaths = [abs_fp for abs_fp, _ in instantiated_assets]
+            asset_relative_filepaths = [rel_fp for _, rel_fp in instantiated_assets]
+
+            instantiated_page_data = page.instantiate(
+                sink,
+                previous_dependency_hashes=previous_dependency_hashes,
+                storage_copies=page_storage_copies,
+                renderer=renderer
+            )
+            page_data = {
+                'id': page.id,
+                'type': page.type,
+                'data': [],
+                'asset_absolute_filepaths': asset_absolute_filepaths,
+                'asset_relative_filepaths': asset_relative_filepaths,
+                'storage_copies': page_storage_copies or [],
+            }
+            if storage_copies is not None and page_storage_copies:
+                storage_copies.extend(page_storage_copies)
+            if instantiated_page_data:
+                page_data['data'].extend(instantiated_page_data)
+            instantiated_pages.append(page_data)
 
     return instantiated_pages
+
+
+def get_instantiated_sources(instantiated_pages: List[dict]) -> Dict[str, dict]:
+    """
+    Map the key (relative path) of each instantiated file to the source object that produced it
+    Takes the result of instantiate_staticsite()
+    """
+    sources = {}
+    for page_data in instantiated_pages:
+        page_asset_ids = {
+            str(Path(relative_path, filename)): asset_id
+            for asset_id, relative_path, filename in PageAsset.objects.filter(page_id=page_data['id']).values_list('id', 'relative_path', 'filename')
+        }
+        for relative_filepath in page_data['asset_relative_filepaths']:
+            key = str(relative_filepath)
+            sources[key] = {'source_type': 'pageasset', 'source_id': page_asset_ids.get(key)}
+
+        for data in page_data['data']:
+            key = str(data['relative_path'])
+            if page_data['type'] == 'news':
+                sources[key] = {'source_type': 'newspage', 'source_id': page_data['id'], 'page_number': data['page_count']}
+                for image in data.get('newsitem_images', []):
+                    sources[str(image['relative_path'])] = {'source_type': 'newsitem_image', 'source_id': image['newsitem_id']}
+            else:
+                sources[key] = {'source_type': 'indexpage', 'source_id': page_data['id']}
+            sources[key]['dependency_hash'] = data.get('dependency_hash')
+
+        for storage_copy in page_data.get('storage_copies', []):
+            sources[str(storage_copy['relative_path'])] = {
+                'source_type': storage_copy['source_type'],
+                'source_id': storage_copy['source_id'],
+            }
+    return sources
+
+
+def get_unrendered_keys(instantiated_pages: List[dict]) -> Set[str]:
+    """
+    Get the keys of pages (and their NewsItem images) that were skipped as unchanged by instantiate_staticsite()
+    > The previous build output is reused for these keys
+    """
+    unrendered_keys = set()
+    for page_data in instantiated_pages:
+        for data in page_data['data']:
+            if data.get('is_rendered', True):
+                continue
+            unrendered_keys.add(str(data['relative_path']))
+            for image in data.get('newsitem_images', []):
+                unrendered_keys.add(str(image['relative_path']))
+    return unrendered_keys
+
+
+def get_file_build_objects(build_files: Iterable[BuildFile], sources: Dict[str, dict]) -> List[StaticSiteBuildObject]:
+    """Prepare (unsaved) build manifest objects for the given files written to the BuildSink"""
+    build_objects = []
+    for build_file in build_files:
+        source = sources.get(build_file.key, {})
+        build_objects.append(
+            StaticSiteBuildObject(
+                key=build_file.key,
+                md5=build_file.md5,
+                size=build_file.size,
+                content_type=build_file.content_type or DEFAULT_CONTENT_TYPE,
+                content_encoding=build_file.content_encoding,
+                source_type=source.get('source_type'),
+                source_id=source.get('source_id'),
+                page_number=source.get('page_number'),
+                dependency_hash=source.get('dependency_hash'),
+            )
+        )
+    return build_objects
+
+
+def get_storage_copy_build_objects(storage_copies: List[dict], max_workers: int = settings.S3_UPLOAD_MAX_WORKERS) -> List[StaticSiteBuildObject]:
+    """
+    Prepare (unsaved) build manifest objects for the given storage copies using the metadata of the source objects
+    The resulting 'size', 'content_type' and 'cache_control' (if not set) are set on each of the given storage_copies
+
+    > The content type is determined by the target key, as the type recorded on upload to the media bucket is not reliable
+    """
+    source_metadata = head_objects(
+        get_s3_client(),
+        [(storage_copy['source_bucket'], storage_copy['source_key']) for storage_copy in storage_copies],
+        max_workers=max_workers
+    )
+    build_objects = []
+    for storage_copy in storage_copies:
+        key = str(storage_copy['relative_path'])
+        metadata = source_metadata[(storage_copy['source_bucket'], storage_copy['source_key'])]
+        content_type, _ = mimetypes.guess_type(key)
+        storage_copy['size'] = metadata['size']
+        storage_copy['content_type'] = content_type or metadata['content_type'] or DEFAULT_CONTENT_TYPE
+        storage_copy.setdefault('cache_control', get_cache_control(storage_copy['content_type']))
+        build_objects.append(
+            StaticSiteBuildObject(
+                key=key,
+                md5=metadata['etag'],
+                size=metadata['size'],
+                content_type=storage_copy['content_type'],
+                source_type=storage_copy['source_type'],
+                source_id=storage_copy['source_id'],
+            )
+        )
+    return build_objects
+
+
+def get_changed_storage_copies(client: Any,
+                               bucket_name: str,
+                               storage_copies: List[dict],
+                               existing_etags: Dict[str, str],
+                               source_etags: Dict[str, str],
+                               max_workers: int = settings.S3_UPLOAD_MAX_WORKERS) -> List[dict]:
+    """
+    Filter the given storage copies to those that are new or differ from the existing objects of the bucket (existing_etags {KEY: ETAG})
+    Copies are unchanged if the existing object ETag matches the source ETag (source_etags {KEY: ETAG}),
+    or for sources uploaded by multipart (ETag with a '-N' suffix, never matching the copied object ETag)
+    if the file_hash recorded on the existing object (see copy_objects()) matches the copy 'file_hash'.
+    """
+    changed_copies = []
+    hashed_copies = []
+    for storage_copy in storage_copies:
+        key = str(storage_copy['relative_path'])
+        existing_etag = existing_etags.get(key)
+        if existing_etag is not None and existing_etag == source_etags[key]:
+            continue
+        if existing_etag is not None and '-' in source_etags[key] and storage_copy.get('file_hash'):
+            hashed_copies.append(storage_copy)
+        else:
+            changed_copies.append(storage_copy)
+
+    existing_metadata = head_objects(
+        client,
+        [(bucket_name, str(storage_copy['relative_path'])) for storage_copy in hashed_copies],
+        max_workers=max_workers
+    ) if hashed_copies else {}
+    for storage_copy in hashed_copies:
+        metadata = existing_metadata[(bucket_name, str(storage_copy['relative_path']))]['metadata']
+        if metadata.get(FILE_HASH_METADATA_KEY) != storage_copy['file_hash']:
+            changed_copies.append(storage_copy)
+    return changed_copies
+
+
+def create_staticsite_build(staticsite: StaticSite,
+                            bucket_name: str,
+                            is_production: bool,
+                            build_objects: List[StaticSiteBuildObject],
+                            transferred_count: int) -> StaticSiteBuild:
+    """
+    Record the build manifest for the given (unsaved) build objects and update the related StaticSite last sync datetime
+    > Objects reused from a previous build are saved as new objects of the resulting build
+    """
+    with transaction.atomic():
+        build = StaticSiteBuild.objects.create(
+            site=staticsite,
+            bucket_name=bucket_name,
+            is_production=is_production,
+            object_count=len(build_objects),
+            total_bytes=sum(o.size for o in build_objects),
+            transferred_count=transferred_count,
+        )
+        for build_object in build_objects:
+            build_object.pk = None
+            build_object.build = build
+        StaticSiteBuildObject.objects.bulk_create(build_objects)
+
+        sync_datetime_field = 'last_production_sync_datetime' if is_production else 'last_staging_sync_datetime'
+        setattr(staticsite, sync_datetime_field, build.created_datetime)
+        StaticSite.objects.filter(pk=staticsite.pk).update(**{sync_datetime_field: build.created_datetime})
+    return build
+
+
+def sync_staticsite(staticsite: StaticSite,
+                    update_production: bool = False,
+                    max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                    incremental: bool = False,
+                    delete_stale: bool = False,
+                    server_side_copy: bool = settings.S3_SERVER_SIDE_COPY,
+                    render_max_processes: int = settings.RENDER_MAX_PROCESSES,
+                    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                    build_sink: str = settings.SYNC_BUILD_SINK) -> List[Path]:
+    """
+    Instantiate site and perform s3 bucket sync to update content in target bucket (See StaticSite.sync())
+    build_sink selects where the site is instantiated before upload (see staticsites.sinks.create_build_sink()),
+    with BUILD_SINK_S3 files are uploaded as they are produced, overlapping rendering and uploading.
+    If given, progress_callback is called with (PHASE, COMPLETED_COUNT, TOTAL_COUNT) as the sync progresses,
+    where the counts are the number of objects transferred during the SYNC_PHASE_TRANSFERRING phase.
+    Returns the relative paths of the uploaded/copied files.
+    """
+    def report_progress(phase: str, completed_count: int = 0, total_count: int = 0) -> None:
+        if progress_callback:
+            progress_callback(phase, completed_count, total_count)
+
+    client = get_s3_client()
+    if update_production:
+        bucket_name = staticsite.production_bucket
+    else:
+        bucket_name = staticsite.staging_bucket
+
+    existing_etags = {}
+    if incremental or delete_stale:
+        existing_etags = list_bucket_etags(client, bucket_name)
+
+    previous_build = None
+    previous_dependency_hashes = None
+    if incremental:
+        previous_build = staticsite.get_latest_build(bucket_name)
+        if previous_build:
+            # pages whose objects are missing from the bucket are rendered again
+            previous_dependency_hashes = previous_build.get_dependency_hashes(existing_etags)
+    # in incremental mode only new or changed objects are transferred
+    changed_etags = existing_etags if incremental else None
+
+    site_prefix = f'site-{staticsite.organization.pk}_'
+    sink = create_build_sink(
+        build_sink,
+        client,
+        bucket_name,
+        changed_etags,
+        max_workers,
+        prefix=site_prefix,
+        content_encoding=settings.SYNC_CONTENT_ENCODING,
+        transforms=settings.SYNC_TRANSFORMS
+    )
+    with sink:
+        storage_copies = [] if server_side_copy else None  # type: Optional[List[dict]]
+        report_progress(SYNC_PHASE_RENDERING)
+        instantiated_pages = instantiate_staticsite(
+            staticsite,
+            sink,
+            previous_dependency_hashes,
+            storage_copies,
+            render_max_processes=render_max_processes
+        )
+        # the same image may be referenced by multiple NewsItems
+        storage_copies = list({str(c['relative_path']): c for c in storage_copies or []}.values())
+
+        sources = get_instantiated_sources(instantiated_pages)
+        file_build_objects = get_file_build_objects(sink.files.values(), sources)
+        copy_build_objects = get_storage_copy_build_objects(storage_copies, max_workers)
+        build_objects = file_build_objects + copy_build_objects
+        generated_md5s = {o.key: o.md5 for o in build_objects}
+
+        # objects of unchanged pages are reused from the previous build
+        unrendered_keys = get_unrendered_keys(instantiated_pages) - set(generated_md5s.keys())
+        if previous_build and unrendered_keys:
+            reused_objects = [o for o in previous_build.build_objects.all() if o.key in unrendered_keys]
+            missing_keys = unrendered_keys - set(o.key for o in reused_objects)
+            if missing_keys:
+                logger.warning(f'Unrendered keys not found in previous build({previous_build.pk}): {missing_keys}')
+            build_objects.extend(reused_objects)
+
+        changed_files = sink.get_changed_files(changed_etags)
+        if incremental:
+            storage_copies = get_changed_storage_copies(client, bucket_name, storage_copies, existing_etags, generated_md5s, max_workers)
+            logger.info(f'{len(changed_files) + len(storage_copies)} new or changed objects to transfer to s3://{bucket_name}')
+
+        transfer_count = len(changed_files) + len(storage_copies)
+        transferred_paths = []
+
+        def report_transfer(relative_filepath: Path) -> None:
+            transferred_paths.append(relative_filepath)
+            report_progress(SYNC_PHASE_TRANSFERRING, len(transferred_paths), transfer_count)
+
+        report_progress(SYNC_PHASE_TRANSFERRING, 0, transfer_count)
+        upload_summary = sink.upload(client, bucket_name, changed_etags, max_workers=max_workers, progress_callback=report_transfer)
+        copy_summary = copy_objects(client, bucket_name, storage_copies, max_workers=max_workers, progress_callback=report_transfer)
+        failed = upload_summary.failed + copy_summary.failed
+        if failed:
+            failed_paths = [str(relative_path) for relative_path, _ in failed]
+            raise TransferError(f'Failed to transfer files to s3://{bucket_name}: {failed_paths}', failed)
+        transferred_files = [build_file.relative_path for build_file in changed_files] + [c['relative_path'] for c in storage_copies]
+
+        report_progress(SYNC_PHASE_RECORDING, transfer_count, transfer_count)
+        if delete_stale:
+            stale_keys = set(existing_etags.keys()) - set(o.key for o in build_objects)
+            delete_keys(client, bucket_name, sorted(stale_keys))
+
+        create_staticsite_build(
+            staticsite,
+            bucket_name,
+            update_production,
+            build_objects,
+            transferred_count=len(transferred_files),
+        )
+    return transferred_files
+
+
+def promote_staticsite(staticsite: StaticSite,
+                       max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                       delete_stale: bool = True) -> List[Path]:
+    """
+    Copy the objects of the staging bucket to the production bucket without re-building the site (See StaticSite.promote())
+    Returns the relative paths of the copied objects.
+    """
+    client = get_s3_client()
+    staging_build = staticsite.get_latest_build(staticsite.staging_bucket)
+    if staging_build:
+        staging_objects = list(staging_build.build_objects.all())
+    else:
+        logger.warning(f'No build recorded for s3://{staticsite.staging_bucket}, using bucket listing ...')
+        staging_objects = []
+        for key, obj in list_bucket_objects(client, staticsite.staging_bucket).items():
+            content_type, _ = mimetypes.guess_type(key)
+            staging_objects.append(
+                StaticSiteBuildObject(
+                    key=key,
+                    md5=obj['etag'],
+                    size=obj['size'],
+                    content_type=content_type or DEFAULT_CONTENT_TYPE,
+                )
+            )
+
+    production_etags = list_bucket_etags(client, staticsite.production_bucket)
+    copies = [
+        {
+            'relative_path': Path(o.key),
+            'source_bucket': staticsite.staging_bucket,
+            'source_key': o.key,
+            'size': o.size,
+        }
+        for o in staging_objects if production_etags.get(o.key) != o.md5
+    ]
+    logger.info(f'Promoting {len(copies)} changed objects from s3://{staticsite.staging_bucket} to s3://{staticsite.production_bucket} ...')
+    summary = copy_objects(client, staticsite.production_bucket, copies, max_workers=max_workers)
+    if summary.failed:
+        failed_paths = [str(relative_path) for relative_path, _ in summary.failed]
+        raise TransferError(f'Failed to promote files to s3://{staticsite.production_bucket}: {failed_paths}', summary.failed)
+
+    if delete_stale:
+        stale_keys = set(production_etags.keys()) - set(o.key for o in staging_objects)
+        delete_keys(client, staticsite.production_bucket, sorted(stale_keys))
+
+    create_staticsite_build(
+        staticsite,
+        staticsite.production_bucket,
+        True,
+        staging_objects,
+        transferred_count=len(copies),
+    )
+    return [c['relative_path'] for c in copies]
+
+
+def build_staticsite(staticsite: StaticSite,
+                     update_production: bool = False,
+                     max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                     incremental: bool = False,
+                     delete_stale: bool = False,
+                     render_max_processes: int = settings.RENDER_MAX_PROCESSES) -> dict:
+    """
+    Sync the given site, returning a summary of the resulting build
+
+    > Any failure is logged and recorded in the summary 'error', it is *NOT* raised
+    """
+    bucket_name = staticsite.production_bucket if update_production else staticsite.staging_bucket
+    summary = {
+        'site_id': staticsite.pk,
+        'organization': staticsite.organization.name,
+        'name': staticsite.name,
+        'bucket_name': bucket_name,
+        'is_succeeded': False,
+        'error': None,
+        'elapsed_seconds': 0.0,
+        'transferred_count': 0,
+        'object_count': 0,
+        'total_bytes': 0,
+    }
+    start = time.perf_counter()
+    try:
+        staticsite.sync(
+            update_production=update_production,
+            max_workers=max_workers,
+            incremental=incremental,
+            delete_stale=delete_stale,
+            render_max_processes=render_max_processes,
+        )
+        build = staticsite.get_latest_build(bucket_name)
+        if build:
+            summary['transferred_count'] = build.transferred_count
+            summary['object_count'] = build.object_count
+            summary['total_bytes'] = build.total_bytes
+        summary['is_succeeded'] = True
+    except Exception as e:  # isolate failures so that a single site does not stop a batch build
+        logger.exception(f'Build of StaticSite({staticsite.pk}) {staticsite.name} failed: {e}')
+        summary['error'] = f'{e.__class__.__name__}: {e}'
+    summary['elapsed_seconds'] = time.perf_counter() - start
+    return summary
+
+
+def build_staticsites(staticsites: Iterable[StaticSite],
+                      update_production: bool = False,
+                      incremental: bool = False,
+                      delete_stale: bool = False,
+                      max_concurrent_sites: int = settings.BUILD_SITES_MAX_CONCURRENT_SITES,
+                      max_transfer_workers: int = settings.BUILD_SITES_MAX_TRANSFER_WORKERS,
+                      max_render_processes: int = settings.RENDER_MAX_PROCESSES) -> List[dict]:
+    """
+    Build and sync the given sites, running up to max_concurrent_sites site builds at the same time
+    The max_transfer_workers and max_render_processes (0 uses all cores) budgets are divided between the concurrently running site builds.
+    Returns the summary of each site build (see build_staticsite()), in the order of the given sites.
+
+    > A failed site build does not stop the other builds
+    """
+    staticsites = list(staticsites)
+    max_concurrent_sites = max(1, min(max_concurrent_sites, len(staticsites)))
+    site_max_workers = max(1, max_transfer_workers // max_concurrent_sites)
+    site_max_processes = max(1, get_render_max_processes(max_render_processes) // max_concurrent_sites)
+    logger.info(f'Building {len(staticsites)} sites, {max_concurrent_sites} at a time '
+                f'with {site_max_workers} transfer workers and {site_max_processes} render processes each ...')
+
+    def build(staticsite: StaticSite) -> dict:
+        return build_staticsite(
+            staticsite,
+            update_production=update_production,
+            max_workers=site_max_workers,
+            incremental=incremental,
+            delete_stale=delete_stale,
+            render_max_processes=site_max_processes,
+        )
+
+    if max_concurrent_sites == 1:
+        return [build(staticsite) for staticsite in staticsites]
+
+    def build_in_thread(staticsite: StaticSite) -> dict:
+        try:
+            return build(staticsite)
+        finally:
+            # database connections are per-thread, close the connection opened by this worker thread
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_sites) as executor:
+        return list(executor.map(build_in_thread, staticsites))
@@ -0,0 +1,244 @@
+import io
+import logging
+from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage, default_storage
+
+from PIL import Image, ImageOps, features
+
+from .transfers import calculate_sha256
+
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL_IMAGE_DERIVATIVE = 'original'
+
+# formats that are written as another format when resized
+DERIVATIVE_OUTPUT_FORMATS = {
+    'MPO': 'JPEG',  # multi-picture JPEG (camera images)
+}
+
+# transcode format (file extension): (Pillow format, mime type)
+TRANSCODE_FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+}
+# source images (by file extension) that are transcoded, animated formats (gif) are *NOT* transcoded
+TRANSCODE_SOURCE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+
+# raised by Pillow for image content that cannot be decoded (unidentified, truncated or corrupt images)
+IMAGE_DECODE_EXCEPTIONS = (OSError, Image.DecompressionBombError)
+
+# (DERIVATIVE_NAME, IMAGE_FORMAT), where an IMAGE_FORMAT of None is the source format
+ImageVariant = Tuple[str, Optional[str]]
+
+
+def calculate_image_hash(fileobj: BinaryIO) -> str:
+    """Calculate the hex sha256 digest of the given image file object content"""
+    return calculate_sha256(fileobj)
+
+
+@lru_cache(maxsize=None)
+def get_transcode_formats(image_formats: Tuple[str, ...] = tuple(settings.IMAGE_TRANSCODE_FORMATS)) -> Tuple[str, ...]:
+    """Get the given transcode formats (see TRANSCODE_FORMATS) supported by the installed Pillow, in the given order"""
+    available_formats = []
+    for image_format in image_formats:
+        if image_format not in TRANSCODE_FORMATS:
+            logger.warning(f'Unknown image transcode format, skipping: {image_format}')
+        elif not features.check(image_format):
+            logger.warning(f'Image transcode format not supported by the installed Pillow, skipping: {image_format}')
+        else:
+            available_formats.append(image_format)
+    return tuple(available_formats)
+
+
+def get_image_transcode_formats(filename: str) -> Tuple[str, ...]:
+    """Get the formats the given image is transcoded to, empty if the image is not transcoded"""
+    suffix = Path(filename).suffix.lower()
+    if suffix not in TRANSCODE_SOURCE_SUFFIXES:
+        return ()
+    return tuple(image_format for image_format in get_transcode_formats() if f'.{image_format}' != suffix)
+
+
+def get_image_variants(filename: str, sizes: Dict[str, Tuple[int, int]]) -> List[ImageVariant]:
+    """
+    Get the variants (DERIVATIVE_NAME, IMAGE_FORMAT) created for the given image:
+    the resized derivatives of the given sizes ({DERIVATIVE_NAME: (MAX_WIDTH, MAX_HEIGHT)}) in the source format,
+    and the original and derivatives transcoded to each of the transcode formats
+
+    > The original in the source format is used as is, and is *NOT* included
+    """
+    derivative_names = [ORIGINAL_IMAGE_DERIVATIVE] + list(sizes)
+    image_formats = [None] + list(get_image_transcode_formats(filename))
+    return [
+        (derivative_name, image_format)
+        for derivative_name in derivative_names
+        for image_format in image_formats
+        if not (derivative_name == ORIGINAL_IMAGE_DERIVATIVE and image_format is None)
+    ]
+
+
+def get_derivative_filename(filename: str, derivative_name: str, image_format: Optional[str] = None) -> str:
+    """
+    Get the filename of the given image variant
+    ('photo.jpg', 'thumbnail') -> 'photo.thumbnail.jpg', ('photo.jpg', 'original', 'webp') -> 'photo.webp'
+    """
+    path = Path(filename)
+    stem = path.stem if derivative_name == ORIGINAL_IMAGE_DERIVATIVE else f'{path.stem}.{derivative_name}'
+    suffix = f'.{image_format}' if image_format else path.suffix
+    return str(path.with_name(f'{stem}{suffix}'))
+
+
+def get_image_sources(relative_path: str) -> List[Dict[str, str]]:
+    """
+    Get the <picture> sources of the transcoded variants of the given image (or derivative) path,
+    [{'type': MIME_TYPE, 'srcset': RELATIVE_PATH}, ...] in settings.IMAGE_TRANSCODE_FORMATS order
+    """
+    path = Path(str(relative_path))
+    return [
+        {'type': TRANSCODE_FORMATS[image_format][1], 'srcset': str(path.with_suffix(f'.{image_format}'))}
+        for image_format in get_image_transcode_formats(path.name)
+    ]
+
+
+def get_derivative_storage_name(image_hash: str,
+                                derivative_name: str,
+                                size: Optional[Tuple[int, int]],
+                                quality: int,
+                                suffix: str) -> str:
+    """
+    Get the storage name of an image variant, keyed by the source image hash and the variant spec (size, quality and format)
+    so that variants are created once per image content and spec
+    """
+    spec = derivative_name
+    if size:
+        max_width, max_height = size
+        spec = f'{spec}-{max_width}x{max_height}'
+    return f'{settings.IMAGE_DERIVATIVE_STORAGE_PREFIX}/{image_hash}/{spec}-q{quality}{suffix.lower()}'
+
+
+def create_image_derivative(source: Image.Image,
+                            source_format: str,
+                            size: Optional[Tuple[int, int]],
+                            quality: int,
+                            image_format: Optional[str] = None) -> bytes:
+    """
+    Create a variant of the given (decoded) source image resized to fit within size (MAX_WIDTH, MAX_HEIGHT), never upscaled,
+    written in the given transcode image_format (see TRANSCODE_FORMATS), or the source format if None.
+    > Metadata is dropped
+    """
+    if image_format:
+        output_format = TRANSCODE_FORMATS[image_format][0]
+    else:
+        output_format = DERIVATIVE_OUTPUT_FORMATS.get(source_format, source_format)
+    image = source.copy()
+    if size:
+        image.thumbnail(size, Image.LANCZOS)
+    options = {}
+    if output_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options.update({'quality': quality, 'optimize': True, 'progressive': True})
+    elif output_format == 'PNG':
+        options.update({'optimize': True})
+    elif output_format in ('WEBP', 'AVIF'):
+        options.update({'quality': quality})
+    output = io.BytesIO()
+    image.save(output, format=output_format, **options)
+    return output.getvalue()
+
+
+def _list_stored_names(storage: Storage, directory: str) -> List[str]:
+    try:
+        _, filenames = storage.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [f'{directory}/{filename}' for filename in filenames]
+
+
+def prepare_image_derivatives(image_hash: str,
+                              filename: str,
+                              content_loader: Callable[[], bytes],
+                              sizes: Dict[str, Tuple[int, int]] = settings.IMAGE_DERIVATIVE_SIZES,
+                              quality: int = settings.IMAGE_DERIVATIVE_QUALITY,
+                              storage: Storage = default_storage) -> Dict[ImageVariant, str]:
+    """
+    Get the storage names of the image variants {(DERIVATIVE_NAME, IMAGE_FORMAT): STORAGE_NAME} (see get_image_variants())
+    Variants not yet in storage are created from the source image content, returned by content_loader(),
+    which is only called (and the image decoded once) if a variant needs to be created.
+
+    > Variants are never re-created for the same image content (image_hash), size, quality and format
+    > If the image cannot be decoded by Pillow, the error is logged and only the variants already in storage are returned
+    """
+    source_suffix = Path(filename).suffix
+    storage_names = {}
+    for derivative_name, image_format in get_image_variants(filename, sizes):
+        suffix = f'.{image_format}' if image_format else source_suffix
+        storage_names[(derivative_name, image_format)] = get_derivative_storage_name(
+            image_hash,
+            derivative_name,
+            sizes.get(derivative_name),
+            quality,
+            suffix
+        )
+    if not storage_names:
+        return storage_names
+
+    # stored variants are listed with a single request
+    stored_names = set(_list_stored_names(storage, f'{settings.IMAGE_DERIVATIVE_STORAGE_PREFIX}/{image_hash}'))
+    missing_variants = [variant for variant, storage_name in storage_names.items() if storage_name not in stored_names]
+    if missing_variants:
+        content = content_loader()
+        try:
+            source = Image.open(io.BytesIO(content))
+            source.load()  # decode now, so that truncated images fail before any variant is created
+        except IMAGE_DECODE_EXCEPTIONS as e:
+            logger.error(f'Unable to decode image ({filename}), variants are not created: {e}')
+            return {variant: storage_name for variant, storage_name in storage_names.items() if storage_name in stored_names}
+        with source:
+            source_format = source.format
+            transposed = ImageOps.exif_transpose(source)
+            for derivative_name, image_format in missing_variants:
+                storage_name = storage_names[(derivative_name, image_format)]
+                logger.info(f'Creating image derivative ({filename} -> {storage_name}) ...')
+                content = create_image_derivative(transposed, source_format, sizes.get(derivative_name), quality, image_format)
+                storage.save(storage_name, ContentFile(content))
+    return storage_names
+
+
+def prepare_images_derivatives(images: Iterable[Tuple[str, str, Callable[[], bytes]]],
+                               sizes: Dict[str, Tuple[int, int]] = settings.IMAGE_DERIVATIVE_SIZES,
+                               quality: int = settings.IMAGE_DERIVATIVE_QUALITY,
+                               storage: Storage = default_storage,
+                               max_workers: int = settings.IMAGE_PROCESSING_MAX_WORKERS) -> List[Dict[ImageVariant, str]]:
+    """
+    Prepare the variants of the given images ((IMAGE_HASH, FILENAME, CONTENT_LOADER), ...) across a thread pool,
+    where each image is decoded once (see prepare_image_derivatives())
+    Returns the storage names of the variants of each image, in the given order.
+    Images with the same content hash and format are prepared once.
+
+    > Pillow releases the GIL while decoding, resizing and encoding, so images are processed in parallel
+    """
+    images = list(images)
+    # identical images (same content and format) are prepared once
+    unique_images = {}  # type: Dict[Tuple[str, str], Tuple[str, str, Callable[[], bytes]]]
+    for image_hash, filename, loader in images:
+        unique_images.setdefault((image_hash, Path(filename).suffix.lower()), (image_hash, filename, loader))
+    if max_workers <= 1 or len(unique_images) <= 1:
+        prepared = {
+            key: prepare_image_derivatives(image_hash, filename, loader, sizes, quality, storage)
+            for key, (image_hash, filename, loader) in unique_images.items()
+        }
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                key: executor.submit(prepare_image_derivatives, image_hash, filename, loader, sizes, quality, storage)
+                for key, (image_hash, filename, loader) in unique_images.items()
+            }
+            prepared = {key: future.result() for key, future in futures.items()}
+    return [prepared[(image_hash, Path(filename).suffix.lower())] for image_hash, filename, _ in images]
@@ -0,0 +1,100 @@
+import time
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import SyncJob, SYNC_JOB_STATUS_QUEUED
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_sync_job(job_id: int, poll_seconds: float = settings.SYNC_JOB_POLL_SECONDS) -> bool:
+    """
+    Run the queued SyncJob of the given id, waiting until its debounce window closes
+    and no other job of the same site is running
+    Returns False if the job was run (or coalesced) by another worker
+
+    > Entry point used by the SyncJob backends, must remain importable at module level
+    """
+    while True:
+        job = SyncJob.objects.select_related('site').get(pk=job_id)
+        if job.status != SYNC_JOB_STATUS_QUEUED:
+            return False
+        if job.run():
+            return True
+        time.sleep(job.get_wait_seconds() or poll_seconds)
+
+
+def run_queued_sync_jobs(limit: Optional[int] = None) -> int:
+    """
+    Run due queued SyncJobs, oldest first
+    Returns the number of jobs run
+
+    > Jobs claimed by another worker in the meantime, or of sites with a running job, are skipped
+    """
+    jobs = SyncJob.objects.select_related('site').filter(
+        status=SYNC_JOB_STATUS_QUEUED,
+        run_after__lte=timezone.now(),
+    ).order_by('run_after', 'id')
+    if limit:
+        jobs = jobs[:limit]
+    return sum(1 for job in list(jobs) if job.run())
+
+
+class BaseSyncJobBackend:
+    """Executes submitted SyncJobs out of band (see StaticSite.enqueue_sync())"""
+
+    def submit(self, job: SyncJob) -> None:
+        raise NotImplementedError
+
+
+class InlineSyncJobBackend(BaseSyncJobBackend):
+    """Run the job immediately in the calling process (for tests)"""
+
+    def submit(self, job: SyncJob) -> None:
+        run_sync_job(job.pk)
+
+
+class ThreadSyncJobBackend(BaseSyncJobBackend):
+    """Run the job in a background thread of the calling process (for local development)"""
+
+    def submit(self, job: SyncJob) -> None:
+        thread = threading.Thread(target=self.run, args=(job.pk,), name=f'SyncJob-{job.pk}', daemon=True)
+        thread.start()
+
+    @staticmethod
+    def run(job_id: int) -> None:
+        try:
+            run_sync_job(job_id)
+        finally:
+            # database connections are per-thread, close the connection opened by this thread
+            connections.close_all()
+
+
+class DatabaseQueueSyncJobBackend(BaseSyncJobBackend):
+    """Leave the job queued in the database, to be run by the `manage.py run_sync_jobs` worker"""
+
+    def submit(self, job: SyncJob) -> None:
+        logger.info(f'SyncJob({job.pk}) queued for run_sync_jobs worker')
+
+
+class ZappaSyncJobBackend(BaseSyncJobBackend):
+    """
+    Run the job in a separate asynchronous lambda invocation (for zappa deployments),
+    so that the request submitting the job is not bound by the API Gateway timeout
+    """
+
+    def submit(self, job: SyncJob) -> None:
+        from zappa.asynchronous import run  # only available in zappa deployments
+        run(run_sync_job, args=[job.pk])
+
+
+def get_sync_job_backend() -> BaseSyncJobBackend:
+    """Get an instance of the configured SYNC_JOB_BACKEND"""
+    return import_string(settings.SYNC_JOB_BACKEND)()
@@ -0,0 +1,115 @@
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from ...models import StaticSite
+from ...functions import build_staticsites
+
+
+class Command(BaseCommand):
+    help = 'Build and sync all (or the filtered) StaticSites to their staging (or production) buckets'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '-o', '--organization',
+            dest='organization_ids',
+            type=int,
+            action='append',
+            default=[],
+            help='Only build the sites of the given Organization id (may be given multiple times)',
+        )
+        parser.add_argument(
+            '-s', '--site',
+            dest='site_ids',
+            type=int,
+            action='append',
+            default=[],
+            help='Only build the StaticSite of the given id (may be given multiple times)',
+        )
+        parser.add_argument(
+            '--include-inactive',
+            action='store_true',
+            default=False,
+            help='Also build the sites of inactive Organizations',
+        )
+        parser.add_argument(
+            '--production',
+            action='store_true',
+            default=False,
+            help='Sync to the production bucket instead of the staging bucket',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            default=False,
+            help='Only render changed pages and only transfer new or changed objects',
+        )
+        parser.add_argument(
+            '--delete-stale',
+            action='store_true',
+            default=False,
+            help='Delete bucket objects that are no longer part of the site',
+        )
+        parser.add_argument(
+            '-c', '--concurrency',
+            type=int,
+            default=settings.BUILD_SITES_MAX_CONCURRENT_SITES,
+            help=f'Number of sites built at the same time (default: {settings.BUILD_SITES_MAX_CONCURRENT_SITES})',
+        )
+        parser.add_argument(
+            '-w', '--max-transfer-workers',
+            type=int,
+            default=settings.BUILD_SITES_MAX_TRANSFER_WORKERS,
+            help=f'Total S3 transfer workers shared by the running site builds (default: {settings.BUILD_SITES_MAX_TRANSFER_WORKERS})',
+        )
+        parser.add_argument(
+            '-p', '--max-render-processes',
+            type=int,
+            default=settings.RENDER_MAX_PROCESSES,
+            help=f'Total render processes shared by the running site builds, 0 uses all cores (default: {settings.RENDER_MAX_PROCESSES})',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        staticsites = StaticSite.objects.select_related('organization').order_by('organization__name', 'name')
+        if not options['include_inactive']:
+            staticsites = staticsites.filter(organization__is_active=True)
+        if options['organization_ids']:
+            staticsites = staticsites.filter(organization__id__in=options['organization_ids'])
+        if options['site_ids']:
+            staticsites = staticsites.filter(id__in=options['site_ids'])
+
+        start = time.perf_counter()
+        summaries = build_staticsites(
+            staticsites,
+            update_production=options['production'],
+            incremental=options['incremental'],
+            delete_stale=options['delete_stale'],
+            max_concurrent_sites=options['concurrency'],
+            max_transfer_workers=options['max_transfer_workers'],
+            max_render_processes=options['max_render_processes'],
+        )
+        elapsed_seconds = time.perf_counter() - start
+
+        for summary in summaries:
+            status = 'OK' if summary['is_succeeded'] else 'FAILED'
+            line = (
+                f'{status:6} {summary["organization"]}/{summary["name"]} -> s3://{summary["bucket_name"]} '
+                f'{summary["elapsed_seconds"]:.2f}s objects={summary["object_count"]} '
+                f'transferred={summary["transferred_count"]} bytes={summary["total_bytes"]}'
+            )
+            if summary['is_succeeded']:
+                self.stdout.write(line)
+            else:
+                self.stderr.write(f'{line} error={summary["error"]}')
+
+        failed = [summary for summary in summaries if not summary['is_succeeded']]
+        self.stdout.write(
+            f'Built {len(summaries) - len(failed)}/{len(summaries)} sites in {elapsed_seconds:.2f}s: '
+            f'objects={sum(s["object_count"] for s in summaries)} '
+            f'transferred={sum(s["transferred_count"] for s in summaries)} '
+            f'bytes={sum(s["total_bytes"] for s in summaries)}'
+        )
+        if failed:
+            raise CommandError(f'{len(failed)} site builds failed: {[summary["site_id"] for summary in failed]}')
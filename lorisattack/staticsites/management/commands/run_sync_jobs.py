@@ -0,0 +1,34 @@
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...jobs import run_queued_sync_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued SyncJobs (worker for the DatabaseQueueSyncJobBackend)'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help='Run the currently queued jobs and exit',
+        )
+        parser.add_argument(
+            '--poll-seconds',
+            type=float,
+            default=settings.SYNC_JOB_POLL_SECONDS,
+            help=f'Seconds to wait between checks for queued jobs (default: {settings.SYNC_JOB_POLL_SECONDS})',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        while True:
+            job_count = run_queued_sync_jobs()
+            if job_count:
+                self.stdout.write(f'Ran {job_count} SyncJobs')
+            if options['once']:
+                break
+            time.sleep(options['poll_seconds'])
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaticSiteBuild',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_name', models.CharField(help_text='S3 bucket the build was synced to', max_length=63)),
+                ('is_production', models.BooleanField(default=False)),
+                ('object_count', models.PositiveIntegerField(default=0, help_text='Number of objects generated by the build')),
+                ('total_bytes', models.BigIntegerField(default=0, help_text='Total size of objects generated by the build')),
+                ('transferred_count', models.PositiveIntegerField(default=0, help_text='Number of objects uploaded by the build')),
+                ('created_datetime', models.DateTimeField(auto_now_add=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='staticsites.StaticSite')),
+            ],
+            options={
+                'get_latest_by': 'created_datetime',
+            },
+        ),
+        migrations.CreateModel(
+            name='StaticSiteBuildObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='S3 object key (relative path from the site root)', max_length=700)),
+                ('md5', models.CharField(help_text='Hex md5 digest of the object content', max_length=32)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('source_type', models.CharField(blank=True, choices=[('indexpage', 'IndexPage'), ('newspage', 'NewsPage'), ('pageasset', 'PageAsset'), ('newsitem_image', 'NewsItem image')], max_length=25, null=True)),
+                ('source_id', models.PositiveIntegerField(blank=True, help_text='id of the object (of source_type) that produced the key', null=True)),
+                ('page_number', models.PositiveIntegerField(blank=True, help_text='Page number for paginated NewsPage output', null=True)),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='build_objects', to='staticsites.StaticSiteBuild')),
+            ],
+            options={
+                'unique_together': {('build', 'key')},
+            },
+        ),
+    ]
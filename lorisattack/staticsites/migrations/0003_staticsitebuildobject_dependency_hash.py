@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0002_staticsitebuild_staticsitebuildobject'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staticsitebuildobject',
+            name='dependency_hash',
+            field=models.CharField(blank=True, help_text='Hash of the inputs used to render the page (used to skip rendering of unchanged pages)', max_length=64, null=True),
+        ),
+    ]
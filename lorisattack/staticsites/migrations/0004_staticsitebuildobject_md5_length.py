@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0003_staticsitebuildobject_dependency_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='staticsitebuildobject',
+            name='md5',
+            field=models.CharField(help_text='Hex md5 digest of the object content (S3 ETag for objects copied from multipart uploads)', max_length=40),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('staticsites', '0004_staticsitebuildobject_md5_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_datetime', models.DateTimeField(auto_now_add=True)),
+                ('updated_datetime', models.DateTimeField(auto_now=True)),
+                ('update_production', models.BooleanField(default=False)),
+                ('incremental', models.BooleanField(default=False)),
+                ('delete_stale', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='queued', editable=False, max_length=10)),
+                ('phase', models.CharField(blank=True, editable=False, help_text='Current sync phase of a running job', max_length=20)),
+                ('completed_count', models.PositiveIntegerField(default=0, editable=False, help_text='Number of objects transferred')),
+                ('total_count', models.PositiveIntegerField(default=0, editable=False, help_text='Number of objects to transfer')),
+                ('error', models.TextField(blank=True, editable=False)),
+                ('started_datetime', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('finished_datetime', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('build', models.ForeignKey(blank=True, editable=False, help_text='Build recorded by a succeeded job', null=True, on_delete=django.db.models.deletion.SET_NULL, to='staticsites.StaticSiteBuild')),
+                ('created_by', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='staticsites_syncjob_created_by', to=settings.AUTH_USER_MODEL)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='staticsites.StaticSite')),
+                ('updated_by', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='staticsites_syncjob_updated_by', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'created_datetime',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='syncjob',
+            index=models.Index(fields=['status', 'created_datetime'], name='staticsites_syncjob_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0005_syncjob'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='syncjob',
+            name='staticsites_syncjob_queue_idx',
+        ),
+        migrations.AddField(
+            model_name='syncjob',
+            name='coalesced_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of additional sync requests merged into the job'),
+        ),
+        migrations.AddField(
+            model_name='syncjob',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='The job is not started before this time (extended when further sync requests are coalesced)'),
+        ),
+        migrations.AddIndex(
+            model_name='syncjob',
+            index=models.Index(fields=['status', 'run_after'], name='staticsites_syncjob_due_idx'),
+        ),
+    ]
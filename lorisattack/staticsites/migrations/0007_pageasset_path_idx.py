@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0006_syncjob_run_after_coalesced_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pageasset',
+            index=models.Index(fields=['page', 'relative_path', 'filename'], name='staticsites_pageasset_path_idx'),
+        ),
+    ]
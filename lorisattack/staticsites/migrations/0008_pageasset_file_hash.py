@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0007_pageasset_path_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageasset',
+            name='file_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='sha256 of image file content, used to key the transcoded image variants', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0008_pageasset_file_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staticsitebuildobject',
+            name='content_encoding',
+            field=models.CharField(blank=True, help_text='Content-Encoding of the stored object (gzip, br), blank if stored as is', max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staticsites', '0009_staticsitebuildobject_content_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staticsite',
+            name='fingerprint_assets',
+            field=models.BooleanField(default=False, help_text='Upload assets referenced by page templates under content-hashed filenames, cached as immutable'),
+        ),
+        migrations.AlterField(
+            model_name='pageasset',
+            name='file_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='sha256 of the file content, used to key the transcoded image variants and fingerprinted filenames', max_length=64),
+        ),
+    ]
@@ -1,30 +1,25 @@
+import time
 import logging
 from pathlib import Path
-from typing import Generator, Tuple, List
-from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, Generator, Tuple, List, Optional, Union
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
 from django.conf import settings
-from django.template import engines
+from django.utils import timezone
 from django.core.validators import MinLengthValidator
+from django.core.files.storage import default_storage
+from django.template.backends.django import Template
 from django.utils.translation import ugettext_lazy as _
 
-import boto3
-from bs4 import BeautifulSoup
-
-from accounts.models import Organization
+from accounts.models import Organization, OrganizationUser
 from commons.models import UserCreatedDatetimeModel
-
-
-S3_RESOURCE = boto3.resource(
-    's3',
-    endpoint_url=settings.BOTO3_ENDPOINTS['s3']
-)
-S3_CLIENT = boto3.client(
-    's3',
-    endpoint_url=settings.BOTO3_ENDPOINTS['s3']
-)
+from .caches import get_compiled_template, get_template_relpaths, invalidate_page_templates
+from .dependencies import calculate_dependency_hash
+from .fingerprints import get_asset_targets, get_fingerprinted_filename
+from .images import ImageVariant, get_derivative_filename, get_image_variants, prepare_images_derivatives
+from .rendering import PageRenderer, render_html
+from .sinks import BuildSink, as_build_sink
+from .transfers import calculate_sha256, get_storage_location, get_storage_name_copy
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +53,10 @@ class StaticSite(UserCreatedDatetimeModel):
         blank=True,
         editable=False,
     )
+    fingerprint_assets = models.BooleanField(
+        default=False,
+        help_text=_('Upload assets referenced by page templates under content-hashed filenames, cached as immutable')
+    )
 
     def get_indexpage(self):
         return IndexPage.objects.get(site=self)
@@ -66,44 +65,113 @@ class StaticSite(UserCreatedDatetimeModel):
         from news.models import NewsPage
         return NewsPage.objects.get(site=self)
 
+    def get_latest_build(self, bucket_name: str) -> Optional['StaticSiteBuild']:
+        """Get the latest StaticSiteBuild synced to the given bucket (None if the site has not been synced)"""
+        return StaticSiteBuild.objects.filter(site=self, bucket_name=bucket_name).order_by('-created_datetime', '-id').first()
+
     def pages(self):
         indexpage = self.get_indexpage()
         yield indexpage
         if indexpage.has_news:
             yield self.get_newspage()
 
-    def sync(self, update_production=False):
-        """Instantiate site and perform s3 bucket sync to update content in target bucket"""
-        from .functions import instantiate_staticsite
+    def sync(self,
+             update_production: bool = False,
+             max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+             incremental: bool = False,
+             delete_stale: bool = False,
+             server_side_copy: bool = settings.S3_SERVER_SIDE_COPY,
+             progress_callback: Optional[Callable[[str, int, int], None]] = None,
+             render_max_processes: int = settings.RENDER_MAX_PROCESSES) -> List[Path]:
+        """
+        Instantiate site and perform s3 bucket sync to update content in target bucket
+
+        Files are uploaded concurrently using up to `max_workers` threads.
+        If `incremental` is True, pages unchanged since the last build for the bucket are not re-rendered and
+        only files that are new or whose content differs from the existing object are uploaded.
+        If `delete_stale` is True, objects in the target bucket that are no longer part of the site are deleted.
+        If `server_side_copy` is True, PageAssets and NewsItem images stored in the media bucket are copied directly
+        to the target bucket with copy_object() instead of being downloaded and re-uploaded.
+        On completion a StaticSiteBuild manifest of all generated objects is recorded.
+        If given, `progress_callback` is called with (PHASE, COMPLETED_COUNT, TOTAL_COUNT) as the sync progresses.
+        Pages are rendered across up to `render_max_processes` processes (see staticsites.rendering.PageRenderer).
+        Raises TransferError if any file fails to upload after retries.
+        Returns the relative paths of the uploaded/copied files.
+        """
+        from .functions import sync_staticsite
+
+        self.get_indexpage()  # confirm that indexpage is defined (will throw DoesNotExist if not defined)
+        return sync_staticsite(
+            self,
+            update_production=update_production,
+            max_workers=max_workers,
+            incremental=incremental,
+            delete_stale=delete_stale,
+            server_side_copy=server_side_copy,
+            progress_callback=progress_callback,
+            render_max_processes=render_max_processes
+        )
 
-        if update_production:
-            bucket_name = self.production_bucket
-        else:
-            bucket_name = self.staging_bucket
+    def enqueue_sync(self,
+                     user: OrganizationUser,
+                     update_production: bool = False,
+                     incremental: bool = False,
+                     delete_stale: bool = False) -> 'SyncJob':
+        """
+        Queue a sync of the site to be run out of band by the configured SYNC_JOB_BACKEND
+        Returns immediately with the queued SyncJob, which records the progress and result of the sync.
 
-        transferred_files = []
-        try:
-            self.get_indexpage()  # confirm that indexpage is defined (will throw DoesNotExist if not defined)
-            site_prefix = f'site-{self.organization.pk}_'
-            with TemporaryDirectory(prefix=site_prefix) as tempdir:
-                tempdir_path = Path(tempdir)
-                instantiate_staticsite(self, tempdir_path)
-                for item in Path(tempdir).glob('**/*'):
-                    if item.is_file():
-                        relative_path = item.relative_to(tempdir_path)
-                        transferred_files.append(relative_path)
-
-                        key = str(relative_path)
-                        logger.info(f'Uploading file ({item}) to: s3://{bucket_name}/{key}')
-                        # transfer file
-                        S3_CLIENT.upload_file(
-                            str(item),
-                            Bucket=bucket_name,
-                            Key=key
-                        )
-        except IndexPage.DoesNotExist:
-            raise  # adding for clarity, re-raise exception
-        return transferred_files
+        Requests are debounced: a job runs only after SYNC_JOB_DEBOUNCE_SECONDS without further requests.
+        While a job for the same target bucket is still queued, the request is coalesced into it
+        (its run is postponed, a full build wins over an incremental one, delete_stale is kept if requested).
+        As the site is rendered when the job runs, the latest saved state is always synced.
+
+        > Jobs are submitted to the backend once the current transaction is committed, coalesced jobs are submitted again
+        > so that a job is not left queued if the worker it was submitted to died (it is run by the first worker claiming it)
+        """
+        from .jobs import get_sync_job_backend
+
+        run_after = timezone.now() + timezone.timedelta(seconds=settings.SYNC_JOB_DEBOUNCE_SECONDS)
+        with transaction.atomic():
+            job = SyncJob.objects.select_for_update().filter(
+                site=self,
+                update_production=update_production,
+                status=SYNC_JOB_STATUS_QUEUED,
+            ).order_by('created_datetime').first()
+            if job:
+                logger.info(f'Coalescing sync request for StaticSite({self.pk}) into {job}')
+                job.run_after = run_after
+                job.incremental = job.incremental and incremental
+                job.delete_stale = job.delete_stale or delete_stale
+                job.coalesced_count += 1
+                job.updated_by = user
+                job.save()
+            else:
+                job = SyncJob.objects.create(
+                    site=self,
+                    update_production=update_production,
+                    incremental=incremental,
+                    delete_stale=delete_stale,
+                    run_after=run_after,
+                    created_by=user,
+                    updated_by=user,
+                )
+        backend = get_sync_job_backend()
+        transaction.on_commit(lambda: backend.submit(job))
+        return job
+
+    def promote(self, max_workers: int = settings.S3_UPLOAD_MAX_WORKERS, delete_stale: bool = True) -> List[Path]:
+        """
+        Promote the current staging bucket content to the production bucket without re-building the site
+
+        The objects of the latest staging build (or the staging bucket listing if no build is recorded) are copied
+        server-side to the production bucket, skipping objects that are already identical.
+        If `delete_stale` is True, production objects not in the staging object set are deleted.
+        Raises TransferError if any object fails to copy after retries.
+        Returns the relative paths of the copied objects.
+        """
+        from .functions import promote_staticsite
+        return promote_staticsite(self, max_workers=max_workers, delete_stale=delete_stale)
 
     class Meta:
         unique_together = (
@@ -142,7 +210,7 @@ class StaticPageBase(UserCreatedDatetimeModel):
         help_text=_('Index template (in django template language format)')
     )
 
-    def get_template_relpaths(self) -> list:
+    def get_template_relpaths(self) -> List[Path]:
         """
         Get all relative paths contained in self.template for the following elements:
 
@@ -151,80 +219,112 @@ class StaticPageBase(UserCreatedDatetimeModel):
         - script
 
         > This is used in order to determine if all necessary relative assets are registered and provided
+        > Results are cached per template content (see caches.get_template_relpaths())
         """
-        relative_path_files = []
+        return get_template_relpaths(self.template)
 
-        soup = BeautifulSoup(self.template, features="html.parser")
-        links = soup.find_all('link')
-        for link in links:
-            href_attr = link.attrs.get('href')
-            if href_attr and not href_attr.startswith('http'):
-                relative_path_files.append(Path(href_attr))
+    @property
+    def relative_filepath(self) -> Path:
+        return Path(str(self.relative_path), str(self.filename))
 
-        scripts = soup.find_all('script')
-        for script in scripts:
-            src_attr = script.attrs.get('src')
-            if src_attr and not src_attr.startswith('http'):
-                relative_path_files.append(Path(src_attr))
+    def get_asset_paths(self) -> Dict[str, str]:
+        """
+        Get the fingerprinted paths {RELATIVE_PATH: FINGERPRINTED_RELATIVE_PATH} of the PageAssets referenced by the template
+        (see get_template_relpaths()), including the transcoded variants of image assets.
+        Empty if the site does not fingerprint assets (StaticSite.fingerprint_assets).
 
-        images = soup.find_all('img')
-        for image in images:
-            src_attr = image.attrs.get('src')
-            if src_attr and not src_attr.startswith('http'):
-                relative_path_files.append(Path(src_attr))
+        > Assets only referenced from other assets (css url()) are not fingerprinted,
+        > fingerprinted assets are also written to their original path (see staticsites.fingerprints.get_asset_targets())
+        """
+        template_relpaths = set(self.get_template_relpaths())
+        if not template_relpaths or not self.site.fingerprint_assets:
+            return {}
+        asset_paths = {}
+        for asset in PageAsset.objects.filter(page=self):
+            if asset.relative_filepath in template_relpaths:
+                asset_paths.update(asset.get_fingerprinted_paths())
+        return asset_paths
 
-        return relative_path_files
+    def get_compiled_template(self) -> Template:
+        """Get the compiled django template for self.template (cached process-wide)"""
+        return get_compiled_template(self.id, self.template)
 
-    @property
-    def relative_filepath(self) -> Path:
-        return Path(str(self.relative_path), str(self.filename))
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        super().save(*args, **kwargs)
+        invalidate_page_templates(self.id)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Tuple[int, Dict[str, int]]:
+        page_id = self.id
+        result = super().delete(*args, **kwargs)
+        invalidate_page_templates(page_id)
+        return result
 
     def _check_for_expected_assets(self) -> List[Path]:
         """
         check that expected assets are registered
-        Raises ValueError if expected assets are *NOT* registered as PageAssets
+        Raises ValueError if expected assets are *NOT* registered as PageAssets of the page
         """
         expected_assets_relative_paths = self.get_template_relpaths()
         if expected_assets_relative_paths:
-            condition = None
-            for relative_filepath in expected_assets_relative_paths:
-                relative_path = str(relative_filepath.parent)
-                filename = relative_filepath.name
-
-                # update QuerySet with OR operation
-                if not condition:
-                    condition = Q(
-                        filename=filename,
-                        relative_path=relative_path
-                    )
-                else:
-                    condition |= Q(
-                        filename=filename,
-                        relative_path=relative_path
-                    )
-            existing_assets_qs = PageAsset.objects.filter(condition)
+            # single indexed query for the page's registered assets, regardless of the number of referenced assets
             registered_assets = set(
-                Path(a.relative_path, a.filename) for a in existing_assets_qs
+                Path(relative_path, filename)
+                for relative_path, filename in PageAsset.objects.filter(page=self).values_list('relative_path', 'filename')
             )
-            if registered_assets != set(expected_assets_relative_paths):
-                missing = set(expected_assets_relative_paths) - registered_assets
+            missing = set(expected_assets_relative_paths) - registered_assets
+            if missing:
                 raise ValueError(f'PageAssets in template not registered: {missing}')
 
         return expected_assets_relative_paths
 
-    def prepare_assets(self, target_root_directory: Path) -> Generator[Tuple[Path, Path], None, None]:
+    def prepare_assets(self,
+                       target: Union[Path, BuildSink],
+                       storage_copies: Optional[List[dict]] = None,
+                       renderer: Optional[PageRenderer] = None) -> Generator[Tuple[Optional[Path], Path], None, None]:
         """
-        Instantiate registered assets to the given target_root_directory
+        Instantiate registered assets to the given target BuildSink (or root directory)
+        Yields the (absolute_filepath, relative_filepath) of each written asset,
+        where absolute_filepath is None if the sink does not write to the local filesystem.
+
+        If a storage_copies list is given, assets stored in an S3 bucket are *NOT* written to the sink,
+        instead a copy definition (see PageAsset.get_storage_copy()) is appended to storage_copies
+        so that the asset can be copied server-side.
+        Assets transformed or compressed by the sink (text assets, see BuildSink.is_stored_as_is()) are always written to the sink.
+        Image assets are also instantiated as transcoded variants (see PageAsset.get_image_variants()).
+        Assets referenced by the template are also written to their fingerprinted path if enabled (see get_asset_paths()).
+        If a renderer is given, assets transformed by the sink (minified CSS/JS) are written through it,
+        so that they are transformed in the render worker processes (see PageRenderer.write()).
         """
+        sink = as_build_sink(target)
         self._check_for_expected_assets()
 
-        for asset in PageAsset.objects.filter(page=self):
-            absolute_filepath = target_root_directory / str(asset.relative_path) / str(asset.filename)
-            relative_filepath = Path(str(asset.relative_path), str(asset.filename))
-
-            logger.info(f'Writing PageAsset({relative_filepath}) to ({target_root_directory}) ...')
-            asset.instantiate(target_root_directory)
-            yield absolute_filepath, relative_filepath
+        assets = list(PageAsset.objects.filter(page=self))
+        # transcoded variants of image assets are prepared in parallel
+        image_assets = [asset for asset in assets if asset.get_image_variants()]
+        prepared_variants = prepare_images_derivatives(
+            [(asset.get_file_hash(), str(asset.filename), asset.load_file_content) for asset in image_assets],
+            sizes={},
+        )
+        variant_storage_names = {asset.id: storage_names for asset, storage_names in zip(image_assets, prepared_variants)}
+
+        asset_paths = self.get_asset_paths()
+        for asset in assets:
+            yield from asset.instantiate_variants(sink, storage_copies, variant_storage_names.get(asset.id, {}), asset_paths)
+
+            for relative_filepath, cache_control in get_asset_targets(asset.relative_filepath, asset_paths):
+                if storage_copies is not None and sink.is_stored_as_is(relative_filepath):
+                    storage_copy = asset.get_storage_copy(relative_filepath, cache_control)
+                    if storage_copy:
+                        storage_copies.append(storage_copy)
+                        continue
+
+                logger.info(f'Writing PageAsset({relative_filepath}) ...')
+                if renderer is not None and sink.get_transforms(relative_filepath):
+                    renderer.write(sink, relative_filepath, asset.load_file_content(), cache_control)
+                    absolute_filepath = sink.get_absolute_filepath(relative_filepath)
+                else:
+                    absolute_filepath = asset.instantiate(sink, relative_filepath, cache_control)
+                yield absolute_filepath, relative_filepath
 
     class Meta:
         unique_together = (
@@ -247,25 +347,62 @@ class IndexPage(StaticPageBase):
             return True
         return False
 
-    def instantiate(self, root_directory: Path) -> List[dict]:
-
-        # prepare template
-        django_engine = engines['django']
-        template = django_engine.from_string(self.template)
+    def get_dependency_hash(self, newsitems: Optional[list] = None, asset_paths: Optional[Dict[str, str]] = None) -> str:
+        """Hash of all inputs used to render the page (including the fingerprinted asset paths, if any)"""
+        values = [
+            self.template,
+            self.newsitems_template_variablename,
+            [(newsitem.id, newsitem.updated_datetime) for newsitem in newsitems or []],
+        ]
+        if asset_paths:
+            values.append(sorted(asset_paths.items()))
+        return calculate_dependency_hash(*values)
+
+    def instantiate(self,
+                    target: Union[Path, BuildSink],
+                    previous_dependency_hashes: Optional[Dict[str, str]] = None,
+                    storage_copies: Optional[List[dict]] = None,
+                    renderer: Optional[PageRenderer] = None) -> List[dict]:
+        """
+        Create instantiated HTML in the given target BuildSink (or root directory)
 
-        news_context = None
+        If previous_dependency_hashes ({KEY: DEPENDENCY_HASH}) is given and the page inputs are unchanged
+        since the previous build the page is *NOT* rendered (page_data 'is_rendered' is False).
+        If a renderer is given, the page is rendered through it (possibly in another process, see PageRenderer),
+        otherwise it is rendered immediately.
+        > storage_copies is accepted for compatibility with NewsPage.instantiate(), the IndexPage produces no storage files
+        """
+        newsitems = None
         if self.has_news:
             newspage = self.site.get_newspage()
 
             # get latest MAX_INDEX_NEWSITEMS news items
+            newsitems = list(newspage.get_latest_n_published(n=settings.MAX_INDEX_NEWSITEMS))
+
+        asset_paths = self.get_asset_paths()
+        page_data = {
+            'filename': self.filename,
+            'relative_path': self.relative_filepath,
+            'dependency_hash': self.get_dependency_hash(newsitems, asset_paths),
+            'is_rendered': False,
+        }
+        previous_dependency_hashes = previous_dependency_hashes or {}
+        if previous_dependency_hashes.get(str(self.relative_filepath)) == page_data['dependency_hash']:
+            logger.info(f'Unchanged, skipping ({self.relative_filepath}) ...')
+            return [page_data]
+
+        news_context = None
+        if self.has_news:
             news_context = {
-                self.newsitems_template_variablename: newspage.get_latest_n_published(n=settings.MAX_INDEX_NEWSITEMS)
+                self.newsitems_template_variablename: newsitems
             }
-        filepath = root_directory / str(self.relative_path) / str(self.filename)
-        with filepath.open('w', encoding='utf8') as html_out:
-            html = template.render(context=news_context)
-            html_out.write(html)
-        return [{'filename': self.filename}]
+        sink = as_build_sink(target)
+        if renderer is not None:
+            renderer.render(self.id, self.template, news_context, sink, self.relative_filepath, asset_paths)
+        else:
+            sink.write_text(self.relative_filepath, render_html(self.id, self.template, news_context, asset_paths))
+        page_data['is_rendered'] = True
+        return [page_data]
 
     def save(self, *args, **kwargs):
         self.filename = 'index.html'
@@ -303,18 +440,436 @@ class PageAsset(UserCreatedDatetimeModel):
     # to save file content use:
     # model.file_content.save(FILENAME, ContentFile(b'content'))
     file_content = models.FileField()
+    file_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        editable=False,
+        help_text=_('sha256 of the file content, used to key the transcoded image variants and fingerprinted filenames')
+    )
 
     @property
     def relative_filepath(self) -> Path:
         return Path(str(self.relative_path), str(self.filename))
 
-    def instantiate(self, root_directory: Path) -> Path:
+    def get_image_variants(self) -> List[ImageVariant]:
+        """Get the transcoded variants (see staticsites.images.get_image_variants()) of image assets, empty for other file types"""
+        if self.file_type != 'img':
+            return []
+        return get_image_variants(str(self.filename), {})
+
+    def get_variant_relative_filepath(self, derivative_name: str, image_format: Optional[str] = None) -> Path:
+        return Path(str(self.relative_path), get_derivative_filename(str(self.filename), derivative_name, image_format))
+
+    def get_file_hash(self) -> str:
+        """Get the file content hash, calculated (and saved) if not yet set"""
+        if not self.file_hash:
+            with self.file_content.open('rb') as file_content:
+                self.file_hash = calculate_sha256(file_content)
+            PageAsset.objects.filter(pk=self.pk).update(file_hash=self.file_hash)
+        return self.file_hash
+
+    def get_fingerprinted_paths(self) -> Dict[str, str]:
+        """
+        Get the content-hashed paths {RELATIVE_PATH: FINGERPRINTED_RELATIVE_PATH} of the asset and its transcoded variants
+        > Variants are fingerprinted by the source content and the variant spec (format and quality)
+        """
+        file_hash = self.get_file_hash()
+        paths = {
+            str(self.relative_filepath): str(Path(str(self.relative_path), get_fingerprinted_filename(str(self.filename), file_hash)))
+        }
+        for derivative_name, image_format in self.get_image_variants():
+            variant_filepath = self.get_variant_relative_filepath(derivative_name, image_format)
+            variant_hash = calculate_dependency_hash(file_hash, derivative_name, image_format, settings.IMAGE_DERIVATIVE_QUALITY)
+            paths[str(variant_filepath)] = str(Path(str(self.relative_path), get_fingerprinted_filename(variant_filepath.name, variant_hash)))
+        return paths
+
+    def load_file_content(self) -> bytes:
+        with self.file_content.open('rb') as file_content:
+            return file_content.read()
+
+    def instantiate_variants(self,
+                             target: Union[Path, BuildSink],
+                             storage_copies: Optional[List[dict]],
+                             variant_storage_names: Dict[ImageVariant, str],
+                             asset_paths: Optional[Dict[str, str]] = None) -> Generator[Tuple[Optional[Path], Path], None, None]:
+        """
+        Write the given prepared variants {(DERIVATIVE_NAME, IMAGE_FORMAT): STORAGE_NAME} to the target BuildSink (or root directory)
+        Yields the (absolute_filepath, relative_filepath) of each written variant,
+        variants stored in an S3 bucket are appended to storage_copies (if given) instead of being written.
+        Variants included in asset_paths are also written to their fingerprinted path (see StaticPageBase.get_asset_paths())
+        """
+        sink = as_build_sink(target)
+        for (derivative_name, image_format), storage_name in variant_storage_names.items():
+            variant_filepath = self.get_variant_relative_filepath(derivative_name, image_format)
+            for relative_filepath, cache_control in get_asset_targets(variant_filepath, asset_paths or {}):
+                if storage_copies is not None:
+                    storage_copy = get_storage_name_copy(default_storage, storage_name, relative_filepath, 'pageasset', self.id)
+                    if storage_copy:
+                        if cache_control:
+                            storage_copy['cache_control'] = cache_control
+                        storage_copies.append(storage_copy)
+                        continue
+                logger.info(f'Writing PageAsset({relative_filepath}) ...')
+                with default_storage.open(storage_name, 'rb') as variant_in:
+                    sink.write_fileobj(relative_filepath, variant_in, settings.FILE_COPY_CHUNK_SIZE, cache_control)
+                yield sink.get_absolute_filepath(relative_filepath), relative_filepath
+
+    def get_storage_copy(self, relative_filepath: Optional[Path] = None, cache_control: Optional[str] = None) -> Optional[dict]:
         """
-        copy file from upload location to target path
-        On upload, file is saved at MEDIA Bucket location, copy locally in order to instaniate for bucket sync operation
+        Get the server-side copy definition for the asset if file_content is stored in an S3 bucket
+        The asset is copied to relative_filepath (the asset relative_filepath if not given) with the given cache_control (if given).
+        Returns None if the file is not stored in an S3 bucket
         """
-        output_filepath = root_directory / str(self.relative_path) / str(self.filename)
-        output_filepath.parent.mkdir(exist_ok=True, parents=True)  # create relative directories
-        with output_filepath.open('wb') as output:
-            output.write(self.file_content.read())
-        return output_filepath
+        location = get_storage_location(self.file_content)
+        if not location:
+            return None
+        source_bucket, source_key = location
+        storage_copy = {
+            'relative_path': relative_filepath or self.relative_filepath,
+            'source_bucket': source_bucket,
+            'source_key': source_key,
+            'source_type': 'pageasset',
+            'source_id': self.id,
+            'file_hash': self.get_file_hash(),
+        }
+        if cache_control:
+            storage_copy['cache_control'] = cache_control
+        return storage_copy
+
+    def instantiate(self,
+                    target: Union[Path, BuildSink],
+                    relative_filepath: Optional[Path] = None,
+                    cache_control: Optional[str] = None) -> Optional[Path]:
+        """
+        copy file from upload location to the target BuildSink (or root directory)
+        On upload, file is saved at MEDIA Bucket location, copy in order to instaniate for bucket sync operation
+        The file is written to relative_filepath (the asset relative_filepath if not given) with the given cache_control (if given).
+        Returns the local path of the written file (None if the sink does not write to the local filesystem)
+        """
+        sink = as_build_sink(target)
+        relative_filepath = relative_filepath or self.relative_filepath
+        with self.file_content.open('rb') as file_content:
+            sink.write_fileobj(relative_filepath, file_content, settings.FILE_COPY_CHUNK_SIZE, cache_control)
+        return sink.get_absolute_filepath(relative_filepath)
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        # hash new uploads, so that transcoded image variants and fingerprinted filenames are keyed by content
+        if not self.file_content:
+            self.file_hash = ''
+        elif not self.file_content._committed or not self.file_hash:
+            self.file_content.open('rb')
+            self.file_hash = calculate_sha256(self.file_content)
+            self.file_content.seek(0)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['page', 'relative_path', 'filename'], name='staticsites_pageasset_path_idx'),
+        ]
+
+
+BUILD_SOURCE_TYPE_CHOICES = (
+    ('indexpage', 'IndexPage'),
+    ('newspage', 'NewsPage'),
+    ('pageasset', 'PageAsset'),
+    ('newsitem_image', 'NewsItem image'),
+)
+
+
+class StaticSiteBuild(models.Model):
+    """Manifest of the objects generated and synced to a bucket by a single StaticSite.sync() call"""
+    site = models.ForeignKey(
+        StaticSite,
+        on_delete=models.CASCADE,
+    )
+    bucket_name = models.CharField(
+        max_length=63,
+        help_text=_('S3 bucket the build was synced to')
+    )
+    is_production = models.BooleanField(
+        default=False
+    )
+    object_count = models.PositiveIntegerField(
+        default=0,
+        help_text=_('Number of objects generated by the build')
+    )
+    total_bytes = models.BigIntegerField(
+        default=0,
+        help_text=_('Total size of objects generated by the build')
+    )
+    transferred_count = models.PositiveIntegerField(
+        default=0,
+        help_text=_('Number of objects uploaded by the build')
+    )
+    created_datetime = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    def get_dependency_hashes(self, existing_etags: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        Get the {KEY: DEPENDENCY_HASH} of rendered pages in the build
+        If the existing_etags ({KEY: ETAG}) of the bucket are given, pages whose object is missing from the bucket (or differs)
+        are excluded so that they are rendered again, and no page is included if a NewsItem image of the build is missing
+        (the images of unrendered pages are not written).
+
+        > Objects with (or copied from) a multipart upload ETag ('-' suffix) can only be checked for existence
+        """
+        build_objects = list(self.build_objects.values_list('key', 'md5', 'source_type', 'dependency_hash'))
+        dependency_hashes = {}
+        for key, md5, source_type, dependency_hash in build_objects:
+            if existing_etags is not None:
+                etag = existing_etags.get(key)
+                if etag is None or (etag != md5 and '-' not in etag + md5):
+                    logger.warning(f'Object of StaticSiteBuild({self.pk}) missing from s3://{self.bucket_name}: {key}')
+                    if source_type == 'newsitem_image':
+                        return {}
+                    continue
+            if dependency_hash is not None:
+                dependency_hashes[key] = dependency_hash
+        return dependency_hashes
+
+    def __str__(self) -> str:
+        return f'StaticSiteBuild({self.site_id}, s3://{self.bucket_name}, {self.created_datetime})'
+
+    class Meta:
+        get_latest_by = 'created_datetime'
+
+
+class StaticSiteBuildObject(models.Model):
+    build = models.ForeignKey(
+        StaticSiteBuild,
+        on_delete=models.CASCADE,
+        related_name='build_objects',
+    )
+    # limited to fit the (build, key) unique index within the InnoDB 3072 byte index key limit (utf8mb4)
+    key = models.CharField(
+        max_length=700,
+        help_text=_('S3 object key (relative path from the site root)')
+    )
+    md5 = models.CharField(
+        max_length=40,
+        help_text=_('Hex md5 digest of the object content (S3 ETag for objects copied from multipart uploads)')
+    )
+    size = models.BigIntegerField()
+    content_type = models.CharField(
+        max_length=100,
+    )
+    content_encoding = models.CharField(
+        max_length=10,
+        null=True,
+        blank=True,
+        help_text=_('Content-Encoding of the stored object (gzip, br), blank if stored as is')
+    )
+    source_type = models.CharField(
+        max_length=25,
+        null=True,
+        blank=True,
+        choices=BUILD_SOURCE_TYPE_CHOICES,
+    )
+    source_id = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text=_('id of the object (of source_type) that produced the key')
+    )
+    page_number = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text=_('Page number for paginated NewsPage output')
+    )
+    dependency_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text=_('Hash of the inputs used to render the page (used to skip rendering of unchanged pages)')
+    )
+
+    class Meta:
+        unique_together = (
+            'build',
+            'key'
+        )
+
+
+SYNC_JOB_STATUS_QUEUED = 'queued'
+SYNC_JOB_STATUS_RUNNING = 'running'
+SYNC_JOB_STATUS_SUCCEEDED = 'succeeded'
+SYNC_JOB_STATUS_FAILED = 'failed'
+SYNC_JOB_STATUS_CHOICES = (
+    (SYNC_JOB_STATUS_QUEUED, 'queued'),
+    (SYNC_JOB_STATUS_RUNNING, 'running'),
+    (SYNC_JOB_STATUS_SUCCEEDED, 'succeeded'),
+    (SYNC_JOB_STATUS_FAILED, 'failed'),
+)
+
+
+class SyncJob(UserCreatedDatetimeModel):
+    """A StaticSite.sync() executed out of band by the configured SYNC_JOB_BACKEND (see StaticSite.enqueue_sync())"""
+    site = models.ForeignKey(
+        StaticSite,
+        on_delete=models.CASCADE,
+        related_name='sync_jobs',
+    )
+    update_production = models.BooleanField(
+        default=False
+    )
+    incremental = models.BooleanField(
+        default=False
+    )
+    delete_stale = models.BooleanField(
+        default=False
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=SYNC_JOB_STATUS_CHOICES,
+        default=SYNC_JOB_STATUS_QUEUED,
+        editable=False,
+    )
+    phase = models.CharField(
+        max_length=20,
+        blank=True,
+        editable=False,
+        help_text=_('Current sync phase of a running job')
+    )
+    completed_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Number of objects transferred')
+    )
+    total_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Number of objects to transfer')
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        help_text=_('The job is not started before this time (extended when further sync requests are coalesced)')
+    )
+    coalesced_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Number of additional sync requests merged into the job')
+    )
+    error = models.TextField(
+        blank=True,
+        editable=False,
+    )
+    build = models.ForeignKey(
+        StaticSiteBuild,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Build recorded by a succeeded job')
+    )
+    started_datetime = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    finished_datetime = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    @property
+    def bucket_name(self) -> str:
+        return self.site.production_bucket if self.update_production else self.site.staging_bucket
+
+    @property
+    def elapsed_seconds(self) -> Optional[float]:
+        if not self.started_datetime:
+            return None
+        finished_datetime = self.finished_datetime or timezone.now()
+        return (finished_datetime - self.started_datetime).total_seconds()
+
+    def get_wait_seconds(self) -> float:
+        """Seconds until the job debounce window closes (0 if the job is due)"""
+        return max(0.0, (self.run_after - timezone.now()).total_seconds())
+
+    def claim(self) -> bool:
+        """
+        Mark a queued, due job as running
+        Returns False if the job was already claimed (by another worker), is not yet due,
+        or another job of the same site is running (at most one running job per site)
+
+        > Running jobs started more than SYNC_JOB_STALE_SECONDS ago are assumed to have died and do not block the site
+        """
+        started_datetime = timezone.now()
+        stale_datetime = started_datetime - timezone.timedelta(seconds=settings.SYNC_JOB_STALE_SECONDS)
+        with transaction.atomic():
+            # lock the site row to serialize claims of the site's jobs
+            StaticSite.objects.select_for_update().filter(pk=self.site_id).first()
+            is_site_busy = SyncJob.objects.filter(
+                site_id=self.site_id,
+                status=SYNC_JOB_STATUS_RUNNING,
+                started_datetime__gt=stale_datetime,
+            ).exists()
+            if is_site_busy:
+                return False
+            claimed = SyncJob.objects.filter(pk=self.pk, status=SYNC_JOB_STATUS_QUEUED, run_after__lte=started_datetime).update(
+                status=SYNC_JOB_STATUS_RUNNING,
+                started_datetime=started_datetime,
+            )
+        if claimed:
+            self.status = SYNC_JOB_STATUS_RUNNING
+            self.started_datetime = started_datetime
+        return bool(claimed)
+
+    def update_progress(self, phase: str, completed_count: int, total_count: int) -> None:
+        """Record the progress of a running job"""
+        self.phase = phase
+        self.completed_count = completed_count
+        self.total_count = total_count
+        SyncJob.objects.filter(pk=self.pk).update(phase=phase, completed_count=completed_count, total_count=total_count)
+
+    def run(self) -> bool:
+        """
+        Claim and run the queued job, recording the result status (and error) on completion
+        Returns True if the job was run, False if it could not be claimed (see claim())
+
+        > Progress is written to the database at most every SYNC_JOB_PROGRESS_UPDATE_SECONDS
+        """
+        if not self.claim():
+            logger.info(f'SyncJob({self.pk}) could not be claimed ({self.status}, run_after={self.run_after}), skipping ...')
+            return False
+
+        last_progress_update = 0.0
+
+        def progress_callback(phase: str, completed_count: int, total_count: int) -> None:
+            nonlocal last_progress_update
+            now = time.monotonic()
+            is_phase_change = phase != self.phase
+            is_complete = completed_count == total_count
+            if is_phase_change or is_complete or now - last_progress_update >= settings.SYNC_JOB_PROGRESS_UPDATE_SECONDS:
+                self.update_progress(phase, completed_count, total_count)
+                last_progress_update = now
+
+        logger.info(f'Running SyncJob({self.pk}) for StaticSite({self.site_id}) to s3://{self.bucket_name} ...')
+        try:
+            self.site.sync(
+                update_production=self.update_production,
+                incremental=self.incremental,
+                delete_stale=self.delete_stale,
+                progress_callback=progress_callback,
+            )
+            self.build = self.site.get_latest_build(self.bucket_name)
+            self.status = SYNC_JOB_STATUS_SUCCEEDED
+        except Exception as e:  # the failure is recorded on the job, as there is no caller to raise to
+            logger.exception(f'SyncJob({self.pk}) failed: {e}')
+            self.error = f'{e.__class__.__name__}: {e}'
+            self.status = SYNC_JOB_STATUS_FAILED
+        self.finished_datetime = timezone.now()
+        self.save()
+        return True
+
+    def __str__(self) -> str:
+        return f'SyncJob({self.pk}, {self.site_id}, s3://{self.bucket_name}, {self.status})'
+
+    class Meta:
+        get_latest_by = 'created_datetime'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='staticsites_syncjob_due_idx'),
+        ]
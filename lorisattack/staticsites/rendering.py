@@ -0,0 +1,189 @@
+import os
+import logging
+import multiprocessing
+from pathlib import Path
+from types import TracebackType
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Type
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait as wait_futures
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+from .caches import get_compiled_template
+from .fingerprints import rewrite_asset_references
+from .transforms import transform_content, transform_text
+from .sinks import BuildSink
+
+
+logger = logging.getLogger(__name__)
+
+RENDER_MAX_PENDING_PER_PROCESS = 2
+
+
+def get_render_max_processes(max_processes: int = settings.RENDER_MAX_PROCESSES) -> int:
+    """Resolve the number of render processes, where 0 uses all available cores"""
+    if max_processes <= 0:
+        return os.cpu_count() or 1
+    return max_processes
+
+
+def get_render_mp_context() -> BaseContext:
+    """
+    Get the multiprocessing context of the render process pool
+
+    > 'fork' is not used: workers would inherit the parent database connections (closing them on exit),
+    > and the locks held by running threads (S3Sink upload threads, boto3 connection pools) at the time of the fork.
+    > 'forkserver' workers are forked from a clean server process, 'spawn' is used where 'forkserver' is not available.
+    """
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(start_method)
+
+
+def close_database_connections() -> None:
+    """
+    Close the database connections of the current process before starting the render workers
+    > Connections in an atomic block are left open, closing them would mark the transaction for rollback
+    """
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def initialize_render_worker() -> None:
+    """Prepare a render worker process (new interpreter, see get_render_mp_context())"""
+    if not apps.ready:
+        django.setup()
+
+
+def render_html(page_id: Optional[int], template_text: str, context: Optional[dict], asset_paths: Optional[Dict[str, str]] = None) -> str:
+    """
+    Render the given page template text with context
+    If given, asset references are rewritten to the fingerprinted asset_paths {RELATIVE_PATH: FINGERPRINTED_RELATIVE_PATH}
+    """
+    template = get_compiled_template(page_id, template_text)
+    html = template.render(context=context)
+    if asset_paths:
+        html = rewrite_asset_references(html, asset_paths)
+    return html
+
+
+def render_transformed_html(page_id: Optional[int],
+                            template_text: str,
+                            context: Optional[dict],
+                            asset_paths: Optional[Dict[str, str]],
+                            transform_paths: Tuple[str, ...]) -> str:
+    """Render the page (see render_html()) and apply the given transforms (see staticsites.transforms.transform_text())"""
+    return transform_text(render_html(page_id, template_text, context, asset_paths), transform_paths)
+
+
+class PageRenderer:
+    """
+    Render page templates to a BuildSink, either in the current process (max_processes == 1) or across a process pool.
+    The process pool is started once min_pool_pages pages (and transformed CSS/JS assets) were rendered in the current process,
+    so that small sites do not pay the worker startup cost.
+    Context data is pickled and sent to the worker processes, so it must contain only evaluated objects (lists, not QuerySets).
+    Rendered HTML is written to the sink in the calling process as renders complete,
+    render() blocks while RENDER_MAX_PENDING_PER_PROCESS renders per process are pending.
+    When rendering across a process pool, the sink transforms (minification) are also applied in the worker processes,
+    for rendered pages and for the content written with write() (CSS/JS PageAssets).
+    If the process pool cannot be started (no /dev/shm semaphore support, as on AWS Lambda), pages are rendered sequentially.
+
+    > Used as a context manager, pending renders are completed on exit and the first failure is raised
+    """
+
+    def __init__(self, max_processes: int = settings.RENDER_MAX_PROCESSES, min_pool_pages: int = settings.RENDER_POOL_MIN_PAGES) -> None:
+        self.max_processes = get_render_max_processes(max_processes)
+        self.min_pool_pages = min_pool_pages
+        self.executor = None  # type: Optional[ProcessPoolExecutor]
+        self.futures = {}  # type: Dict[Future, Tuple[BuildSink, Path, Optional[str]]]
+        self._page_count = 0
+        self._is_pool_requested = False
+
+    def __enter__(self) -> 'PageRenderer':
+        return self
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Get the process pool, started once min_pool_pages pages were rendered, None while rendering in the current process"""
+        if self._is_pool_requested or self.max_processes <= 1 or self._page_count < self.min_pool_pages:
+            return self.executor
+        self._is_pool_requested = True
+        logger.info(f'Rendering pages with {self.max_processes} processes ...')
+        close_database_connections()
+        try:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=get_render_mp_context(),
+                initializer=initialize_render_worker,
+            )
+        except OSError as e:
+            logger.warning(f'Unable to start the render process pool ({e}), rendering sequentially')
+        return self.executor
+
+    def _submit(self, executor: ProcessPoolExecutor, sink: BuildSink, relative_filepath: Path, cache_control: Optional[str], func: Callable, *args: Any) -> None:
+        # bound the number of pending renders (and their pickled contexts and results) held in memory
+        while len(self.futures) >= self.max_processes * RENDER_MAX_PENDING_PER_PROCESS:
+            done, _ = wait_futures(self.futures, return_when=FIRST_COMPLETED)
+            self._write(done)
+        future = executor.submit(func, *args)
+        self.futures[future] = (sink, relative_filepath, cache_control)
+        self._write([future for future in self.futures if future.done()])
+
+    def render(self,
+               page_id: Optional[int],
+               template_text: str,
+               context: Optional[dict],
+               sink: BuildSink,
+               relative_filepath: Path,
+               asset_paths: Optional[Dict[str, str]] = None) -> None:
+        """Render the page (see render_html()) and write the resulting HTML to the sink at relative_filepath (see wait())"""
+        executor = self._get_executor()
+        self._page_count += 1
+        if executor is None:
+            sink.write_text(relative_filepath, render_html(page_id, template_text, context, asset_paths))
+        else:
+            transform_paths = sink.get_transforms(relative_filepath)
+            self._submit(executor, sink, relative_filepath, None, render_transformed_html, page_id, template_text, context, asset_paths, transform_paths)
+
+    def write(self, sink: BuildSink, relative_filepath: Path, content: bytes, cache_control: Optional[str] = None) -> None:
+        """
+        Write the given content to the sink at relative_filepath (see wait()),
+        where the sink transforms are applied in the worker processes (see staticsites.transforms.transform_content())
+        """
+        transform_paths = sink.get_transforms(relative_filepath)
+        if not transform_paths:
+            sink.write(relative_filepath, content, cache_control)
+            return
+        executor = self._get_executor()
+        self._page_count += 1
+        if executor is None:
+            sink.write(relative_filepath, content, cache_control)
+        else:
+            self._submit(executor, sink, relative_filepath, cache_control, transform_content, content, transform_paths)
+
+    def _write(self, futures: Iterable[Future]) -> None:
+        for future in futures:
+            sink, relative_filepath, cache_control = self.futures.pop(future)
+            content = future.result()
+            if isinstance(content, str):
+                content = content.encode('utf8')
+            sink.write(relative_filepath, content, cache_control, is_transformed=True)
+
+    def wait(self) -> None:
+        """Wait for all pending renders to complete and be written, raising the first failure"""
+        self._write(as_completed(list(self.futures)))
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+            self.futures = {}
@@ -0,0 +1,512 @@
+import io
+import time
+import queue
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
+from pathlib import Path
+from types import TracebackType
+from functools import partial
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from typing import IO, Any, BinaryIO, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Type, Union
+
+from django.conf import settings
+
+from .compression import compress, get_cache_control, get_content_encoding, is_compressible
+from .transforms import Transforms, get_file_transforms, normalize_transforms, transform_content
+from .transfers import (
+    RETRYABLE_EXCEPTIONS,
+    TransferSummary,
+    run_transfers,
+    upload_file_with_retry,
+    upload_fileobj_with_retry,
+    put_object_with_retry,
+)
+
+
+logger = logging.getLogger(__name__)
+
+BUILD_SINK_FILESYSTEM = 'filesystem'
+BUILD_SINK_MEMORY = 'memory'
+BUILD_SINK_S3 = 's3'
+
+
+class BuildFile:
+    """
+    A file written to a BuildSink
+    md5 and size are of the stored content, compressed with content_encoding if set
+    cache_control defaults to the Cache-Control of the content type (see staticsites.compression.get_cache_control())
+    """
+
+    def __init__(self,
+                 relative_path: Path,
+                 md5: str,
+                 size: int,
+                 content_type: Optional[str] = None,
+                 content_encoding: Optional[str] = None,
+                 cache_control: Optional[str] = None):
+        self.relative_path = relative_path
+        self.md5 = md5
+        self.size = size
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.cache_control = cache_control or get_cache_control(content_type)
+
+    @property
+    def key(self) -> str:
+        return str(self.relative_path)
+
+    def get_extra_args(self) -> dict:
+        """Get the object metadata (ContentType, ContentEncoding and CacheControl) set on upload"""
+        extra_args = {'CacheControl': self.cache_control}
+        if self.content_type:
+            extra_args['ContentType'] = self.content_type
+        if self.content_encoding:
+            extra_args['ContentEncoding'] = self.content_encoding
+        return extra_args
+
+    def __repr__(self) -> str:
+        return f'BuildFile({self.relative_path}, md5={self.md5}, size={self.size}, content_encoding={self.content_encoding})'
+
+
+class BuildSink:
+    """
+    Destination of the files produced by site instantiation (see instantiate_staticsite())
+    Written files are recorded in `files` ({KEY: BuildFile}) with their md5 and size,
+    so that they can be synced without walking and re-reading the output.
+    If transforms ({CONTENT_TYPE: (DOTTED_PATH, ...)}) are given, the text of matching files is transformed (minified) on write,
+    see staticsites.transforms.
+    If content_encoding ('gzip' or 'br') is given, compressible (text) files are stored compressed (see staticsites.compression).
+
+    > Used as a context manager, close() is called on exit
+    """
+
+    def __init__(self, content_encoding: Optional[str] = None, transforms: Optional[Transforms] = None):
+        self.files = {}  # type: Dict[str, BuildFile]
+        self.content_encoding = content_encoding
+        self.transforms = transforms or {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'BuildSink':
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the resources held by the sink"""
+
+    def get_absolute_filepath(self, relative_filepath: Path) -> Optional[Path]:
+        """Local path of the written file, None if the sink does not write to the local filesystem"""
+        return None
+
+    def get_content_encoding(self, relative_filepath: Path) -> Optional[str]:
+        """Get the Content-Encoding the given file is stored with, None if stored as is"""
+        if not self.content_encoding:
+            return None
+        content_type, _ = mimetypes.guess_type(str(relative_filepath))
+        if not is_compressible(content_type):
+            return None
+        return self.content_encoding
+
+    def get_transforms(self, relative_filepath: Path) -> Tuple[str, ...]:
+        """Get the transforms (dotted paths) applied to the given file on write, empty if written as is"""
+        return get_file_transforms(relative_filepath, self.transforms)
+
+    def is_stored_as_is(self, relative_filepath: Path) -> bool:
+        """True if the given file is stored as given (not transformed nor compressed), so that it may be copied server-side"""
+        return not self.get_content_encoding(relative_filepath) and not self.get_transforms(relative_filepath)
+
+    def _store(self, build_file: BuildFile, content: bytes) -> None:
+        raise NotImplementedError
+
+    def _store_fileobj(self, build_file: BuildFile, fileobj: IO[bytes], buffered_size: int) -> None:
+        """
+        Store the content of the given (spooled) file object, the sink is responsible for closing it
+        buffered_size is the number of bytes of the content held in memory (the rest is spooled to disk)
+        """
+        with fileobj:
+            self._store(build_file, fileobj.read())
+
+    def _upload_file(self, client: Any, bucket_name: str, build_file: BuildFile) -> int:
+        raise NotImplementedError
+
+    def _record(self, build_file: BuildFile) -> BuildFile:
+        with self._lock:
+            self.files[build_file.key] = build_file
+        return build_file
+
+    def write(self,
+              relative_filepath: Path,
+              content: bytes,
+              cache_control: Optional[str] = None,
+              is_transformed: bool = False) -> BuildFile:
+        """
+        Write the given content, transformed and compressed as configured
+        If is_transformed is True the content was already transformed (see PageRenderer), and is only compressed
+        """
+        relative_filepath = Path(relative_filepath)
+        if not is_transformed:
+            content = transform_content(content, self.get_transforms(relative_filepath))
+        content_type, _ = mimetypes.guess_type(str(relative_filepath))
+        content_encoding = self.get_content_encoding(relative_filepath)
+        if content_encoding:
+            content = compress(content, content_encoding)
+        build_file = BuildFile(relative_filepath, hashlib.md5(content).hexdigest(), len(content), content_type, content_encoding, cache_control)
+        self._store(build_file, content)
+        return self._record(build_file)
+
+    def write_text(self, relative_filepath: Path, text: str, is_transformed: bool = False) -> BuildFile:
+        return self.write(relative_filepath, text.encode('utf8'), is_transformed=is_transformed)
+
+    def write_fileobj(self,
+                      relative_filepath: Path,
+                      fileobj: BinaryIO,
+                      chunk_size: int = settings.FILE_COPY_CHUNK_SIZE,
+                      cache_control: Optional[str] = None) -> BuildFile:
+        """
+        Write the content of the given file object, read in chunk_size chunks
+        Files stored as is are streamed to a spooled temporary file (kept in memory up to chunk_size bytes, on disk otherwise).
+
+        > Files stored transformed or compressed are read into memory to be transformed and compressed
+        """
+        relative_filepath = Path(relative_filepath)
+        if not self.is_stored_as_is(relative_filepath):
+            buffer = io.BytesIO()
+            shutil.copyfileobj(fileobj, buffer, chunk_size)
+            return self.write(relative_filepath, buffer.getvalue(), cache_control)
+
+        spooled = SpooledTemporaryFile(max_size=chunk_size)
+        md5 = hashlib.md5()
+        size = 0
+        for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+            md5.update(chunk)
+            size += len(chunk)
+            spooled.write(chunk)
+        spooled.seek(0)
+        content_type, _ = mimetypes.guess_type(str(relative_filepath))
+        build_file = BuildFile(relative_filepath, md5.hexdigest(), size, content_type, cache_control=cache_control)
+        self._store_fileobj(build_file, spooled, min(size, chunk_size))
+        return self._record(build_file)
+
+    def get_changed_files(self, existing_etags: Optional[Dict[str, str]] = None) -> List[BuildFile]:
+        """
+        Get the written files that are new or differ from the existing objects
+        If existing_etags ({KEY: ETAG}) is None all written files are returned
+        """
+        if existing_etags is None:
+            return list(self.files.values())
+        return [build_file for key, build_file in self.files.items() if existing_etags.get(key) != build_file.md5]
+
+    def upload(self,
+               client: Any,
+               bucket_name: str,
+               existing_etags: Optional[Dict[str, str]] = None,
+               max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+               progress_callback: Optional[Callable[[Path], None]] = None) -> TransferSummary:
+        """
+        Upload the written files to the target bucket using a bounded thread pool.
+        If existing_etags ({KEY: ETAG}) is given, only new or changed files are uploaded (see get_changed_files()).
+
+        > Failures are collected in the resulting summary, they are *NOT* raised
+        """
+        tasks = (
+            (build_file.relative_path, partial(self._upload_file, client, bucket_name, build_file))
+            for build_file in self.get_changed_files(existing_etags)
+        )
+        summary = run_transfers(tasks, max_workers, progress_callback)
+        logger.info(f'Uploaded {len(summary.transferred)} files ({summary.total_bytes} bytes) to s3://{bucket_name} '
+                    f'in {summary.elapsed_seconds:.2f}s')
+        return summary
+
+
+class FilesystemSink(BuildSink):
+    """
+    Write files under the given root_directory
+    If no root_directory is given, a temporary directory is used (removed on close())
+    """
+
+    def __init__(self,
+                 root_directory: Optional[Path] = None,
+                 prefix: str = 'site-',
+                 content_encoding: Optional[str] = None,
+                 transforms: Optional[Transforms] = None):
+        super().__init__(content_encoding, transforms)
+        self._tempdir = None  # type: Optional[TemporaryDirectory]
+        if root_directory is None:
+            self._tempdir = TemporaryDirectory(prefix=prefix)
+            root_directory = Path(self._tempdir.name)
+        self.root_directory = root_directory
+
+    def close(self) -> None:
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+
+    def get_absolute_filepath(self, relative_filepath: Path) -> Path:
+        return self.root_directory / relative_filepath
+
+    def _store(self, build_file: BuildFile, content: bytes) -> None:
+        absolute_filepath = self.get_absolute_filepath(build_file.relative_path)
+        absolute_filepath.parent.mkdir(parents=True, exist_ok=True)
+        absolute_filepath.write_bytes(content)
+
+    def write_fileobj(self,
+                      relative_filepath: Path,
+                      fileobj: BinaryIO,
+                      chunk_size: int = settings.FILE_COPY_CHUNK_SIZE,
+                      cache_control: Optional[str] = None) -> BuildFile:
+        """
+        Stream the content of the given file object to disk in chunk_size chunks
+        > Files stored transformed or compressed are read into memory to be transformed and compressed
+        """
+        if not self.is_stored_as_is(relative_filepath):
+            return super().write_fileobj(relative_filepath, fileobj, chunk_size, cache_control)
+        absolute_filepath = self.get_absolute_filepath(relative_filepath)
+        absolute_filepath.parent.mkdir(parents=True, exist_ok=True)
+        md5 = hashlib.md5()
+        size = 0
+        with absolute_filepath.open('wb') as output:
+            for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+                md5.update(chunk)
+                size += len(chunk)
+                output.write(chunk)
+        content_type, _ = mimetypes.guess_type(str(relative_filepath))
+        return self._record(BuildFile(Path(relative_filepath), md5.hexdigest(), size, content_type, cache_control=cache_control))
+
+    def _upload_file(self, client: Any, bucket_name: str, build_file: BuildFile) -> int:
+        absolute_filepath = self.get_absolute_filepath(build_file.relative_path)
+        return upload_file_with_retry(client, absolute_filepath, bucket_name, build_file.key, extra_args=build_file.get_extra_args())
+
+
+class MemorySink(BuildSink):
+    """Keep written files in memory buffers"""
+
+    def __init__(self, content_encoding: Optional[str] = None, transforms: Optional[Transforms] = None):
+        super().__init__(content_encoding, transforms)
+        self.contents = {}  # type: Dict[str, bytes]
+
+    def _store(self, build_file: BuildFile, content: bytes) -> None:
+        with self._lock:
+            self.contents[build_file.key] = content
+
+    def get_content(self, relative_filepath: Path) -> bytes:
+        return self.contents[str(relative_filepath)]
+
+    def _upload_file(self, client: Any, bucket_name: str, build_file: BuildFile) -> int:
+        return put_object_with_retry(client, self.contents[build_file.key], bucket_name, build_file.key, extra_args=build_file.get_extra_args())
+
+
+class S3Sink(BuildSink):
+    """
+    Upload files to the target bucket as soon as they are written, so that uploading overlaps rendering.
+    Written files are put on a bounded queue consumed by max_workers upload threads,
+    writers block while max_pending files, or max_pending_bytes of in-memory content, are waiting to be uploaded (backpressure)
+    so that memory stays bounded. Files written with write_fileobj() are queued as spooled files.
+    If existing_etags ({KEY: ETAG}) is given, files identical to the existing object are not uploaded.
+
+    > Call upload() to wait for the queued uploads to complete.
+    > Used as a context manager, if the block raises (failed render) the queued uploads that have not started are discarded,
+    > so that a partial site is not published.
+    """
+
+    def __init__(self,
+                 client: Any,
+                 bucket_name: str,
+                 existing_etags: Optional[Dict[str, str]] = None,
+                 max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                 max_pending: int = settings.SYNC_PIPELINE_MAX_PENDING,
+                 max_pending_bytes: int = settings.SYNC_PIPELINE_MAX_PENDING_BYTES,
+                 content_encoding: Optional[str] = None,
+                 transforms: Optional[Transforms] = None):
+        super().__init__(content_encoding, transforms)
+        self.client = client
+        self.bucket_name = bucket_name
+        self.existing_etags = existing_etags
+        self._start = time.perf_counter()
+        self._results = []  # type: List[Tuple[BuildFile, int, Optional[Exception]]]
+        self._queue = queue.Queue(maxsize=max(1, max_pending))  # type: queue.Queue
+        self.max_pending_bytes = max_pending_bytes
+        self._pending_bytes = 0
+        self._pending_condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._consume, name=f'S3Sink-{bucket_name}-{i}', daemon=True)
+            for i in range(max(1, max_workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        if exc_type is not None:
+            self.discard_pending()
+        self.close()
+
+    def discard_pending(self) -> int:
+        """Discard the queued uploads that have not started, returning the number of discarded files"""
+        discarded_count = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                _, content, buffered_size = item
+                if not isinstance(content, bytes):
+                    content.close()
+                self._release(buffered_size)
+                discarded_count += 1
+            finally:
+                self._queue.task_done()
+        if discarded_count:
+            logger.warning(f'Discarded {discarded_count} queued uploads to s3://{self.bucket_name}')
+        return discarded_count
+
+    def close(self) -> None:
+        """Stop the upload threads once the queued uploads are complete"""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _consume(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                build_file, content, buffered_size = item
+                try:
+                    if isinstance(content, bytes):
+                        upload = put_object_with_retry  # type: Callable[..., int]
+                    else:  # spooled file object, streamed (see write_fileobj())
+                        upload = upload_fileobj_with_retry
+                    transferred_bytes = upload(
+                        self.client,
+                        content,
+                        self.bucket_name,
+                        build_file.key,
+                        extra_args=build_file.get_extra_args()
+                    )
+                    result = (build_file, transferred_bytes, None)  # type: Tuple[BuildFile, int, Optional[Exception]]
+                except Exception as e:  # collected and reported (or raised) by upload()
+                    result = (build_file, 0, e)
+                finally:
+                    if not isinstance(content, bytes):
+                        content.close()
+                    self._release(buffered_size)
+                with self._lock:
+                    self._results.append(result)
+            finally:
+                self._queue.task_done()
+
+    def _reserve(self, buffered_size: int) -> None:
+        """Block until buffered_size bytes fit within max_pending_bytes, a file larger than max_pending_bytes waits for an empty queue"""
+        with self._pending_condition:
+            self._pending_condition.wait_for(
+                lambda: self._pending_bytes == 0 or self._pending_bytes + buffered_size <= self.max_pending_bytes
+            )
+            self._pending_bytes += buffered_size
+
+    def _release(self, buffered_size: int) -> None:
+        with self._pending_condition:
+            self._pending_bytes -= buffered_size
+            self._pending_condition.notify_all()
+
+    def _is_unchanged(self, build_file: BuildFile) -> bool:
+        if self.existing_etags is not None and self.existing_etags.get(build_file.key) == build_file.md5:
+            logger.debug(f'Unchanged, skipping: {build_file.key}')
+            return True
+        return False
+
+    def _enqueue(self, build_file: BuildFile, content: Union[bytes, IO[bytes]], buffered_size: int) -> None:
+        self._reserve(buffered_size)
+        self._queue.put((build_file, content, buffered_size))  # blocks while the queue is full
+
+    def _store(self, build_file: BuildFile, content: bytes) -> None:
+        if not self._is_unchanged(build_file):
+            self._enqueue(build_file, content, len(content))
+
+    def _store_fileobj(self, build_file: BuildFile, fileobj: IO[bytes], buffered_size: int) -> None:
+        if self._is_unchanged(build_file):
+            fileobj.close()
+            return
+        self._enqueue(build_file, fileobj, buffered_size)
+
+    def upload(self,
+               client: Any,
+               bucket_name: str,
+               existing_etags: Optional[Dict[str, str]] = None,
+               max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+               progress_callback: Optional[Callable[[Path], None]] = None) -> TransferSummary:
+        """
+        Wait for the uploads queued on write to complete
+        Retryable transfer failures are collected in the resulting summary, any other error is raised
+
+        > Files are uploaded to the bucket (and filtered by the existing_etags) given on creation
+        """
+        if bucket_name != self.bucket_name:
+            raise ValueError(f'S3Sink streams to s3://{self.bucket_name}, not s3://{bucket_name}')
+
+        self._queue.join()
+        with self._lock:
+            results = self._results
+            self._results = []
+
+        summary = TransferSummary()
+        for build_file, transferred_bytes, error in results:
+            if error is None:
+                summary.total_bytes += transferred_bytes
+                summary.transferred.append(build_file.relative_path)
+            elif isinstance(error, RETRYABLE_EXCEPTIONS):
+                logger.error(f'Transfer of ({build_file.key}) failed: {error}')
+                summary.failed.append((build_file.relative_path, error))
+            else:
+                raise error
+            if progress_callback:
+                progress_callback(build_file.relative_path)
+        summary.elapsed_seconds = time.perf_counter() - self._start
+        logger.info(f'Uploaded {len(summary.transferred)} files ({summary.total_bytes} bytes) to s3://{self.bucket_name} '
+                    f'in {summary.elapsed_seconds:.2f}s')
+        return summary
+
+
+def as_build_sink(target: Union[Path, BuildSink]) -> BuildSink:
+    """Get the BuildSink for the given target, where a directory Path is written with a FilesystemSink"""
+    if isinstance(target, BuildSink):
+        return target
+    return FilesystemSink(Path(target))
+
+
+def create_build_sink(sink_type: str,
+                      client: Any,
+                      bucket_name: str,
+                      existing_etags: Optional[Dict[str, str]] = None,
+                      max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                      prefix: str = 'site-',
+                      content_encoding: Optional[str] = None,
+                      transforms: Optional[Mapping[str, Iterable[str]]] = None) -> BuildSink:
+    """
+    Create the BuildSink of the given type (BUILD_SINK_FILESYSTEM, BUILD_SINK_MEMORY or BUILD_SINK_S3) used to sync to bucket_name
+    Files are transformed with the given transforms ({CONTENT_TYPE: [DOTTED_PATH, ...]}, see settings.SYNC_TRANSFORMS),
+    and compressible files are stored with the given content_encoding ('gzip', 'br' or None, see staticsites.compression.get_content_encoding())
+    """
+    content_encoding = get_content_encoding(content_encoding)
+    sink_transforms = normalize_transforms(transforms)
+    if sink_type == BUILD_SINK_S3:
+        return S3Sink(client, bucket_name, existing_etags, max_workers, content_encoding=content_encoding, transforms=sink_transforms)
+    elif sink_type == BUILD_SINK_MEMORY:
+        return MemorySink(content_encoding, sink_transforms)
+    elif sink_type == BUILD_SINK_FILESYSTEM:
+        return FilesystemSink(prefix=prefix, content_encoding=content_encoding, transforms=sink_transforms)
+    raise ValueError(f'Unknown build sink type: {sink_type}')
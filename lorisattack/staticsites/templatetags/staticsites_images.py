@@ -0,0 +1,40 @@
+from typing import Dict, List, Optional
+
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..images import get_image_sources
+
+
+register = template.Library()
+
+
+@register.filter
+def image_sources(relative_path: str) -> List[Dict[str, str]]:
+    """
+    Get the <picture> sources of the transcoded variants of the given image path:
+
+        {% load staticsites_images %}
+        <picture>
+            {% for source in newsitem.image_derivatives.thumbnail|image_sources %}
+                <source type="{{ source.type }}" srcset="{{ source.srcset }}">
+            {% endfor %}
+            <img src="{{ newsitem.image_derivatives.thumbnail }}">
+        </picture>
+    """
+    if not relative_path:
+        return []
+    return get_image_sources(str(relative_path))
+
+
+@register.simple_tag
+def picture(relative_path: str, **attributes: Optional[str]) -> str:
+    """
+    Render a <picture> with the transcoded variant sources of the given image path, and an <img> fallback with the given attributes
+
+        {% load staticsites_images %}
+        {% picture "imgs/logo.png" alt="logo" %}
+    """
+    sources = format_html_join('', '<source type="{}" srcset="{}">', ((s['type'], s['srcset']) for s in image_sources(relative_path)))
+    img_attributes = format_html_join('', ' {}="{}"', sorted(attributes.items()))
+    return format_html('<picture>{}<img src="{}"{}></picture>', sources, relative_path, img_attributes)
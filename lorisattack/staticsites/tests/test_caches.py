@@ -0,0 +1,125 @@
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase
+
+from bs4 import BeautifulSoup
+
+from accounts.models import Organization, OrganizationUser
+
+from ..models import StaticSite, IndexPage
+from .. import caches
+from ..caches import LRUCache, TEMPLATE_CACHE, TEMPLATE_RELPATHS_CACHE, get_compiled_template, get_template_relpaths, extract_template_relpaths
+
+STATICSITES_FIXTURES_DIRECTORY = Path(__file__).parent.parent / 'fixtures'
+
+
+class LRUCacheTestCase(TestCase):
+
+    def test_lrucache_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'a' is now most recently used
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_lrucache_invalidate(self):
+        cache = LRUCache(maxsize=10)
+        cache.set((1, 'x'), 1)
+        cache.set((1, 'y'), 2)
+        cache.set((2, 'x'), 3)
+        removed_count = cache.invalidate(lambda key: key[0] == 1)
+        self.assertEqual(removed_count, 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get((2, 'x')), 3)
+
+
+class CompiledTemplateCacheTestCase(TestCase):
+    fixtures = ['accounts_test']
+
+    def setUp(self) -> None:
+        TEMPLATE_CACHE.clear()
+        self.org = Organization.objects.all()[0]
+        self.system_admin_user = OrganizationUser.objects.get(username='system-admin')
+        self.staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite',
+            staging_bucket='staticsite-staging-test',
+            production_bucket='staticsite-production-test',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        self.staticsite.save()
+        self.indexpage = IndexPage(
+            site=self.staticsite,
+            relative_path='.',
+            template='<html>{{ value }}</html>',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        self.indexpage.save()
+
+    def test_get_compiled_template(self):
+        template = get_compiled_template(1, '<html>{{ value }}</html>')
+        self.assertIs(template, get_compiled_template(1, '<html>{{ value }}</html>'))
+        self.assertIsNot(template, get_compiled_template(1, '<html>{{ other }}</html>'))
+        self.assertEqual(template.render(context={'value': 'x'}), '<html>x</html>')
+
+    def test_invalidate_on_save(self):
+        template = self.indexpage.get_compiled_template()
+        self.assertIs(template, self.indexpage.get_compiled_template())
+
+        self.indexpage.template = '<html>updated {{ value }}</html>'
+        self.indexpage.save()
+        self.assertEqual(len(TEMPLATE_CACHE), 0)
+        updated_template = self.indexpage.get_compiled_template()
+        self.assertEqual(updated_template.render(context={'value': 'x'}), '<html>updated x</html>')
+
+
+class TemplateRelpathsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        TEMPLATE_RELPATHS_CACHE.clear()
+
+    def test_extract_template_relpaths(self):
+        template_text = (
+            '<html><head>'
+            '<link rel="stylesheet" href="css/style.css">'
+            '<link rel="stylesheet" href="https://cdn.example.com/x.css">'
+            '<script src="js/app.js"></script>'
+            '<script>var x = "<img src=\'not/an/asset.png\'>";</script>'
+            '</head><body>'
+            '<img src="imgs/logo.png" />'
+            '<img alt="no source">'
+            '<link rel="icon" href="favicon.ico"/>'
+            '</body></html>'
+        )
+        self.assertEqual(
+            extract_template_relpaths(template_text),
+            [Path('css/style.css'), Path('favicon.ico'), Path('js/app.js'), Path('imgs/logo.png')]
+        )
+
+    def test_extract_template_relpaths__matches_beautifulsoup(self):
+        template_text = (STATICSITES_FIXTURES_DIRECTORY / 'index-sample-1.html.template').read_text(encoding='utf-8')
+        soup = BeautifulSoup(template_text, features='html.parser')
+        expected = []
+        for tag, attribute_name in (('link', 'href'), ('script', 'src'), ('img', 'src')):
+            for element in soup.find_all(tag):
+                value = element.attrs.get(attribute_name)
+                if value and not value.startswith('http'):
+                    expected.append(Path(value))
+        self.assertEqual(extract_template_relpaths(template_text), expected)
+
+    def test_get_template_relpaths__cached(self):
+        template_text = '<html><link href="css/style.css"></html>'
+        self.assertEqual(get_template_relpaths(template_text), [Path('css/style.css')])
+        with mock.patch.object(caches, 'extract_template_relpaths') as mock_extract:
+            self.assertEqual(get_template_relpaths(template_text), [Path('css/style.css')])
+            mock_extract.assert_not_called()
+
+            get_template_relpaths('<html><img src="updated.png"></html>')
+            mock_extract.assert_called_once()
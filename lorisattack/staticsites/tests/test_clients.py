@@ -0,0 +1,41 @@
+import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import TestCase, override_settings
+
+from ..clients import get_s3_client, reset_clients
+
+
+class S3ClientTestCase(TestCase):
+
+    def setUp(self) -> None:
+        reset_clients()
+
+    def tearDown(self) -> None:
+        reset_clients()
+
+    @override_settings(S3_CLIENT_MAX_POOL_CONNECTIONS=25, S3_CLIENT_MAX_ATTEMPTS=2)
+    def test_get_s3_client__config(self):
+        client = get_s3_client()
+        self.assertEqual(client.meta.config.max_pool_connections, 25)
+        self.assertEqual(client.meta.config.retries['total_max_attempts'], 2)
+
+    def test_get_s3_client__shared_between_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: get_s3_client(), range(32)))
+        self.assertEqual(len(set(id(client) for client in clients)), 1)
+        self.assertIs(get_s3_client(), clients[0])
+
+        reset_clients()
+        self.assertIsNot(get_s3_client(), clients[0])
+
+    def test_import__no_client_created(self):
+        # importing the models/functions must not create boto3 clients (import cost on every process cold start)
+        script = (
+            'import django; django.setup(); '
+            'from staticsites import functions, clients; '
+            'assert not clients._CLIENTS, clients._CLIENTS'
+        )
+        result = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.assertEqual(result.returncode, 0, result.stdout.decode('utf8'))
@@ -0,0 +1,151 @@
+import io
+import gzip
+import posixpath
+from pathlib import Path
+
+from django.test import TestCase
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+import boto3
+from PIL import Image
+
+from accounts.models import Organization, OrganizationUser
+from ..fingerprints import get_fingerprinted_filename, rewrite_asset_references
+from ..models import StaticSite, IndexPage, PageAsset
+
+S3_CLIENT = boto3.client(
+    's3',
+    endpoint_url=settings.BOTO3_ENDPOINTS['s3'],
+)
+
+SAMPLE_IMAGE_FILEPATH = Path(__file__).parent.parent.parent / 'news' / 'fixtures' / 'images' / 'sample-photo.jpeg'
+
+
+class FingerprintsTestCase(TestCase):
+    fixtures = ['accounts_test']
+
+    def setUp(self) -> None:
+        self.staging_bucket_name = 'staticsite-staging-fingerprints-test'
+        for bucket_name in (settings.AWS_STORAGE_BUCKET_NAME, self.staging_bucket_name):
+            S3_CLIENT.create_bucket(
+                Bucket=bucket_name
+            )
+        contents = S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)
+        if 'Contents' in contents:
+            S3_CLIENT.delete_objects(
+                Bucket=self.staging_bucket_name,
+                Delete={'Objects': [{'Key': obj['Key']} for obj in contents['Contents']]}
+            )
+        self.org = Organization.objects.all()[0]
+        self.system_admin_user = OrganizationUser.objects.get(username='system-admin')
+
+    def _get_png_content(self) -> bytes:
+        output = io.BytesIO()
+        Image.new('RGB', (8, 8), color='white').save(output, format='PNG')
+        return output.getvalue()
+
+    def test_rewrite_asset_references(self):
+        self.assertEqual(get_fingerprinted_filename('style.css', 'abcdef0123456789'), 'style.abcdef012345.css')
+        asset_paths = {
+            'stylesheets/style.css': 'stylesheets/style.abc.css',
+            'imgs/logo.png': 'imgs/logo.def.png',
+            'imgs/logo.webp': 'imgs/logo.fed.webp',
+        }
+        html = (
+            '<link rel="stylesheet" href="./stylesheets/style.css">'
+            '<a href="https://example.com/stylesheets/style.css">x</a>'
+            "<picture><source srcset='imgs/logo.webp 1x, imgs/other.webp 2x'><img src=\"imgs/logo.png\" alt=\"logo.png\"></picture>"
+            '<img class="lazy" data-src="imgs/logo.png" data-srcset="imgs/logo.webp">'
+        )
+        self.assertEqual(
+            rewrite_asset_references(html, asset_paths),
+            '<link rel="stylesheet" href="stylesheets/style.abc.css">'
+            '<a href="https://example.com/stylesheets/style.css">x</a>'
+            "<picture><source srcset='imgs/logo.fed.webp 1x, imgs/other.webp 2x'><img src=\"imgs/logo.def.png\" alt=\"logo.png\"></picture>"
+            '<img class="lazy" data-src="imgs/logo.png" data-srcset="imgs/logo.webp">'
+        )
+        self.assertEqual(rewrite_asset_references(html, {}), html)
+
+    def test_sync__fingerprinted_assets(self):
+        staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-fingerprints',
+            staging_bucket=self.staging_bucket_name,
+            production_bucket='staticsite-production-fingerprints-test',
+            fingerprint_assets=True,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        staticsite.save()
+        indexpage = IndexPage(
+            site=staticsite,
+            relative_path='.',
+            template=(
+                '{% load staticsites_images %}'
+                '<html><head><link rel="stylesheet" href="stylesheets/style.css"></head>'
+                '<body><picture>'
+                '{% for source in "imgs/photo.jpeg"|image_sources %}<source type="{{ source.type }}" srcset="{{ source.srcset }}">{% endfor %}'
+                '<img src="imgs/photo.jpeg" alt="photo">'
+                '</picture></body></html>'
+            ),
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        indexpage.save()
+        assets = {}
+        for file_type, relative_path, filename, content in (
+                ('css', 'stylesheets', 'style.css', b'body { background: url(../imgs/bg.png); } .photo { background: url(../imgs/photo.jpeg); }'),
+                ('img', 'imgs', 'photo.jpeg', SAMPLE_IMAGE_FILEPATH.read_bytes()),
+                ('img', 'imgs', 'bg.png', self._get_png_content())):
+            asset = PageAsset(
+                page=indexpage,
+                file_type=file_type,
+                filename=filename,
+                relative_path=relative_path,
+                file_content=SimpleUploadedFile(name=filename, content=content),
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            asset.save()
+            assets[filename] = asset
+
+        asset_paths = indexpage.get_asset_paths()
+        style_path = asset_paths['stylesheets/style.css']
+        photo_path = asset_paths['imgs/photo.jpeg']
+        photo_webp_path = asset_paths['imgs/photo.webp']
+        self.assertEqual(style_path, f'stylesheets/{get_fingerprinted_filename("style.css", assets["style.css"].file_hash)}')
+        # assets not referenced by the template keep their path
+        self.assertNotIn('imgs/bg.png', asset_paths)
+
+        staticsite.sync(update_production=False, server_side_copy=True)
+        keys = set(obj['Key'] for obj in S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)['Contents'])
+        # fingerprinted assets are also uploaded to their original path
+        self.assertEqual(keys, {
+            'index.html',
+            style_path, 'stylesheets/style.css',
+            photo_path, 'imgs/photo.jpeg',
+            photo_webp_path, 'imgs/photo.webp',
+            'imgs/bg.png', 'imgs/bg.webp',
+        })
+
+        response = S3_CLIENT.get_object(Bucket=self.staging_bucket_name, Key='index.html')
+        self.assertEqual(response['CacheControl'], settings.SYNC_HTML_CACHE_CONTROL)
+        html = gzip.decompress(response['Body'].read()).decode('utf8')
+        self.assertIn(f'href="{style_path}"', html)
+        self.assertIn(f'src="{photo_path}"', html)
+        self.assertIn(f'srcset="{photo_webp_path}"', html)
+
+        # fingerprinted assets are cached as immutable, whether written (compressed css) or copied server-side (images)
+        for key in (style_path, photo_path, photo_webp_path):
+            response = S3_CLIENT.head_object(Bucket=self.staging_bucket_name, Key=key)
+            self.assertEqual(response['CacheControl'], settings.SYNC_IMMUTABLE_CACHE_CONTROL)
+        for key in ('imgs/bg.png', 'stylesheets/style.css', 'imgs/photo.jpeg', 'imgs/photo.webp'):
+            response = S3_CLIENT.head_object(Bucket=self.staging_bucket_name, Key=key)
+            self.assertEqual(response['CacheControl'], settings.SYNC_ASSET_CACHE_CONTROL)
+
+        # css url() references are not rewritten, and resolve to the original paths
+        response = S3_CLIENT.get_object(Bucket=self.staging_bucket_name, Key=style_path)
+        css = gzip.decompress(response['Body'].read()).decode('utf8')
+        self.assertIn('url(../imgs/photo.jpeg)', css)
+        self.assertIn(posixpath.normpath(posixpath.join('stylesheets', '../imgs/photo.jpeg')), keys)
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from unittest import mock
 from tempfile import TemporaryDirectory
 
 from django.test import TestCase
@@ -11,7 +12,9 @@ import boto3
 from accounts.models import Organization, OrganizationUser, OrganizationEmailDomain
 
 from ..models import StaticSite, IndexPage, PageAsset
-from ..functions import instantiate_staticsite
+from ..compression import compress
+from ..functions import instantiate_staticsite, build_staticsites, get_changed_storage_copies, get_storage_copy_build_objects
+from ..transfers import copy_objects, list_bucket_etags
 
 S3_CLIENT = boto3.client(
     's3',
@@ -115,3 +118,140 @@ class StaticSiteFunctionsTestCase(TestCase):
 
             expected_absolute_filepath = Path(tempdir) / self.indexpage.relative_filepath
             self.assertTrue(expected_absolute_filepath.exists(), f'Expected Filepath Not found: {expected_absolute_filepath}')
+
+    def test_functions_instantiate_staticsite__storage_copies(self):
+        # register  assets
+        assets_directory = STATICSITES_FIXTURES_DIRECTORY / 'assets'
+        expected_assets = (
+            ('stylesheets/plugins', 'bootstrap3.min.css'),
+            ('stylesheets/plugins', 'drawer.min.css'),
+            ('stylesheets', 'style.css')
+        )
+        for relpath, filename in expected_assets:
+            local_filepath = assets_directory / filename
+            content = SimpleUploadedFile(
+                name=filename,
+                content=local_filepath.open('rb').read(),
+                content_type='text/css'
+            )
+            asset = PageAsset(
+                page=self.indexpage,
+                file_type='css',
+                filename=filename,
+                relative_path=relpath,
+                file_content=content,
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user
+            )
+            asset.save()
+
+        with TemporaryDirectory(prefix='sometestprefix-') as tempdir:
+            storage_copies = []
+            instantiated_page_data = instantiate_staticsite(
+                self.staticsite,
+                Path(tempdir),
+                storage_copies=storage_copies
+            )
+            expected_relative_paths = set(Path(relpath, filename) for relpath, filename in expected_assets)
+            self.assertEqual(set(c['relative_path'] for c in storage_copies), expected_relative_paths)
+            for storage_copy in storage_copies:
+                self.assertEqual(storage_copy['source_bucket'], settings.AWS_STORAGE_BUCKET_NAME)
+                self.assertEqual(storage_copy['source_type'], 'pageasset')
+                self.assertFalse((Path(tempdir) / storage_copy['relative_path']).exists())
+            self.assertFalse(instantiated_page_data[0]['asset_relative_filepaths'])
+            self.assertTrue((Path(tempdir) / self.indexpage.relative_filepath).exists())
+
+    def test_functions_build_staticsites(self):
+        # site without an IndexPage fails, without stopping the other builds
+        broken_staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-broken',
+            staging_bucket=self.staging_bucket_name,
+            production_bucket=self.production_bucket_name,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        broken_staticsite.save()
+
+        simple_staging_bucket_name = 'staticsite-staging-simple-test'
+        S3_CLIENT.create_bucket(
+            Bucket=simple_staging_bucket_name
+        )
+        simple_staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-simple',
+            staging_bucket=simple_staging_bucket_name,
+            production_bucket=self.production_bucket_name,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        simple_staticsite.save()
+        IndexPage(
+            site=simple_staticsite,
+            filename='index.html',
+            relative_path='.',
+            template='<html><body>simple</body></html>',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        ).save()
+
+        summaries = build_staticsites([broken_staticsite, simple_staticsite], max_concurrent_sites=1)
+        self.assertEqual([s['site_id'] for s in summaries], [broken_staticsite.pk, simple_staticsite.pk])
+
+        broken_summary, simple_summary = summaries
+        self.assertFalse(broken_summary['is_succeeded'])
+        self.assertIn('DoesNotExist', broken_summary['error'])
+
+        self.assertTrue(simple_summary['is_succeeded'], simple_summary['error'])
+        self.assertEqual(simple_summary['object_count'], 1)
+        self.assertEqual(simple_summary['transferred_count'], 1)
+        # total_bytes is the stored (compressed) size
+        self.assertEqual(simple_summary['total_bytes'], len(compress(b'<html><body>simple</body></html>', 'gzip')))
+        objects = S3_CLIENT.list_objects(Bucket=simple_staging_bucket_name)['Contents']
+        self.assertEqual([obj['Key'] for obj in objects], ['index.html'])
+
+    def test_functions_build_staticsites__budgets_divided(self):
+        staticsites = [StaticSite(name=f'site-{i}') for i in range(3)]
+        with mock.patch('staticsites.functions.build_staticsite', return_value={}) as mock_build_staticsite:
+            build_staticsites(staticsites, max_concurrent_sites=2, max_transfer_workers=10, max_render_processes=4)
+        self.assertEqual(mock_build_staticsite.call_count, 3)
+        for call in mock_build_staticsite.call_args_list:
+            self.assertEqual(call[1]['max_workers'], 5)
+            self.assertEqual(call[1]['render_max_processes'], 2)
+
+    def test_functions_get_changed_storage_copies__multipart_source(self):
+        source_bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        S3_CLIENT.create_bucket(Bucket=source_bucket_name)
+        # sources uploaded by multipart have an ETag with a '-N' suffix
+        upload = S3_CLIENT.create_multipart_upload(Bucket=source_bucket_name, Key='uploads/large.jpg')
+        part = S3_CLIENT.upload_part(
+            Bucket=source_bucket_name, Key='uploads/large.jpg', UploadId=upload['UploadId'], PartNumber=1, Body=b'x' * 1024
+        )
+        S3_CLIENT.complete_multipart_upload(
+            Bucket=source_bucket_name,
+            Key='uploads/large.jpg',
+            UploadId=upload['UploadId'],
+            MultipartUpload={'Parts': [{'ETag': part['ETag'], 'PartNumber': 1}]}
+        )
+        storage_copy = {
+            'relative_path': Path('imgs', 'large.jpg'),
+            'source_bucket': source_bucket_name,
+            'source_key': 'uploads/large.jpg',
+            'source_type': 'pageasset',
+            'source_id': 1,
+            'file_hash': 'a' * 64,
+        }
+        source_etags = {o.key: o.md5 for o in get_storage_copy_build_objects([storage_copy])}
+        self.assertIn('-', source_etags['imgs/large.jpg'])
+
+        copy_objects(S3_CLIENT, self.staging_bucket_name, [storage_copy])
+        existing_etags = list_bucket_etags(S3_CLIENT, self.staging_bucket_name)
+        self.assertNotEqual(existing_etags['imgs/large.jpg'], source_etags['imgs/large.jpg'])
+
+        # unchanged by the file_hash recorded on copy
+        self.assertEqual(get_changed_storage_copies(S3_CLIENT, self.staging_bucket_name, [storage_copy], existing_etags, source_etags), [])
+        changed_copy = dict(storage_copy, file_hash='b' * 64)
+        self.assertEqual(
+            get_changed_storage_copies(S3_CLIENT, self.staging_bucket_name, [changed_copy], existing_etags, source_etags),
+            [changed_copy]
+        )
@@ -0,0 +1,148 @@
+from pathlib import Path
+from unittest import mock
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase
+from django.conf import settings
+from django.template import engines
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+import boto3
+from PIL import Image
+
+from accounts.models import Organization, OrganizationUser
+from ..images import get_derivative_filename, get_image_sources, get_image_variants
+from ..models import StaticSite, IndexPage, PageAsset
+
+S3_CLIENT = boto3.client(
+    's3',
+    endpoint_url=settings.BOTO3_ENDPOINTS['s3'],
+)
+
+SAMPLE_IMAGE_FILEPATH = Path(__file__).parent.parent.parent / 'news' / 'fixtures' / 'images' / 'sample-photo.jpeg'
+
+
+class ImagesTestCase(TestCase):
+    fixtures = ['accounts_test']
+
+    def setUp(self) -> None:
+        S3_CLIENT.create_bucket(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME
+        )
+        self.org = Organization.objects.all()[0]
+        self.system_admin_user = OrganizationUser.objects.get(username='system-admin')
+
+    def test_get_image_variants(self):
+        sizes = {'thumbnail': (320, 320)}
+        self.assertEqual(
+            get_image_variants('photo.jpg', sizes),
+            [('original', 'webp'), ('thumbnail', None), ('thumbnail', 'webp')]
+        )
+        # animated/unsupported formats are resized but not transcoded
+        self.assertEqual(get_image_variants('anim.gif', sizes), [('thumbnail', None)])
+        self.assertEqual(get_image_variants('photo.webp', {}), [])
+
+        self.assertEqual(get_derivative_filename('photo.jpg', 'thumbnail'), 'photo.thumbnail.jpg')
+        self.assertEqual(get_derivative_filename('photo.jpg', 'thumbnail', 'webp'), 'photo.thumbnail.webp')
+        self.assertEqual(get_derivative_filename('photo.jpg', 'original', 'webp'), 'photo.webp')
+
+    def test_template_tags(self):
+        self.assertEqual(get_image_sources('imgs/logo.png'), [{'type': 'image/webp', 'srcset': 'imgs/logo.webp'}])
+        template = engines['django'].from_string(
+            '{% load staticsites_images %}'
+            '{% for source in path|image_sources %}{{ source.type }} {{ source.srcset }};{% endfor %}'
+            '{% picture path alt="logo" %}'
+        )
+        self.assertEqual(
+            template.render({'path': 'imgs/logo.png'}),
+            'image/webp imgs/logo.webp;'
+            '<picture><source type="image/webp" srcset="imgs/logo.webp"><img src="imgs/logo.png" alt="logo"></picture>'
+        )
+
+    def test_prepare_assets__image_transcoded(self):
+        staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-images',
+            staging_bucket='staticsite-staging-images-test',
+            production_bucket='staticsite-production-images-test',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        staticsite.save()
+        indexpage = IndexPage(
+            site=staticsite,
+            template='<html><body><img src="imgs/photo.jpeg"></body></html>',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        indexpage.save()
+        content = SAMPLE_IMAGE_FILEPATH.read_bytes()
+        asset = PageAsset(
+            page=indexpage,
+            file_type='img',
+            filename='photo.jpeg',
+            relative_path='imgs',
+            file_content=SimpleUploadedFile(name='photo.jpeg', content=content, content_type='image/jpeg'),
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        asset.save()
+        self.assertTrue(asset.file_hash)
+
+        with TemporaryDirectory(prefix='images_test_') as tempdir:
+            written = [relative_filepath for _, relative_filepath in indexpage.prepare_assets(Path(tempdir))]
+            self.assertEqual(set(written), {Path('imgs', 'photo.jpeg'), Path('imgs', 'photo.webp')})
+            self.assertEqual((Path(tempdir) / 'imgs' / 'photo.jpeg').read_bytes(), content)
+            with Image.open(Path(tempdir) / 'imgs' / 'photo.webp') as transcoded:
+                self.assertEqual(transcoded.format, 'WEBP')
+
+        # transcoded variants are kept in storage, and copied server-side
+        storage_copies = []
+        with mock.patch('staticsites.images.create_image_derivative') as mock_create_image_derivative:
+            with TemporaryDirectory(prefix='images_test_') as tempdir:
+                self.assertEqual(list(indexpage.prepare_assets(Path(tempdir), storage_copies)), [])
+            mock_create_image_derivative.assert_not_called()
+        self.assertEqual(set(str(c['relative_path']) for c in storage_copies), {'imgs/photo.jpeg', 'imgs/photo.webp'})
+
+    def test_sync__undecodable_image_uploaded_as_is(self):
+        staging_bucket_name = 'staticsite-staging-images-corrupt-test'
+        S3_CLIENT.create_bucket(Bucket=staging_bucket_name)
+        staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-images-corrupt',
+            staging_bucket=staging_bucket_name,
+            production_bucket='staticsite-production-images-corrupt-test',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        staticsite.save()
+        indexpage = IndexPage(
+            site=staticsite,
+            template='<html><body><img src="imgs/broken.png"><img src="imgs/truncated.jpeg"></body></html>',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        indexpage.save()
+        sample_content = SAMPLE_IMAGE_FILEPATH.read_bytes()
+        contents = {
+            'broken.png': b'\x89PNG\r\n\x1a\n' + b'not an image',
+            'truncated.jpeg': sample_content[:len(sample_content) // 2],
+        }
+        for filename, content in contents.items():
+            PageAsset(
+                page=indexpage,
+                file_type='img',
+                filename=filename,
+                relative_path='imgs',
+                file_content=SimpleUploadedFile(name=filename, content=content),
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            ).save()
+
+        staticsite.sync(update_production=False, server_side_copy=False)
+        keys = set(obj['Key'] for obj in S3_CLIENT.list_objects(Bucket=staging_bucket_name)['Contents'])
+        # the images are uploaded as is, without transcoded variants
+        self.assertEqual(keys, {'index.html', 'imgs/broken.png', 'imgs/truncated.jpeg'})
+        for filename, content in contents.items():
+            response = S3_CLIENT.get_object(Bucket=staging_bucket_name, Key=f'imgs/{filename}')
+            self.assertEqual(response['Body'].read(), content)
@@ -0,0 +1,156 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.utils import timezone
+
+import boto3
+
+from accounts.models import Organization, OrganizationUser
+
+from ..models import (
+    StaticSite,
+    IndexPage,
+    SyncJob,
+    SYNC_JOB_STATUS_QUEUED,
+    SYNC_JOB_STATUS_RUNNING,
+    SYNC_JOB_STATUS_SUCCEEDED,
+    SYNC_JOB_STATUS_FAILED,
+)
+from ..jobs import InlineSyncJobBackend, run_queued_sync_jobs, run_sync_job
+
+S3_CLIENT = boto3.client(
+    's3',
+    endpoint_url=settings.BOTO3_ENDPOINTS['s3'],
+)
+
+INDEX_TEMPLATE = '<html><body>jobs</body></html>'
+
+
+class SyncJobTestCase(TestCase):
+    fixtures = ['accounts_test']
+
+    def setUp(self) -> None:
+        self.org = Organization.objects.all()[0]
+        self.system_admin_user = OrganizationUser.objects.get(username='system-admin')
+
+        self.staging_bucket_name = 'staticsite-staging-jobs-test'
+        S3_CLIENT.create_bucket(
+            Bucket=self.staging_bucket_name
+        )
+        self.staticsite = StaticSite(
+            organization=self.org,
+            name='test-staticsite-jobs',
+            staging_bucket=self.staging_bucket_name,
+            production_bucket='staticsite-production-jobs-test',
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        self.staticsite.save()
+
+    def _create_indexpage(self):
+        IndexPage(
+            site=self.staticsite,
+            filename='index.html',
+            relative_path='.',
+            template=INDEX_TEMPLATE,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        ).save()
+
+    @override_settings(SYNC_JOB_BACKEND='staticsites.jobs.DatabaseQueueSyncJobBackend', SYNC_JOB_DEBOUNCE_SECONDS=0)
+    def test_enqueue_sync__run_queued_sync_jobs(self):
+        self._create_indexpage()
+        job = self.staticsite.enqueue_sync(self.system_admin_user)
+        self.assertEqual(job.status, SYNC_JOB_STATUS_QUEUED)
+
+        self.assertEqual(run_queued_sync_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SYNC_JOB_STATUS_SUCCEEDED, job.error)
+        self.assertEqual((job.completed_count, job.total_count), (1, 1))
+        self.assertTrue(job.started_datetime <= job.finished_datetime)
+        self.assertEqual(job.build, self.staticsite.get_latest_build(self.staging_bucket_name))
+        objects = S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)['Contents']
+        self.assertEqual([obj['Key'] for obj in objects], ['index.html'])
+
+        # finished jobs are not run again
+        self.assertFalse(job.run())
+        self.assertEqual(run_queued_sync_jobs(), 0)
+
+    def test_inline_backend__failure(self):
+        # no IndexPage defined
+        job = SyncJob.objects.create(
+            site=self.staticsite,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        InlineSyncJobBackend().submit(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SYNC_JOB_STATUS_FAILED)
+        self.assertIn('DoesNotExist', job.error)
+        self.assertIsNone(job.build)
+        self.assertIsNotNone(job.finished_datetime)
+
+    @override_settings(SYNC_JOB_BACKEND='staticsites.jobs.DatabaseQueueSyncJobBackend', SYNC_JOB_DEBOUNCE_SECONDS=60)
+    def test_enqueue_sync__coalesced(self):
+        self._create_indexpage()
+        job = self.staticsite.enqueue_sync(self.system_admin_user, incremental=True)
+        first_run_after = job.run_after
+        coalesced_job = self.staticsite.enqueue_sync(self.system_admin_user, incremental=False, delete_stale=True)
+        self.assertEqual(coalesced_job.pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.coalesced_count, 1)
+        self.assertGreaterEqual(job.run_after, first_run_after)
+        self.assertFalse(job.incremental)
+        self.assertTrue(job.delete_stale)
+
+        # production requests are queued separately
+        production_job = self.staticsite.enqueue_sync(self.system_admin_user, update_production=True)
+        self.assertNotEqual(production_job.pk, job.pk)
+
+        # debounce window still open
+        self.assertEqual(SyncJob.objects.filter(site=self.staticsite).count(), 2)
+        self.assertEqual(run_queued_sync_jobs(), 0)
+        self.assertGreater(job.get_wait_seconds(), 0)
+
+    @override_settings(SYNC_JOB_DEBOUNCE_SECONDS=0)
+    def test_enqueue_sync__coalesced_resubmitted(self):
+        self._create_indexpage()
+        submitted_jobs = []
+        backend = mock.Mock(submit=submitted_jobs.append)
+        with mock.patch('staticsites.jobs.get_sync_job_backend', return_value=backend), \
+                mock.patch('staticsites.models.transaction.on_commit', side_effect=lambda func: func()):
+            # the first submission is dropped (the worker died before running the job)
+            job = self.staticsite.enqueue_sync(self.system_admin_user)
+            coalesced_job = self.staticsite.enqueue_sync(self.system_admin_user)
+        self.assertEqual(coalesced_job.pk, job.pk)
+        self.assertEqual([submitted_job.pk for submitted_job in submitted_jobs], [job.pk, job.pk])
+
+        InlineSyncJobBackend().submit(submitted_jobs[-1])
+        job.refresh_from_db()
+        self.assertEqual(job.status, SYNC_JOB_STATUS_SUCCEEDED, job.error)
+        # workers of the other submissions find the job already run
+        self.assertFalse(run_sync_job(job.pk))
+
+    @override_settings(SYNC_JOB_DEBOUNCE_SECONDS=0)
+    def test_claim__one_running_job_per_site(self):
+        running_job = SyncJob.objects.create(
+            site=self.staticsite,
+            status=SYNC_JOB_STATUS_RUNNING,
+            started_datetime=timezone.now(),
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        job = SyncJob.objects.create(
+            site=self.staticsite,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        self.assertFalse(job.claim())
+
+        # running jobs past SYNC_JOB_STALE_SECONDS no longer block the site
+        running_job.started_datetime = timezone.now() - timezone.timedelta(seconds=settings.SYNC_JOB_STALE_SECONDS + 1)
+        running_job.save()
+        self.assertTrue(job.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, SYNC_JOB_STATUS_RUNNING)
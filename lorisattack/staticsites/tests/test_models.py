@@ -1,6 +1,10 @@
+import os
+import gzip
 from pathlib import Path
+from unittest import mock
+from tempfile import TemporaryDirectory
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
 from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -9,7 +13,8 @@ import boto3
 
 from accounts.models import Organization, OrganizationUser, OrganizationEmailDomain
 from news.models import NewsPage, NewsItem
-from ..models import StaticSite, IndexPage, PageAsset
+from ..models import StaticSite, IndexPage, PageAsset, StaticSiteBuild
+from ..transforms import minify_css
 
 S3_CLIENT = boto3.client(
     's3',
@@ -244,6 +249,195 @@ class ModelsStaticSiteTestCase(TestCase):
         missing = set(expected_keys) - set(actual_keys)
         self.assertFalse(missing, f'missing Keys: {missing}')
 
+    def test_method_sync_staging__incremental(self):
+        transferred_relative_paths = self.staticsite.sync(update_production=False)
+        self.assertEqual(len(transferred_relative_paths), 4)
+
+        # nothing changed, nothing transferred
+        transferred_relative_paths = self.staticsite.sync(update_production=False, incremental=True)
+        self.assertFalse(transferred_relative_paths, f'unexpected transfers: {transferred_relative_paths}')
+
+        # only the updated index.html is transferred
+        self.indexpage.template = self.indexpage.template.replace('</body>', '<p>updated</p></body>')
+        self.indexpage.save()
+        transferred_relative_paths = self.staticsite.sync(update_production=False, incremental=True)
+        self.assertEqual(transferred_relative_paths, [Path('index.html')])
+
+    def test_method_sync_staging__delete_stale(self):
+        stale_key = 'news/removed.html'
+        S3_CLIENT.put_object(Bucket=self.staging_bucket_name, Key=stale_key, Body=b'<html></html>')
+
+        self.staticsite.sync(update_production=False, incremental=True, delete_stale=True)
+        objects = S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)['Contents']
+        actual_keys = [obj['Key'] for obj in objects]
+        self.assertNotIn(stale_key, actual_keys)
+        self.assertIn('index.html', actual_keys)
+
+    def test_method_sync_staging__build_manifest(self):
+        newspage = NewsPage(
+            site=self.staticsite,
+            index=self.indexpage,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        newspage.save()
+        self.indexpage.newsitems_template_variablename = 'news_items'
+        self.indexpage.save()
+        newsitem = NewsItem(
+            newspage=newspage,
+            publish_on=timezone.now() - timezone.timedelta(days=1),
+            is_published=True,
+            image=self._get_dummy_image_file(sample_image_filename=self.news_image_filename),
+            image_relpath=self.news_image_relpath,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        newsitem.save()
+
+        self.assertIsNone(self.staticsite.last_staging_sync_datetime)
+        self.staticsite.sync(update_production=False)
+        self.staticsite.refresh_from_db()
+        self.assertIsNotNone(self.staticsite.last_staging_sync_datetime)
+        self.assertIsNone(self.staticsite.last_production_sync_datetime)
+
+        build = StaticSiteBuild.objects.filter(site=self.staticsite).latest()
+        self.assertEqual(build.bucket_name, self.staging_bucket_name)
+        self.assertFalse(build.is_production)
+
+        build_objects = {o.key: o for o in build.build_objects.all()}
+        self.assertEqual(build.object_count, len(build_objects))
+        self.assertEqual(build.total_bytes, sum(o.size for o in build_objects.values()))
+
+        index_object = build_objects['index.html']
+        self.assertEqual(index_object.source_type, 'indexpage')
+        self.assertEqual(index_object.source_id, self.indexpage.id)
+        self.assertEqual(index_object.content_type, 'text/html')
+        self.assertEqual(index_object.content_encoding, 'gzip')
+
+        news_object = build_objects['news/news_0.html']
+        self.assertEqual(news_object.source_type, 'newspage')
+        self.assertEqual(news_object.page_number, 0)
+
+        asset_object = build_objects['stylesheets/style.css']
+        self.assertEqual(asset_object.source_type, 'pageasset')
+        self.assertEqual(asset_object.content_type, 'text/css')
+
+        image_object = build_objects[str(Path(self.news_image_relpath, newsitem.image.name))]
+        self.assertEqual(image_object.source_type, 'newsitem_image')
+        self.assertEqual(image_object.source_id, newsitem.id)
+        self.assertIsNone(image_object.content_encoding)
+
+        # md5 matches the uploaded object ETag
+        response = S3_CLIENT.head_object(Bucket=self.staging_bucket_name, Key='index.html')
+        self.assertEqual(response['ETag'].strip('"'), index_object.md5)
+
+    def test_method_sync_staging__incremental_reuses_unchanged_pages(self):
+        newspage = NewsPage(
+            site=self.staticsite,
+            index=self.indexpage,
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user,
+        )
+        newspage.save()
+        self.indexpage.newsitems_template_variablename = 'news_items'
+        self.indexpage.save()
+        one_day_ago = timezone.now() - timezone.timedelta(days=1)
+        newsitems = []
+        for i in range(15):
+            newsitem = NewsItem(
+                newspage=newspage,
+                publish_on=one_day_ago - timezone.timedelta(hours=i),
+                is_published=True,
+                image=self._get_dummy_image_file(sample_image_filename=self.news_image_filename),
+                image_relpath=self.news_image_relpath,
+                created_by=self.system_admin_user,
+                updated_by=self.system_admin_user,
+            )
+            newsitem.save()
+            newsitems.append(newsitem)
+        self.staticsite.sync(update_production=False)
+        first_build = self.staticsite.get_latest_build(self.staging_bucket_name)
+
+        # update the oldest item, only the last news page is re-rendered
+        newsitems[-1].title = 'updated'
+        newsitems[-1].save()
+        self.staticsite.sync(update_production=False, incremental=True, delete_stale=True)
+        second_build = self.staticsite.get_latest_build(self.staging_bucket_name)
+        self.assertNotEqual(first_build.pk, second_build.pk)
+
+        first_build_objects = {o.key: o for o in first_build.build_objects.all()}
+        second_build_objects = {o.key: o for o in second_build.build_objects.all()}
+        self.assertEqual(set(first_build_objects.keys()), set(second_build_objects.keys()))
+        self.assertNotEqual(first_build_objects['news/news_2.html'].dependency_hash, second_build_objects['news/news_2.html'].dependency_hash)
+        self.assertEqual(first_build_objects['news/news_0.html'].dependency_hash, second_build_objects['news/news_0.html'].dependency_hash)
+
+        # unrendered pages are not removed from the bucket
+        objects = S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)['Contents']
+        actual_keys = [obj['Key'] for obj in objects]
+        missing = set(first_build_objects.keys()) - set(actual_keys)
+        self.assertFalse(missing, f'missing Keys: {missing}')
+
+        # unchanged pages missing from the bucket are rendered and uploaded again
+        S3_CLIENT.delete_object(Bucket=self.staging_bucket_name, Key='news/news_0.html')
+        transferred_relative_paths = self.staticsite.sync(update_production=False, incremental=True)
+        self.assertEqual(transferred_relative_paths, [Path('news', 'news_0.html')])
+        S3_CLIENT.head_object(Bucket=self.staging_bucket_name, Key='news/news_0.html')
+
+    @override_settings(SYNC_CONTENT_ENCODING='', SYNC_TRANSFORMS={})
+    def test_method_sync_staging__server_side_copy(self):
+        with mock.patch.object(PageAsset, 'instantiate') as mock_instantiate:
+            transferred_relative_paths = self.staticsite.sync(update_production=False, server_side_copy=True)
+            mock_instantiate.assert_not_called()
+        self.assertIn(Path('stylesheets/style.css'), transferred_relative_paths)
+
+        response = S3_CLIENT.get_object(Bucket=self.staging_bucket_name, Key='stylesheets/style.css')
+        expected_content = (STATICSITES_FIXTURES_DIRECTORY / 'assets' / 'style.css').read_bytes()
+        self.assertEqual(response['Body'].read(), expected_content)
+        self.assertEqual(response['ContentType'], 'text/css')
+
+    def test_method_sync_staging__compressed(self):
+        with mock.patch.object(PageAsset, 'get_storage_copy') as mock_get_storage_copy:
+            self.staticsite.sync(update_production=False, server_side_copy=True)
+            # minified and compressed text assets are written through the sink
+            mock_get_storage_copy.assert_not_called()
+
+        for key, content_type in (('index.html', 'text/html'), ('stylesheets/style.css', 'text/css')):
+            response = S3_CLIENT.get_object(Bucket=self.staging_bucket_name, Key=key)
+            self.assertEqual(response['ContentType'], content_type)
+            self.assertEqual(response['ContentEncoding'], 'gzip')
+            self.assertEqual(response['CacheControl'], settings.SYNC_HTML_CACHE_CONTROL if key == 'index.html' else settings.SYNC_ASSET_CACHE_CONTROL)
+            content = gzip.decompress(response['Body'].read())
+            if key == 'stylesheets/style.css':
+                self.assertEqual(content.decode('utf8'), minify_css((STATICSITES_FIXTURES_DIRECTORY / 'assets' / 'style.css').read_text()))
+
+        # compression is deterministic, unchanged files are not re-uploaded
+        transferred_relative_paths = self.staticsite.sync(update_production=False, incremental=True)
+        self.assertNotIn(Path('index.html'), transferred_relative_paths)
+        self.assertNotIn(Path('stylesheets/style.css'), transferred_relative_paths)
+
+    def test_method_promote(self):
+        stale_key = 'news/removed.html'
+        S3_CLIENT.put_object(Bucket=self.production_bucket_name, Key=stale_key, Body=b'<html></html>')
+        self.staticsite.sync(update_production=False)
+
+        with mock.patch('staticsites.functions.instantiate_staticsite') as mock_instantiate:
+            promoted_relative_paths = self.staticsite.promote()
+            mock_instantiate.assert_not_called()
+        self.assertEqual(len(promoted_relative_paths), 4)
+
+        staging_objects = {obj['Key']: obj['ETag'] for obj in S3_CLIENT.list_objects(Bucket=self.staging_bucket_name)['Contents']}
+        production_objects = {obj['Key']: obj['ETag'] for obj in S3_CLIENT.list_objects(Bucket=self.production_bucket_name)['Contents']}
+        self.assertEqual(staging_objects, production_objects)
+
+        self.staticsite.refresh_from_db()
+        self.assertIsNotNone(self.staticsite.last_production_sync_datetime)
+        production_build = self.staticsite.get_latest_build(self.production_bucket_name)
+        self.assertTrue(production_build.is_production)
+        self.assertEqual(set(o.key for o in production_build.build_objects.all()), set(staging_objects.keys()))
+
+        # unchanged objects are not copied again
+        self.assertFalse(self.staticsite.promote())
+
 
 class ModelsSiteIndexPageTestCase(TestCase):
     fixtures = ['accounts_test']
@@ -325,5 +519,25 @@ class ModelsSiteIndexPageTestCase(TestCase):
                 updated_by=self.system_admin_user
             )
             asset.save()
-        results = self.indexpage._check_for_expected_assets()
+        # validated with a single page-scoped query, regardless of the number of referenced assets
+        with self.assertNumQueries(1):
+            results = self.indexpage._check_for_expected_assets()
         self.assertTrue(results)
+
+    @override_settings(FILE_COPY_CHUNK_SIZE=1024)
+    def test_pageasset_instantiate__chunked(self):
+        content = os.urandom(10 * 1024 + 7)
+        asset = PageAsset(
+            page=self.indexpage,
+            file_type='pdf',
+            filename='brochure.pdf',
+            relative_path='docs',
+            file_content=SimpleUploadedFile(name='brochure.pdf', content=content, content_type='application/pdf'),
+            created_by=self.system_admin_user,
+            updated_by=self.system_admin_user
+        )
+        asset.save()
+        with TemporaryDirectory(prefix='pageasset-test-') as tempdir:
+            output_filepath = asset.instantiate(Path(tempdir))
+            self.assertEqual(output_filepath, Path(tempdir) / 'docs' / 'brochure.pdf')
+            self.assertEqual(output_filepath.read_bytes(), content)
@@ -0,0 +1,115 @@
+import socket
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import TestCase
+from django.conf import settings
+
+from ..rendering import PageRenderer, close_database_connections, get_render_mp_context
+from ..sinks import MemorySink
+from ..transforms import normalize_transforms
+
+MYSQL_COM_QUIT_PACKET = b'\x01\x00\x00\x00\x01'
+
+
+class FakeMySQLConnection:
+    """DB-API connection sending COM_QUIT to the server on close (or garbage collection), as mysqlclient does"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+
+    def close(self):
+        if not self.closed and self.sock.fileno() != -1:
+            self.closed = True
+            self.sock.sendall(MYSQL_COM_QUIT_PACKET)
+
+    def __del__(self):
+        self.close()
+
+
+class FakeDatabaseWrapper:
+
+    def __init__(self, connection: FakeMySQLConnection, in_atomic_block: bool = False):
+        self.connection = connection
+        self.in_atomic_block = in_atomic_block
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class PageRendererTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client_socket, self.server_socket = socket.socketpair()
+        self.server_socket.setblocking(False)
+
+    def tearDown(self) -> None:
+        self.client_socket.close()
+        self.server_socket.close()
+
+    def _get_received(self) -> bytes:
+        try:
+            return self.server_socket.recv(1024)
+        except BlockingIOError:
+            return b''
+
+    def test_render__workers_do_not_use_parent_connections(self):
+        self.assertNotEqual(get_render_mp_context().get_start_method(), 'fork')
+
+        # connection of the parent process, left open while in a transaction
+        wrapper = FakeDatabaseWrapper(FakeMySQLConnection(self.client_socket), in_atomic_block=True)
+        with mock.patch('staticsites.rendering.connections') as mock_connections:
+            mock_connections.all.return_value = [wrapper]
+            with MemorySink() as sink:
+                with PageRenderer(max_processes=2, min_pool_pages=0) as renderer:
+                    for i in range(4):
+                        renderer.render(None, '<p>{{ i }}</p>', {'i': i}, sink, Path(f'page-{i}.html'))
+                self.assertEqual(sink.get_content(Path('page-3.html')), b'<p>3</p>')
+        # workers did not inherit (and close) the parent connection
+        self.assertEqual(self._get_received(), b'')
+        self.assertIsNotNone(wrapper.connection)
+
+    def test_close_database_connections(self):
+        wrapper = FakeDatabaseWrapper(FakeMySQLConnection(self.client_socket))
+        with mock.patch('staticsites.rendering.connections') as mock_connections:
+            mock_connections.all.return_value = [wrapper]
+            close_database_connections()
+        self.assertIsNone(wrapper.connection)
+        self.assertEqual(self._get_received(), MYSQL_COM_QUIT_PACKET)
+
+    def test_write__transformed_in_workers(self):
+        with MemorySink(transforms=normalize_transforms(settings.SYNC_TRANSFORMS)) as sink:
+            with PageRenderer(max_processes=2, min_pool_pages=0) as renderer:
+                renderer.write(sink, Path('css', 'style.css'), b'a {\n  color: red;\n}\n', settings.SYNC_IMMUTABLE_CACHE_CONTROL)
+                renderer.write(sink, Path('imgs', 'a.png'), b'\x89PNG  ')
+            self.assertEqual(sink.get_content(Path('css', 'style.css')), b'a{color:red}')
+            self.assertEqual(sink.files['css/style.css'].cache_control, settings.SYNC_IMMUTABLE_CACHE_CONTROL)
+            self.assertEqual(sink.get_content(Path('imgs', 'a.png')), b'\x89PNG  ')
+
+    def test_render__pool_started_lazily(self):
+        # worker threads stand in for the worker processes
+        with mock.patch('staticsites.rendering.ProcessPoolExecutor', side_effect=lambda **kwargs: ThreadPoolExecutor(max_workers=2)) as mock_executor_class:
+            with MemorySink() as sink:
+                with PageRenderer(max_processes=2, min_pool_pages=2) as renderer:
+                    # small sites are rendered in the current process
+                    for i in range(2):
+                        renderer.render(None, '<p>{{ i }}</p>', {'i': i}, sink, Path(f'page-{i}.html'))
+                    mock_executor_class.assert_not_called()
+                    self.assertEqual(sink.get_content(Path('page-1.html')), b'<p>1</p>')
+
+                    renderer.render(None, '<p>{{ i }}</p>', {'i': 2}, sink, Path('page-2.html'))
+                    mock_executor_class.assert_called_once()
+                    self.assertIsNotNone(renderer.executor)
+                self.assertEqual(sink.get_content(Path('page-2.html')), b'<p>2</p>')
+
+    def test_render__process_pool_unavailable(self):
+        with mock.patch('staticsites.rendering.ProcessPoolExecutor', side_effect=OSError(38, 'Function not implemented')):
+            with MemorySink() as sink:
+                with PageRenderer(max_processes=2, min_pool_pages=0) as renderer:
+                    self.assertIsNone(renderer.executor)
+                    renderer.render(None, '<p>{{ i }}</p>', {'i': 1}, sink, Path('page.html'))
+                self.assertEqual(sink.get_content(Path('page.html')), b'<p>1</p>')
@@ -0,0 +1,227 @@
+import io
+import gzip
+import hashlib
+import threading
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase
+from django.template import TemplateSyntaxError
+from django.conf import settings
+
+import boto3
+
+from ..sinks import FilesystemSink, MemorySink, S3Sink
+from ..transfers import upload_fileobj_with_retry
+
+S3_CLIENT = boto3.client(
+    's3',
+    endpoint_url=settings.BOTO3_ENDPOINTS['s3'],
+)
+
+
+class BuildSinksTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.bucket_name = 'staticsite-sinks-test'
+        S3_CLIENT.create_bucket(
+            Bucket=self.bucket_name
+        )
+        contents = S3_CLIENT.list_objects(Bucket=self.bucket_name)
+        if 'Contents' in contents:
+            S3_CLIENT.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': obj['Key']} for obj in contents['Contents']]}
+            )
+
+    def _get_objects(self) -> dict:
+        contents = S3_CLIENT.list_objects(Bucket=self.bucket_name).get('Contents', [])
+        return {obj['Key']: obj['ETag'].strip('"') for obj in contents}
+
+    def test_filesystem_sink(self):
+        content = b'x' * 1000
+        with FilesystemSink(prefix='sinks-test-') as sink:
+            build_file = sink.write_fileobj(Path('imgs', 'a.jpg'), io.BytesIO(content), chunk_size=64)
+            absolute_filepath = sink.get_absolute_filepath(Path('imgs', 'a.jpg'))
+            self.assertEqual(absolute_filepath.read_bytes(), content)
+            self.assertEqual(build_file.md5, hashlib.md5(content).hexdigest())
+            self.assertEqual(build_file.size, len(content))
+
+            summary = sink.upload(S3_CLIENT, self.bucket_name)
+            self.assertEqual(summary.transferred, [Path('imgs', 'a.jpg')])
+        # temporary directory is removed on close
+        self.assertFalse(absolute_filepath.exists())
+        self.assertEqual(self._get_objects(), {'imgs/a.jpg': build_file.md5})
+
+    def test_memory_sink__changed_files(self):
+        with MemorySink() as sink:
+            index_file = sink.write_text(Path('index.html'), '<html></html>')
+            sink.write_text(Path('news', 'news_0.html'), '<html>news</html>')
+            self.assertEqual(sink.get_content(Path('index.html')), b'<html></html>')
+
+            existing_etags = {'index.html': index_file.md5}
+            changed_files = sink.get_changed_files(existing_etags)
+            self.assertEqual([f.key for f in changed_files], ['news/news_0.html'])
+
+            summary = sink.upload(S3_CLIENT, self.bucket_name, existing_etags)
+            self.assertEqual(summary.transferred, [Path('news', 'news_0.html')])
+        response = S3_CLIENT.head_object(Bucket=self.bucket_name, Key='news/news_0.html')
+        self.assertEqual(response['ContentType'], 'text/html')
+
+    def test_memory_sink__compressed(self):
+        html = '<html>' + 'compressible ' * 100 + '</html>'
+        image_content = b'\xff\xd8' + b'x' * 100
+        with MemorySink(content_encoding='gzip') as sink:
+            index_file = sink.write_text(Path('index.html'), html)
+            image_file = sink.write(Path('imgs', 'a.jpg'), image_content)
+            self.assertEqual(index_file.content_encoding, 'gzip')
+            self.assertLess(index_file.size, len(html))
+            self.assertIsNone(image_file.content_encoding)
+            self.assertEqual(sink.get_content(Path('imgs', 'a.jpg')), image_content)
+            summary = sink.upload(S3_CLIENT, self.bucket_name)
+            self.assertEqual(len(summary.transferred), 2)
+
+        response = S3_CLIENT.get_object(Bucket=self.bucket_name, Key='index.html')
+        self.assertEqual(response['ContentEncoding'], 'gzip')
+        self.assertEqual(response['ContentType'], 'text/html')
+        self.assertEqual(response['CacheControl'], settings.SYNC_HTML_CACHE_CONTROL)
+        self.assertEqual(response['ETag'].strip('"'), index_file.md5)
+        self.assertEqual(gzip.decompress(response['Body'].read()).decode('utf8'), html)
+
+        response = S3_CLIENT.get_object(Bucket=self.bucket_name, Key='imgs/a.jpg')
+        self.assertNotIn('ContentEncoding', response)
+        self.assertEqual(response['CacheControl'], settings.SYNC_ASSET_CACHE_CONTROL)
+        self.assertEqual(response['Body'].read(), image_content)
+
+    def test_filesystem_sink__compressed_fileobj(self):
+        content = b'body { color: black; }\n' * 100
+        with FilesystemSink(prefix='sinks-test-', content_encoding='gzip') as sink:
+            build_file = sink.write_fileobj(Path('css', 'style.css'), io.BytesIO(content), chunk_size=64)
+            stored_content = sink.get_absolute_filepath(Path('css', 'style.css')).read_bytes()
+            self.assertEqual(gzip.decompress(stored_content), content)
+            self.assertEqual(build_file.md5, hashlib.md5(stored_content).hexdigest())
+            sink.upload(S3_CLIENT, self.bucket_name)
+        response = S3_CLIENT.head_object(Bucket=self.bucket_name, Key='css/style.css')
+        self.assertEqual(response['ContentEncoding'], 'gzip')
+        self.assertEqual(response['ContentType'], 'text/css')
+
+    def test_s3_sink__uploads_on_write(self):
+        unchanged_content = b'unchanged'
+        S3_CLIENT.put_object(Bucket=self.bucket_name, Key='unchanged.txt', Body=unchanged_content)
+        existing_etags = self._get_objects()
+
+        with S3Sink(S3_CLIENT, self.bucket_name, existing_etags, max_workers=2) as sink:
+            for i in range(5):
+                sink.write_text(Path(f'page-{i}.html'), f'<html>{i}</html>')
+            sink.write(Path('unchanged.txt'), unchanged_content)
+            progress = []
+            summary = sink.upload(S3_CLIENT, self.bucket_name, existing_etags, progress_callback=progress.append)
+            self.assertEqual(len(sink.files), 6)
+
+        self.assertFalse(summary.failed)
+        self.assertEqual(set(summary.transferred), set(Path(f'page-{i}.html') for i in range(5)))
+        self.assertEqual(set(progress), set(summary.transferred))
+        objects = self._get_objects()
+        self.assertEqual(set(objects.keys()), set([f'page-{i}.html' for i in range(5)] + ['unchanged.txt']))
+
+        with S3Sink(S3_CLIENT, self.bucket_name) as sink:
+            with self.assertRaises(ValueError):
+                sink.upload(S3_CLIENT, 'other-bucket')
+
+    def test_s3_sink__streams_fileobj(self):
+        content = b'\xff\xd8' + b'x' * 1000
+        with S3Sink(S3_CLIENT, self.bucket_name, content_encoding='gzip') as sink:
+            with mock.patch('staticsites.sinks.upload_fileobj_with_retry', wraps=upload_fileobj_with_retry) as mock_upload_fileobj:
+                # stored as is, streamed from a spooled file rather than read into memory
+                image_file = sink.write_fileobj(Path('imgs', 'a.jpg'), io.BytesIO(content), chunk_size=64)
+                css_file = sink.write_fileobj(Path('css', 'style.css'), io.BytesIO(b'a { color: red; }'), chunk_size=64)
+                summary = sink.upload(S3_CLIENT, self.bucket_name)
+            mock_upload_fileobj.assert_called_once()  # compressed css is put from memory
+        self.assertEqual(set(summary.transferred), {Path('imgs', 'a.jpg'), Path('css', 'style.css')})
+        self.assertEqual(summary.total_bytes, image_file.size + css_file.size)
+        self.assertEqual(self._get_objects(), {'imgs/a.jpg': hashlib.md5(content).hexdigest(), 'css/style.css': css_file.md5})
+        response = S3_CLIENT.get_object(Bucket=self.bucket_name, Key='imgs/a.jpg')
+        self.assertEqual(response['ContentType'], 'image/jpeg')
+        self.assertEqual(response['Body'].read(), content)
+
+    def test_s3_sink__backpressure(self):
+        upload_started = threading.Event()
+        release_uploads = threading.Event()
+        client = mock.Mock()
+
+        def put_object(**kwargs):
+            upload_started.set()
+            release_uploads.wait(timeout=10)
+
+        client.put_object.side_effect = put_object
+        with S3Sink(client, self.bucket_name, max_workers=1, max_pending=1) as sink:
+            sink.write_text(Path('page-0.html'), '0')  # taken by the upload worker
+            self.assertTrue(upload_started.wait(timeout=10))
+            sink.write_text(Path('page-1.html'), '1')  # fills the queue
+
+            # queue is full, the next write blocks until an upload completes
+            writer = threading.Thread(target=sink.write_text, args=(Path('page-2.html'), '2'))
+            writer.start()
+            writer.join(timeout=0.2)
+            self.assertTrue(writer.is_alive())
+
+            release_uploads.set()
+            writer.join(timeout=10)
+            self.assertFalse(writer.is_alive())
+            summary = sink.upload(client, self.bucket_name)
+        self.assertEqual(len(summary.transferred), 3)
+        self.assertEqual(client.put_object.call_count, 3)
+
+    def test_s3_sink__failed_render_discards_queued(self):
+        upload_started = threading.Event()
+        release_uploads = threading.Event()
+        client = mock.Mock()
+
+        def put_object(**kwargs):
+            upload_started.set()
+            release_uploads.wait(timeout=10)
+
+        client.put_object.side_effect = put_object
+        with self.assertRaises(TemplateSyntaxError):
+            with S3Sink(client, self.bucket_name, max_workers=1) as sink:
+                sink.write_text(Path('page-0.html'), '0')  # taken by the upload worker
+                self.assertTrue(upload_started.wait(timeout=10))
+                sink.write_text(Path('page-1.html'), '1')
+                sink.write_fileobj(Path('imgs', 'a.jpg'), io.BytesIO(b'\xff\xd8'))
+                # the upload in progress completes once the queue is discarded
+                threading.Timer(0.2, release_uploads.set).start()
+                raise TemplateSyntaxError('failed render')
+
+        self.assertEqual([call[1]['Key'] for call in client.put_object.call_args_list], ['page-0.html'])
+        client.upload_fileobj.assert_not_called()
+        self.assertEqual(sink._pending_bytes, 0)
+        self.assertFalse(sink._workers)
+
+    def test_s3_sink__backpressure_bytes(self):
+        upload_started = threading.Event()
+        release_uploads = threading.Event()
+        client = mock.Mock()
+
+        def put_object(**kwargs):
+            upload_started.set()
+            release_uploads.wait(timeout=10)
+
+        client.put_object.side_effect = put_object
+        with S3Sink(client, self.bucket_name, max_workers=1, max_pending=32, max_pending_bytes=10) as sink:
+            sink.write(Path('a.txt'), b'x' * 8)
+            self.assertTrue(upload_started.wait(timeout=10))
+
+            # pending bytes would exceed max_pending_bytes, the write blocks until the upload completes
+            writer = threading.Thread(target=sink.write, args=(Path('b.txt'), b'y' * 8))
+            writer.start()
+            writer.join(timeout=0.2)
+            self.assertTrue(writer.is_alive())
+
+            release_uploads.set()
+            writer.join(timeout=10)
+            self.assertFalse(writer.is_alive())
+            # larger than max_pending_bytes, queued once the pending uploads complete
+            sink.write(Path('c.txt'), b'z' * 100)
+            summary = sink.upload(client, self.bucket_name)
+        self.assertEqual(len(summary.transferred), 3)
+        self.assertEqual(sink._pending_bytes, 0)
@@ -0,0 +1,53 @@
+from pathlib import Path
+from unittest import mock
+from functools import partial
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase
+from django.conf import settings
+
+import boto3
+from botocore.exceptions import ClientError
+
+from ..transfers import run_transfers, upload_file_with_retry
+
+S3_CLIENT = boto3.client(
+    's3',
+    endpoint_url=settings.BOTO3_ENDPOINTS['s3'],
+)
+
+
+class TransfersTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.bucket_name = 'staticsite-transfers-test'
+        S3_CLIENT.create_bucket(
+            Bucket=self.bucket_name
+        )
+
+    def test_upload_file_with_retry(self):
+        error = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}}, 'PutObject')
+        client = mock.Mock()
+        client.upload_file.side_effect = [error, error, None]
+        with TemporaryDirectory(prefix='transfers-test-') as tempdir:
+            absolute_filepath = Path(tempdir) / 'index.html'
+            absolute_filepath.write_text('<html></html>')
+            transferred_bytes = upload_file_with_retry(
+                client,
+                absolute_filepath,
+                self.bucket_name,
+                'index.html',
+                max_retries=2,
+                backoff_seconds=0
+            )
+            self.assertEqual(transferred_bytes, len('<html></html>'))
+            self.assertEqual(client.upload_file.call_count, 3)
+
+            # retries exhausted, failure is collected in summary
+            client.upload_file.reset_mock()
+            client.upload_file.side_effect = error
+            upload = partial(upload_file_with_retry, client, absolute_filepath, self.bucket_name, 'index.html', max_retries=1, backoff_seconds=0)
+            summary = run_transfers([(Path('index.html'), upload)])
+            self.assertFalse(summary.transferred)
+            self.assertEqual(len(summary.failed), 1)
+            self.assertEqual(client.upload_file.call_count, 2)
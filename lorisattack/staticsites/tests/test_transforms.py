@@ -0,0 +1,105 @@
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase
+from django.conf import settings
+
+from ..rendering import PageRenderer
+from ..sinks import MemorySink
+from ..transforms import (
+    TRANSFORM_CACHE,
+    get_file_transforms,
+    minify_css,
+    minify_html,
+    minify_js,
+    normalize_transforms,
+    transform_text,
+)
+
+STATICSITES_FIXTURES_DIRECTORY = Path(__file__).parent.parent / 'fixtures'
+
+
+class TransformsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        TRANSFORM_CACHE.clear()
+        self.transforms = normalize_transforms(settings.SYNC_TRANSFORMS)
+
+    def test_minify_html(self):
+        html = (
+            '<!DOCTYPE html>\n<html>\n  <head>\n    <!-- comment -->\n    <!--[if lt IE 9]><script src="x.js"></script><![endif]-->\n'
+            '    <style>\n  body { color: red; }\n</style>\n  </head>\n'
+            '  <body>\n    <p>Hello,\n       world</p>\n    <pre>\n  keep   this\n</pre>\n'
+            '    <script>\n  var a = "  x  ";\n</script>\n  </body>\n</html>\n'
+        )
+        self.assertEqual(
+            minify_html(html),
+            '<!DOCTYPE html> <html> <head> <!--[if lt IE 9]><script src="x.js"></script><![endif]--> '
+            '<style>\n  body { color: red; }\n</style> </head> '
+            '<body> <p>Hello, world</p> <pre>\n  keep   this\n</pre> '
+            '<script>\n  var a = "  x  ";\n</script> </body> </html>'
+        )
+
+    def test_minify_css(self):
+        css = (
+            '/*! license */\n/* comment */\n'
+            'a :hover,\nb > c {\n  color: red;\n  width: calc(100% - 10px);\n'
+            '  content: "  a;}  ";\n  background: url( "x y.png" );\n}\n'
+            '@media screen and (max-width: 600px) {\n  a { color: blue; }\n}\n'
+        )
+        self.assertEqual(
+            minify_css(css),
+            '/*! license */ '
+            'a :hover,b>c{color:red;width:calc(100% - 10px);content:"  a;}  ";background:url("x y.png")}'
+            '@media screen and (max-width:600px){a{color:blue}}'
+        )
+
+    def test_minify_js(self):
+        js = (
+            '/*! license */\n// comment\nfunction add(a, b) {\n    /* block */\n    return a + +b;  // trailing\n}\n\n'
+            'var url = "http://example.com"; // not a comment in the string\n'
+            'var re = /\\/\\/ [/]/g, half = 4 / 2 / 1;\n'
+            'var t = `multi\n    line`\n'
+            'if (re.test(url)) { return /x/i }\n'
+        )
+        self.assertEqual(
+            minify_js(js),
+            '/*! license */\nfunction add(a, b) {\nreturn a + +b;\n}\n'
+            'var url = "http://example.com";\n'
+            'var re = /\\/\\/ [/]/g, half = 4 / 2 / 1;\n'
+            'var t = `multi\n    line`\n'
+            'if (re.test(url)) { return /x/i }'
+        )
+
+    def test_transform_text__cached(self):
+        self.assertEqual(get_file_transforms(Path('css', 'style.css'), self.transforms), ('staticsites.transforms.minify_css',))
+        # files minified by the author are not transformed
+        self.assertEqual(get_file_transforms(Path('css', 'bootstrap3.min.css'), self.transforms), ())
+        self.assertEqual(get_file_transforms(Path('imgs', 'a.png'), self.transforms), ())
+
+        css = (STATICSITES_FIXTURES_DIRECTORY / 'assets' / 'style.css').read_text()
+        transform_paths = ('staticsites.transforms.minify_css',)
+        with mock.patch('staticsites.transforms.load_transform', return_value=minify_css) as mock_load_transform:
+            self.assertEqual(transform_text(css, transform_paths), minify_css(css))
+            self.assertEqual(transform_text(css, transform_paths), minify_css(css))
+            mock_load_transform.assert_called_once_with('staticsites.transforms.minify_css')
+
+        # failing transforms fall back to the untransformed text
+        with mock.patch('staticsites.transforms.load_transform', return_value=mock.Mock(side_effect=ValueError)):
+            self.assertEqual(transform_text('a { }', ('failing',)), 'a { }')
+
+    def test_sink__transformed(self):
+        html = '<html>\n  <body>\n    <!-- comment -->\n  </body>\n</html>\n'
+        with MemorySink(transforms=self.transforms) as sink:
+            build_file = sink.write_text(Path('index.html'), html)
+            self.assertEqual(sink.get_content(Path('index.html')), b'<html> <body> </body> </html>')
+            self.assertEqual(build_file.size, len(b'<html> <body> </body> </html>'))
+            self.assertFalse(sink.is_stored_as_is(Path('css', 'style.css')))
+            self.assertTrue(sink.is_stored_as_is(Path('imgs', 'a.png')))
+
+            # rendered (and transformed) in the render worker processes
+            with PageRenderer(max_processes=2, min_pool_pages=0) as renderer:
+                for i in range(3):
+                    renderer.render(None, '<p>\n  {{ i }}\n</p>', {'i': i}, sink, Path(f'page-{i}.html'))
+            for i in range(3):
+                self.assertEqual(sink.get_content(Path(f'page-{i}.html')), f'<p> {i} </p>'.encode('utf8'))
@@ -0,0 +1,383 @@
+import io
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.db.models.fields.files import FieldFile
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+logger = logging.getLogger(__name__)
+
+HASH_READ_CHUNK_SIZE = 1024 * 1024
+S3_DELETE_OBJECTS_MAX_KEYS = 1000  # delete_objects() accepts at most 1000 keys per request
+# user metadata of server-side copied objects holding the sha256 of the content (x-amz-meta-sha256)
+FILE_HASH_METADATA_KEY = 'sha256'
+
+RETRYABLE_EXCEPTIONS = (
+    BotoCoreError,
+    ClientError,
+    S3UploadFailedError,
+)
+
+
+class TransferError(Exception):
+    """Raised when one or more files could not be transferred after all retries"""
+
+    def __init__(self, message: str, failed: List[Tuple[Path, Exception]]):
+        super().__init__(message)
+        self.failed = failed
+
+
+class TransferSummary:
+    """Aggregated result of a multi-file transfer"""
+
+    def __init__(self) -> None:
+        self.transferred = []  # type: List[Path]
+        self.failed = []  # type: List[Tuple[Path, Exception]]
+        self.total_bytes = 0
+        self.elapsed_seconds = 0.0
+
+    def __repr__(self) -> str:
+        return f'TransferSummary(transferred={len(self.transferred)}, failed={len(self.failed)}, total_bytes={self.total_bytes})'
+
+
+def call_with_retry(func: Callable[[], int],
+                    description: str,
+                    max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                    backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS) -> int:
+    """Call the given transfer function, retrying with exponential backoff on failure"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except RETRYABLE_EXCEPTIONS as e:
+            if attempt >= max_retries:
+                raise
+            wait_seconds = backoff_seconds * (2 ** attempt)
+            attempt += 1
+            logger.warning(f'{description} failed ({e}), retrying ({attempt}/{max_retries}) in {wait_seconds}s ...')
+            time.sleep(wait_seconds)
+
+
+def upload_file_with_retry(client: Any,
+                           absolute_filepath: Path,
+                           bucket_name: str,
+                           key: str,
+                           max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                           backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS,
+                           extra_args: Optional[dict] = None) -> int:
+    """
+    Upload a single file, retrying with exponential backoff on failure
+    If given, extra_args (ContentType, ContentEncoding, CacheControl, ...) are set on the uploaded object
+    Returns the number of bytes transferred
+    """
+    def upload() -> int:
+        logger.info(f'Uploading file ({absolute_filepath}) to: s3://{bucket_name}/{key}')
+        client.upload_file(
+            str(absolute_filepath),
+            Bucket=bucket_name,
+            Key=key,
+            ExtraArgs=extra_args or None
+        )
+        return absolute_filepath.stat().st_size
+
+    return call_with_retry(upload, f'Upload of ({key})', max_retries, backoff_seconds)
+
+
+def put_object_with_retry(client: Any,
+                          content: bytes,
+                          bucket_name: str,
+                          key: str,
+                          content_type: Optional[str] = None,
+                          max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                          backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS,
+                          extra_args: Optional[dict] = None) -> int:
+    """
+    Upload the given in-memory content as a single object, retrying with exponential backoff on failure
+    If given, extra_args (ContentEncoding, CacheControl, ...) are set on the uploaded object
+    Returns the number of bytes transferred
+    """
+    extra_args = dict(extra_args or {})
+    if content_type:
+        extra_args['ContentType'] = content_type
+
+    def put() -> int:
+        logger.info(f'Uploading ({len(content)} bytes) to: s3://{bucket_name}/{key}')
+        client.put_object(
+            Body=content,
+            Bucket=bucket_name,
+            Key=key,
+            **extra_args
+        )
+        return len(content)
+
+    return call_with_retry(put, f'Upload of ({key})', max_retries, backoff_seconds)
+
+
+def upload_fileobj_with_retry(client: Any,
+                              fileobj: BinaryIO,
+                              bucket_name: str,
+                              key: str,
+                              max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                              backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS,
+                              extra_args: Optional[dict] = None) -> int:
+    """
+    Stream the content of the given (seekable) file object as a single object, retrying with exponential backoff on failure
+    If given, extra_args (ContentType, ContentEncoding, CacheControl, ...) are set on the uploaded object
+    Returns the number of bytes transferred
+
+    > upload_fileobj() reads the file in chunks (multipart upload for large files), the content is not held in memory
+    """
+    def upload() -> int:
+        size = fileobj.seek(0, io.SEEK_END)
+        fileobj.seek(0)
+        logger.info(f'Uploading ({size} bytes) to: s3://{bucket_name}/{key}')
+        client.upload_fileobj(
+            fileobj,
+            Bucket=bucket_name,
+            Key=key,
+            ExtraArgs=extra_args or None
+        )
+        return size
+
+    return call_with_retry(upload, f'Upload of ({key})', max_retries, backoff_seconds)
+
+
+def copy_object_with_retry(client: Any,
+                           source_bucket_name: str,
+                           source_key: str,
+                           bucket_name: str,
+                           key: str,
+                           size: int = 0,
+                           content_type: Optional[str] = None,
+                           max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                           backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS,
+                           cache_control: Optional[str] = None,
+                           metadata: Optional[Dict[str, str]] = None) -> int:
+    """
+    Server-side copy a single object between buckets, retrying with exponential backoff on failure
+    If content_type (cache_control or user metadata) is given, the object metadata is replaced to set the ContentType
+    (CacheControl and Metadata), otherwise the metadata of the source object is kept
+    Returns the given object size
+
+    > copy_object() supports objects up to 5GB
+    """
+    extra_args = {}  # type: Dict[str, Any]
+    if content_type:
+        extra_args = {'MetadataDirective': 'REPLACE', 'ContentType': content_type}
+    if cache_control:
+        extra_args.update({'MetadataDirective': 'REPLACE', 'CacheControl': cache_control})
+    if metadata:
+        extra_args.update({'MetadataDirective': 'REPLACE', 'Metadata': metadata})
+
+    def copy() -> int:
+        logger.info(f'Copying s3://{source_bucket_name}/{source_key} to: s3://{bucket_name}/{key}')
+        client.copy_object(
+            CopySource={'Bucket': source_bucket_name, 'Key': source_key},
+            Bucket=bucket_name,
+            Key=key,
+            **extra_args
+        )
+        return size
+
+    return call_with_retry(copy, f'Copy of ({key})', max_retries, backoff_seconds)
+
+
+def run_transfers(tasks: Iterable[Tuple[Path, Callable[[], int]]],
+                  max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                  progress_callback: Optional[Callable[[Path], None]] = None) -> TransferSummary:
+    """
+    Run the given (relative_filepath, TRANSFER_FUNCTION) tasks using a bounded thread pool.
+    TRANSFER_FUNCTION is expected to return the number of bytes transferred.
+    If given, progress_callback is called (in the calling thread) with the relative_filepath of each finished task.
+
+    > Failures are collected in the resulting summary, they are *NOT* raised
+    """
+    summary = TransferSummary()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(func): relative_filepath for relative_filepath, func in tasks}
+        for future in as_completed(futures):
+            relative_filepath = futures[future]
+            try:
+                summary.total_bytes += future.result()
+                summary.transferred.append(relative_filepath)
+            except RETRYABLE_EXCEPTIONS as e:
+                logger.error(f'Transfer of ({relative_filepath}) failed: {e}')
+                summary.failed.append((relative_filepath, e))
+            if progress_callback:
+                progress_callback(relative_filepath)
+    summary.elapsed_seconds = time.perf_counter() - start
+    return summary
+
+
+def copy_objects(client: Any,
+                 bucket_name: str,
+                 copies: Iterable[dict],
+                 max_workers: int = settings.S3_UPLOAD_MAX_WORKERS,
+                 max_retries: int = settings.S3_UPLOAD_MAX_RETRIES,
+                 backoff_seconds: float = settings.S3_UPLOAD_RETRY_BACKOFF_SECONDS,
+                 progress_callback: Optional[Callable[[Path], None]] = None) -> TransferSummary:
+    """
+    Server-side copy the given objects to the target bucket using a bounded thread pool.
+    copies are dictionaries containing 'relative_path' (used as the object key), 'source_bucket', 'source_key'
+    and optionally 'size', 'content_type', 'cache_control' and 'file_hash' (set as the FILE_HASH_METADATA_KEY object metadata).
+
+    > Failures are collected in the resulting summary, they are *NOT* raised
+    """
+    tasks = (
+        (
+            copy['relative_path'],
+            partial(
+                copy_object_with_retry,
+                client,
+                copy['source_bucket'],
+                copy['source_key'],
+                bucket_name,
+                str(copy['relative_path']),
+                copy.get('size', 0),
+                copy.get('content_type'),
+                max_retries,
+                backoff_seconds,
+                copy.get('cache_control'),
+                {FILE_HASH_METADATA_KEY: copy['file_hash']} if copy.get('file_hash') else None
+            )
+        )
+        for copy in copies
+    )
+    summary = run_transfers(tasks, max_workers, progress_callback)
+    logger.info(f'Copied {len(summary.transferred)} objects ({summary.total_bytes} bytes) to s3://{bucket_name} '
+                f'in {summary.elapsed_seconds:.2f}s')
+    return summary
+
+
+def head_objects(client: Any, locations: Iterable[Tuple[str, str]], max_workers: int = settings.S3_UPLOAD_MAX_WORKERS) -> Dict[Tuple[str, str], dict]:
+    """
+    Get the metadata of the given (bucket_name, key) objects using a bounded thread pool
+    Returns a {(BUCKET_NAME, KEY): {'etag': ETAG, 'size': SIZE, 'content_type': CONTENT_TYPE, 'metadata': METADATA}} dictionary
+    """
+    def head(bucket_name: str, key: str) -> dict:
+        response = client.head_object(Bucket=bucket_name, Key=key)
+        return {
+            'etag': response['ETag'].strip('"'),
+            'size': response['ContentLength'],
+            'content_type': response.get('ContentType'),
+            'metadata': response.get('Metadata', {}),
+        }
+
+    locations = set(locations)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {location: executor.submit(head, *location) for location in locations}
+        return {location: future.result() for location, future in futures.items()}
+
+
+def get_storage_location(fieldfile: FieldFile) -> Optional[Tuple[str, str]]:
+    """
+    Get the (bucket_name, key) of the given FieldFile if it is stored in an S3 bucket (django-storages S3Boto3Storage)
+    Returns None for files in other storage backends
+    """
+    return get_storage_name_location(fieldfile.storage, fieldfile.name)
+
+
+def get_storage_name_location(storage: Storage, name: str) -> Optional[Tuple[str, str]]:
+    """
+    Get the (bucket_name, key) of the named file in the given storage if it is an S3 bucket (django-storages S3Boto3Storage)
+    Returns None for other storage backends
+    """
+    bucket_name = getattr(storage, 'bucket_name', None)
+    if not bucket_name or not name:
+        return None
+    key = storage._normalize_name(storage._clean_name(name))
+    return bucket_name, key
+
+
+def get_storage_name_copy(storage: Storage,
+                          name: str,
+                          relative_path: Path,
+                          source_type: str,
+                          source_id: Optional[int],
+                          file_hash: Optional[str] = None) -> Optional[dict]:
+    """
+    Get the server-side copy definition of the named file in the given storage to relative_path in the site bucket
+    If given, the file_hash (sha256 of the file content) is recorded on the copied object to detect unchanged copies
+    Returns None if the storage is not an S3 bucket
+    """
+    location = get_storage_name_location(storage, name)
+    if not location:
+        return None
+    source_bucket, source_key = location
+    storage_copy = {
+        'relative_path': relative_path,
+        'source_bucket': source_bucket,
+        'source_key': source_key,
+        'source_type': source_type,
+        'source_id': source_id,
+    }
+    if file_hash:
+        storage_copy['file_hash'] = file_hash
+    return storage_copy
+
+
+def calculate_sha256(fileobj: BinaryIO) -> str:
+    """Calculate the hex sha256 digest of the given file object content"""
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_READ_CHUNK_SIZE), b''):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def list_bucket_objects(client: Any, bucket_name: str) -> Dict[str, dict]:
+    """
+    List all objects in the given bucket
+    Returns a {KEY: {'etag': ETAG, 'size': SIZE}} dictionary, where ETAG is unquoted
+    """
+    objects = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = {
+                'etag': obj['ETag'].strip('"'),
+                'size': obj['Size'],
+            }
+    return objects
+
+
+def list_bucket_etags(client: Any, bucket_name: str) -> Dict[str, str]:
+    """
+    List all objects in the given bucket
+    Returns a {KEY: ETAG} dictionary, where ETAG is unquoted
+
+    > ETags of multipart uploads contain a '-' suffix and will never match a file md5
+    """
+    return {key: obj['etag'] for key, obj in list_bucket_objects(client, bucket_name).items()}
+
+
+def delete_keys(client: Any, bucket_name: str, keys: Iterable[str]) -> List[str]:
+    """Delete the given keys from the bucket, returning the deleted keys"""
+    keys = list(keys)
+    deleted_keys = []  # type: List[str]
+    for offset in range(0, len(keys), S3_DELETE_OBJECTS_MAX_KEYS):
+        batch = keys[offset: offset + S3_DELETE_OBJECTS_MAX_KEYS]
+        logger.info(f'Deleting {len(batch)} stale objects from s3://{bucket_name} ...')
+        response = client.delete_objects(
+            Bucket=bucket_name,
+            Delete={
+                'Objects': [{'Key': key} for key in batch],
+                'Quiet': True,
+            }
+        )
+        errors = response.get('Errors', [])
+        for error in errors:
+            logger.error(f'Failed to delete s3://{bucket_name}/{error["Key"]}: {error.get("Message")}')
+        failed_keys = set(error['Key'] for error in errors)
+        deleted_keys.extend(key for key in batch if key not in failed_keys)
+    return deleted_keys
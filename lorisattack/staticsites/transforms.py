@@ -0,0 +1,273 @@
+"""
+Transforms applied to the text of synced files (before compression), configured per content type by settings.SYNC_TRANSFORMS:
+
+    {CONTENT_TYPE: [DOTTED_PATH, ...]}
+
+where each transform is a function taking and returning the file text (see minify_html(), minify_css() and minify_js())
+
+> Minifiers are conservative: they remove comments and redundant whitespace, identifiers are *NOT* renamed
+"""
+import re
+import hashlib
+import logging
+import mimetypes
+from pathlib import Path
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .caches import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+Transform = Callable[[str], str]
+# {CONTENT_TYPE: (DOTTED_PATH, ...)}
+Transforms = Dict[str, Tuple[str, ...]]
+
+# files already minified by the author are not transformed
+MINIFIED_FILENAME_PATTERN = re.compile(r'[.-]min\.[^.]+$')
+
+TRANSFORM_CACHE = LRUCache(maxsize=settings.SYNC_TRANSFORM_CACHE_MAXSIZE)
+
+# comments, elements with whitespace-sensitive (or non-html) content, and tags
+HTML_TOKEN_PATTERN = re.compile(
+    r'<!--.*?-->|<(pre|textarea|script|style)\b.*?</\1\s*>|<[^>]*>',
+    re.IGNORECASE | re.DOTALL
+)
+# conditional comments are kept
+HTML_KEPT_COMMENT_PREFIXES = ('<!--[if', '<!--<![endif]', '<!-->')
+
+# comments, strings and url() values
+CSS_TOKEN_PATTERN = re.compile(
+    r'''/\*.*?(?:\*/|$)|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|url\(\s*[^'"\s)][^)]*\)''',
+    re.DOTALL | re.IGNORECASE
+)
+CSS_PUNCTUATION_SPACE_PATTERN = re.compile(r'\s*([{};,>~])\s*')
+CSS_COLON_SPACE_PATTERN = re.compile(r':\s+')
+CSS_PARENTHESIS_SPACE_PATTERN = re.compile(r'\(\s+|\s+\)')
+
+# a '/' following these characters (or keywords) starts a regular expression literal, otherwise it is a division
+JS_REGEX_PRECEDING_CHARACTERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_PRECEDING_KEYWORDS = {
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else', 'yield', 'await',
+}
+JS_WHITESPACE = set(' \t\r\n\f\v\u00a0\ufeff')
+
+
+def normalize_transforms(transforms: Optional[Mapping[str, Iterable[str]]]) -> Transforms:
+    """Normalize the given {CONTENT_TYPE: [DOTTED_PATH, ...]} transforms configuration (see settings.SYNC_TRANSFORMS)"""
+    return {content_type: tuple(paths) for content_type, paths in (transforms or {}).items() if paths}
+
+
+def get_file_transforms(relative_filepath: Path, transforms: Transforms) -> Tuple[str, ...]:
+    """Get the transforms (dotted paths) applied to the given file, by its content type"""
+    if not transforms or MINIFIED_FILENAME_PATTERN.search(Path(relative_filepath).name):
+        return ()
+    content_type, _ = mimetypes.guess_type(str(relative_filepath))
+    if not content_type:
+        return ()
+    return transforms.get(content_type, ())
+
+
+@lru_cache(maxsize=None)
+def load_transform(dotted_path: str) -> Transform:
+    return import_string(dotted_path)
+
+
+def transform_text(text: str, transform_paths: Tuple[str, ...]) -> str:
+    """
+    Apply the given transforms (dotted paths) to text, in order
+    Results are cached process-wide keyed by (TRANSFORM_PATHS, TEXT_HASH), so unchanged files are transformed once.
+
+    > If a transform fails the untransformed text is used
+    """
+    if not transform_paths:
+        return text
+    key = (transform_paths, hashlib.sha256(text.encode('utf8')).hexdigest())
+    transformed = TRANSFORM_CACHE.get(key)
+    if transformed is None:
+        transformed = text
+        for dotted_path in transform_paths:
+            try:
+                transformed = load_transform(dotted_path)(transformed)
+            except Exception as e:
+                logger.warning(f'Transform ({dotted_path}) failed, using untransformed text: {e}')
+                transformed = text
+                break
+        TRANSFORM_CACHE.set(key, transformed)
+    return transformed
+
+
+def transform_content(content: bytes, transform_paths: Tuple[str, ...]) -> bytes:
+    """Apply the given transforms to the utf8 encoded content (see transform_text()), content that is not utf8 is returned as is"""
+    if not transform_paths:
+        return content
+    try:
+        text = content.decode('utf8')
+    except UnicodeDecodeError:
+        logger.warning(f'Content is not utf8, skipping transforms: {transform_paths}')
+        return content
+    return transform_text(text, transform_paths).encode('utf8')
+
+
+def _collapse_whitespace(text: str) -> str:
+    return re.sub(r'\s+', ' ', text)
+
+
+def minify_html(html: str) -> str:
+    """
+    Remove comments (other than conditional comments) and collapse whitespace between tags to a single space
+    > Tags, and the content of pre, textarea, script and style elements are kept as is
+    """
+    output = []  # type: List[str]
+    text = ''  # text between kept tokens, including the text around removed comments
+    position = 0
+    for match in HTML_TOKEN_PATTERN.finditer(html):
+        text += html[position:match.start()]
+        position = match.end()
+        token = match.group(0)
+        if token.startswith('<!--') and not token.startswith(HTML_KEPT_COMMENT_PREFIXES):
+            continue
+        output.extend((_collapse_whitespace(text), token))
+        text = ''
+    output.append(_collapse_whitespace(text + html[position:]))
+    return ''.join(output).strip()
+
+
+def _minify_css_segment(css: str) -> str:
+    css = _collapse_whitespace(css)
+    css = CSS_PUNCTUATION_SPACE_PATTERN.sub(r'\1', css)
+    # 'a :hover' (descendant) differs from 'a:hover', only the space after ':' is removed
+    css = CSS_COLON_SPACE_PATTERN.sub(':', css)
+    css = CSS_PARENTHESIS_SPACE_PATTERN.sub(lambda match: match.group(0).strip(), css)
+    return css.replace(';}', '}')
+
+
+def minify_css(css: str) -> str:
+    """
+    Remove comments (other than /*! license comments) and redundant whitespace
+    > Strings and url() values are kept as is, and spaces around '+'/'-' are kept (calc() expressions)
+    """
+    output = []  # type: List[str]
+    segment = ''  # css between kept tokens, including the css around removed comments
+    position = 0
+    for match in CSS_TOKEN_PATTERN.finditer(css):
+        segment += css[position:match.start()]
+        position = match.end()
+        token = match.group(0)
+        if token.startswith('/*') and not token.startswith('/*!'):
+            continue
+        output.extend((_minify_css_segment(segment), token))
+        segment = ''
+    output.append(_minify_css_segment(segment + css[position:]))
+    return ''.join(output).strip()
+
+
+def _find_js_string_end(js: str, start: int) -> int:
+    """Get the end index of the string (or template) literal starting at start"""
+    quote = js[start]
+    i = start + 1
+    while i < len(js):
+        c = js[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == quote:
+            return i + 1
+        if c == '\n' and quote != '`':
+            return i  # unterminated
+        i += 1
+    return len(js)
+
+
+def _find_js_regex_end(js: str, start: int) -> int:
+    """Get the end index of the regular expression literal (including flags) starting at start"""
+    i = start + 1
+    in_class = False
+    while i < len(js):
+        c = js[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            return i  # unterminated
+        if in_class:
+            in_class = c != ']'
+        elif c == '[':
+            in_class = True
+        elif c == '/':
+            i += 1
+            while i < len(js) and _is_js_identifier_character(js[i]):
+                i += 1
+            return i
+        i += 1
+    return len(js)
+
+
+def _is_js_identifier_character(c: str) -> bool:
+    return c.isalnum() or c in '_$'
+
+
+def _is_js_regex_start(previous_token: str) -> bool:
+    """True if a '/' following the given (non-whitespace) token starts a regular expression literal"""
+    if not previous_token:
+        return True
+    return previous_token[-1] in JS_REGEX_PRECEDING_CHARACTERS or previous_token in JS_REGEX_PRECEDING_KEYWORDS
+
+
+def minify_js(js: str) -> str:
+    """
+    Remove comments (other than /*! license comments), indentation, trailing whitespace and blank lines,
+    and collapse other whitespace to a single space
+    > Line breaks are kept, so that automatic semicolon insertion is not affected
+    """
+    output = []  # type: List[str]
+    previous_token = ''
+    pending_space = False
+    pending_newline = False
+    i = 0
+    while i < len(js):
+        c = js[i]
+        if c in JS_WHITESPACE:
+            pending_newline = pending_newline or c == '\n'
+            pending_space = True
+            i += 1
+            continue
+
+        if c == '/' and js.startswith('//', i):
+            end = js.find('\n', i)
+            i = len(js) if end == -1 else end
+            continue
+        if c == '/' and js.startswith('/*', i) and not js.startswith('/*!', i):
+            end = js.find('*/', i + 2)
+            end = len(js) if end == -1 else end + 2
+            # a comment containing a line break is a line terminator
+            pending_newline = pending_newline or '\n' in js[i:end]
+            pending_space = True
+            i = end
+            continue
+
+        if pending_space and output:
+            output.append('\n' if pending_newline else ' ')
+        pending_space = pending_newline = False
+
+        if c in '"\'`':
+            end = _find_js_string_end(js, i)
+        elif c == '/' and js.startswith('/*!', i):
+            end = js.find('*/', i + 3)
+            end = len(js) if end == -1 else end + 2
+        elif c == '/' and _is_js_regex_start(previous_token):
+            end = _find_js_regex_end(js, i)
+        elif _is_js_identifier_character(c):
+            end = i + 1
+            while end < len(js) and _is_js_identifier_character(js[end]):
+                end += 1
+        else:
+            end = i + 1
+        previous_token = js[i:end]
+        output.append(previous_token)
+        i = end
+    return ''.join(output)